@@ -0,0 +1,267 @@
+# agendador_envios.py — ritmo dos envios para a Graph API (token bucket + prioridades)
+# ==============================================================================
+# Respostas de conversa, alertas de handoff e disparos de campanha disputam a mesma
+# vazão do número na Meta. Aqui cada phone_number_id tem um balde de tokens:
+#   - INTERATIVO / HANDOFF pegam token assim que existir um
+#   - CAMPANHA só consome acima de uma reserva e para enquanto houver conversa esperando
+# Um 429 / 130429 derruba a taxa pela metade; sucessos a recuperam aos poucos.
+#
+# Os baldes são do processo: com N workers do gunicorn cada um fica com WA_MPS / N
+# (N = WA_PROCESSOS, por padrão o mesmo WEB_CONCURRENCY que o gunicorn usa para
+# decidir quantos workers subir), para o número não passar de WA_MPS no total.
+#
+# A fila de campanha fica numa outbox SQLite (CAMPANHA_OUTBOX_PATH): o Apps Script
+# recebe 200 assim que o disparo está no disco, e um restart não perde o que
+# estava na fila. Workers que apontam para o mesmo arquivo dividem os disparos
+# (cada um reserva o que vai enviar, por CAMPANHA_RESERVA_S). Se o processo cair
+# no meio de um envio, a reserva vence e aquele disparo sai de novo.
+# Erros temporários são repetidos com backoff; o que sobrar vai para a fila morta.
+# Só se repete o que a Meta certamente não recebeu (ver falhas_envio.classificar).
+import os, threading, time
+from typing import Optional
+from uuid import uuid4
+
+from caixa_saida import CaixaSaida
+from falhas_envio import FilaMorta, OK, TEMPORARIO, WA_TENTATIVAS, classificar, espera_backoff
+from metricas import Estatistica
+from whatsapp_client import RespostaEnvio, WhatsAppClient, cliente
+
+INTERATIVO, HANDOFF, CAMPANHA = 0, 1, 2
+_NOMES = {INTERATIVO: "interativo", HANDOFF: "handoff", CAMPANHA: "campanha"}
+
+WA_PROCESSOS        = max(1, int(os.getenv("WA_PROCESSOS", os.getenv("WEB_CONCURRENCY", "1"))))
+WA_MPS              = float(os.getenv("WA_MPS", "80")) / WA_PROCESSOS   # mensagens/s por número, neste processo
+WA_MPS_MIN          = float(os.getenv("WA_MPS_MIN", "1"))
+WA_RESERVA_CAMPANHA = float(os.getenv("WA_RESERVA_CAMPANHA", "0.3"))  # fração do balde
+CAMPANHA_FILA_MAX   = int(os.getenv("CAMPANHA_FILA_MAX", "5000"))
+CAMPANHA_OUTBOX_PATH = os.getenv("CAMPANHA_OUTBOX_PATH", "campanhas.sqlite3").strip()   # vazio = só memória
+CAMPANHA_LOTE        = int(os.getenv("CAMPANHA_LOTE", "5"))           # reservados por vez (cabem na reserva)
+CAMPANHA_VARREDURA_S = float(os.getenv("CAMPANHA_VARREDURA_S", "15"))
+CAMPANHA_RESERVA_S   = float(os.getenv("CAMPANHA_RESERVA_S", "120"))   # worker que cai libera o lote depois disso
+
+# Códigos da Graph API que significam "vá mais devagar"
+CODIGOS_THROTTLE = {4, 80007, 130429, 131048, 131056}
+
+
+class BaldeTokens:
+    """Token bucket com taxa adaptativa (AIMD)."""
+
+    def __init__(self, taxa: float = WA_MPS, taxa_min: float = WA_MPS_MIN):
+        self.taxa_max = taxa
+        self.taxa_min = min(taxa_min, taxa)
+        self.taxa = taxa
+        self.capacidade = max(1.0, taxa)
+        self.tokens = self.capacidade
+        self._ultimo = time.monotonic()
+        self.throttles = 0
+
+    def _repor(self, agora: float):
+        self.tokens = min(self.capacidade, self.tokens + (agora - self._ultimo) * self.taxa)
+        self._ultimo = agora
+
+    def tentar(self, reserva: float = 0.0) -> float:
+        """Consome 1 token e retorna 0, ou retorna quantos segundos esperar."""
+        agora = time.monotonic()
+        self._repor(agora)
+        piso = reserva * self.capacidade
+        if self.tokens - 1 >= piso:
+            self.tokens -= 1
+            return 0.0
+        return (piso + 1 - self.tokens) / self.taxa
+
+    def penalizar(self):
+        self.throttles += 1
+        self.taxa = max(self.taxa_min, self.taxa / 2)
+        self.tokens = min(self.tokens, 0.0)
+
+    def recompensar(self):
+        if self.taxa < self.taxa_max:
+            self.taxa = min(self.taxa_max, self.taxa + self.taxa_max * 0.02)
+
+
+class AgendadorEnvios:
+
+    def __init__(self, cliente_wa: Optional[WhatsAppClient] = None):
+        self._cliente = cliente_wa
+        self._lock = threading.Lock()
+        self._baldes = {}
+        self._interativos_esperando = 0
+        self.campanhas = CaixaSaida(CAMPANHA_OUTBOX_PATH, max_itens=CAMPANHA_FILA_MAX,
+                                    reserva_s=CAMPANHA_RESERVA_S)
+        self._campanha_nova = threading.Event()
+        self._retomar_no_fork = False
+        self._thread = None
+        self._pid = None
+
+        self.fila_morta = FilaMorta()
+        self.enviados = {n: 0 for n in _NOMES.values()}
+        self.reenvios = 0
+        self.sucesso_apos_reenvio = 0
+        self.falhas = {"temporario": 0, "permanente": 0, "incerto": 0}
+        self.espera_ms = {n: Estatistica() for n in _NOMES.values()}
+        self.campanhas_rejeitadas = 0
+
+    @property
+    def cliente(self) -> WhatsAppClient:
+        return self._cliente or cliente()
+
+    def _balde(self, phone_number_id: str) -> BaldeTokens:
+        balde = self._baldes.get(phone_number_id)
+        if balde is None:
+            balde = self._baldes[phone_number_id] = BaldeTokens()
+        return balde
+
+    # ===== Envio síncrono (qualquer prioridade) ===============================
+    def enviar(self, payload, prioridade: int = INTERATIVO, tipo: Optional[str] = None,
+               timeout: Optional[float] = None, registrar_falha: bool = True) -> RespostaEnvio:
+        """payload: dict ou bytes pré-serializados (ver catalogo_mensagens.py)."""
+        wa = self.cliente
+        if isinstance(payload, dict):
+            tipo = tipo or payload.get("type")
+        tipo = tipo or "text"
+        if not wa.configurado():
+            print("[MOCK→WA]", tipo)
+            return RespostaEnvio(ok=False, erro_msg="WhatsApp não configurado")
+
+        tentativas = max(1, WA_TENTATIVAS)
+        for tentativa in range(tentativas):
+            self._aguardar_token(wa.phone_number_id, prioridade)
+            resp = wa.enviar(payload, tipo=tipo, timeout=timeout)
+            self.observar(wa.phone_number_id, resp)
+            classe = classificar(resp)
+            if classe == OK:
+                if tentativa:
+                    self.sucesso_apos_reenvio += 1
+                break
+            if classe != TEMPORARIO or tentativa == tentativas - 1:
+                break
+            self.reenvios += 1
+            time.sleep(espera_backoff(tentativa))
+
+        self.enviados[_NOMES[prioridade]] += 1
+        if classe != OK:
+            self.falhas[classe] += 1
+            if registrar_falha:
+                self.fila_morta.registrar(payload, tipo, prioridade, resp, classe, tentativa + 1)
+        return resp
+
+    def _aguardar_token(self, phone_number_id: str, prioridade: int):
+        inicio = time.monotonic()
+        urgente = prioridade != CAMPANHA
+        reserva = 0.0 if urgente else WA_RESERVA_CAMPANHA
+        if urgente:
+            with self._lock:
+                self._interativos_esperando += 1
+        try:
+            while True:
+                with self._lock:
+                    if not urgente and self._interativos_esperando:
+                        espera = 0.05
+                    else:
+                        espera = self._balde(phone_number_id).tentar(reserva)
+                if espera <= 0:
+                    break
+                time.sleep(min(espera, 1.0))
+        finally:
+            if urgente:
+                with self._lock:
+                    self._interativos_esperando -= 1
+        self.espera_ms[_NOMES[prioridade]].registrar((time.monotonic() - inicio) * 1000)
+
+    def observar(self, phone_number_id: str, resp: RespostaEnvio):
+        """Ajusta a taxa do número conforme a resposta da Meta."""
+        with self._lock:
+            balde = self._balde(phone_number_id)
+            if resp.status_code == 429 or resp.erro_codigo in CODIGOS_THROTTLE:
+                balde.penalizar()
+                print(f"🐢 [ENVIOS] throttle da Meta ({resp.erro_codigo or resp.status_code}) — "
+                      f"taxa agora {balde.taxa:.1f} msg/s")
+            elif resp.ok:
+                balde.recompensar()
+
+    # ===== Campanha (fila em background) ======================================
+    def enfileirar_campanha(self, payload: dict, tipo: str = "campanha") -> bool:
+        """Grava o disparo na outbox; False = fila cheia (quem chamou devolve 503)."""
+        self._garantir_thread()
+        if self.campanhas.cheia():
+            self.campanhas_rejeitadas += 1
+            print(f"⚠️ [ENVIOS] fila de campanha cheia ({CAMPANHA_FILA_MAX})")
+            return False
+        self.campanhas.gravar(f"campanha-{uuid4().hex}", {"payload": payload, "tipo": tipo}, reservar=False)
+        self._campanha_nova.set()
+        return True
+
+    def retomar_campanhas(self):
+        """
+        Sobe o envio de campanha se ficou fila de um processo anterior. Chamado uma
+        vez na subida do processo; em quem faz fork depois (gunicorn --preload),
+        roda de novo em cada filho.
+        """
+        if not self._retomar_no_fork:
+            self._retomar_no_fork = True
+            if hasattr(os, "register_at_fork"):
+                os.register_at_fork(after_in_child=self.retomar_campanhas)
+        if os.path.exists(CAMPANHA_OUTBOX_PATH):
+            self._garantir_thread()
+
+    def _garantir_thread(self):
+        pid = os.getpid()
+        if self._pid == pid:
+            return
+        with self._lock:
+            if self._pid == pid:
+                return
+            self._thread = threading.Thread(target=self._loop_campanha, name="campanha", daemon=True)
+            self._thread.start()
+            self._pid = pid
+
+    def _loop_campanha(self):
+        while True:
+            self._campanha_nova.clear()
+            try:
+                itens = self.campanhas.reservar(CAMPANHA_LOTE)
+            except Exception as e:
+                print("❌ [ENVIOS] erro ao ler a fila de campanha:", e)
+                itens = []
+            if not itens:
+                self._campanha_nova.wait(CAMPANHA_VARREDURA_S)
+                continue
+            for chave, item in itens:
+                payload = item["payload"]
+                try:
+                    r = self.enviar(payload, prioridade=CAMPANHA, tipo=item["tipo"])
+                    print("📤 CAMPANHA:", payload.get("to"), r.status_code, r.erro_codigo or "")
+                except Exception as e:
+                    print("❌ [ENVIOS] erro no disparo de campanha:", e)
+                    self.campanhas.adiar([chave], CAMPANHA_VARREDURA_S, str(e))
+                    continue
+                # enviado ou registrado na fila morta: sai da fila de campanha
+                self.campanhas.confirmar([chave])
+
+    # ===== Observabilidade ====================================================
+    def metricas(self) -> dict:
+        with self._lock:
+            baldes = {
+                pid: {"taxa_msg_s": round(b.taxa, 2), "tokens": round(b.tokens, 1), "throttles": b.throttles}
+                for pid, b in self._baldes.items()
+            }
+        return {
+            "baldes": baldes,
+            "processos": WA_PROCESSOS,
+            "campanha_pendentes": self.campanhas.pendentes()[0],
+            "campanhas_rejeitadas": self.campanhas_rejeitadas,
+            "enviados": dict(self.enviados),
+            "reenvios": self.reenvios,
+            "sucesso_apos_reenvio": self.sucesso_apos_reenvio,
+            "falhas": dict(self.falhas),
+            "fila_morta": self.fila_morta.metricas(),
+            "espera_token_ms": {n: e.resumo() for n, e in self.espera_ms.items()},
+        }
+
+
+# ===== Instância compartilhada ===============================================
+_AGENDADOR = AgendadorEnvios()
+
+
+def agendador() -> AgendadorEnvios:
+    return _AGENDADOR
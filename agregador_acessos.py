@@ -0,0 +1,118 @@
+# agregador_acessos.py — contagem em memória de eventos de acesso (acesso_inicial, acesso_endereco)
+# ==============================================================================
+# São eventos de muito volume e pouco valor individual: em vez de uma linha no
+# Sheets por evento, conta-se por (tipo, especialidade, hora) somando todos os
+# contatos, e cada hora fechada sai numa linha-resumo com a quantidade ("qtd") e
+# quantos contatos distintos ("contatos"). A varredura roda a cada ACESSOS_FLUSH_S,
+# mas só emite horas já encerradas; a hora corrente só sai no encerramento.
+#
+# message_id estável por (tipo, especialidade, hora, processo): o reenvio da
+# outbox é idempotente, e workers diferentes não se sobrepõem.
+# ACESSOS_MODO=evento mantém uma linha por evento (granularidade antiga).
+import os, atexit, threading, time
+from datetime import datetime
+from typing import Callable, Dict, Tuple
+
+from zoneinfo import ZoneInfo
+
+ACESSOS_MODO    = os.getenv("ACESSOS_MODO", "resumo").strip().lower()   # "resumo" ou "evento"
+ACESSOS_FLUSH_S = float(os.getenv("ACESSOS_FLUSH_S", "300"))
+
+_TZ_SP = ZoneInfo("America/Sao_Paulo")   # a hora do resumo é a da clínica, não a do servidor
+
+
+def _hora_atual() -> str:
+    return datetime.now(_TZ_SP).strftime("%Y-%m-%d %H:00")
+
+
+class _Contagem:
+    __slots__ = ("qtd", "contatos", "primeiro", "ultimo")
+
+    def __init__(self, ts: str):
+        self.qtd = 0
+        self.contatos = set()
+        self.primeiro = ts
+        self.ultimo = ts
+
+
+class AgregadorAcessos:
+    """emitir(registro) recebe cada linha-resumo (ex.: _post_webapp)."""
+
+    def __init__(self, emitir: Callable[[dict], object], intervalo_s: float = ACESSOS_FLUSH_S):
+        self._emitir = emitir
+        self.intervalo_s = intervalo_s
+        self._contagens: Dict[Tuple[str, str, str], _Contagem] = {}
+        self._lock = threading.Lock()
+        self._pid = None
+
+        self.eventos = 0
+        self.eventos_resumidos = 0
+        self.resumos = 0
+        atexit.register(self.descarregar)
+
+    def _garantir_thread(self):
+        pid = os.getpid()
+        if self._pid == pid:
+            return
+        with self._lock:
+            if self._pid == pid:
+                return
+            threading.Thread(target=self._loop, name="acessos", daemon=True).start()
+            self._pid = pid
+
+    def contar(self, tipo: str, especialidade: str, contato: str, whatsapp_nome: str, timestamp_local: str):
+        self._garantir_thread()
+        chave = (tipo, especialidade or "", _hora_atual())
+        with self._lock:
+            c = self._contagens.get(chave)
+            if c is None:
+                c = self._contagens[chave] = _Contagem(timestamp_local)
+            c.qtd += 1
+            c.contatos.add(contato)
+            c.ultimo = timestamp_local
+            self.eventos += 1
+
+    def _loop(self):
+        while True:
+            time.sleep(self.intervalo_s)
+            self.descarregar(so_fechadas=True)
+
+    def descarregar(self, so_fechadas: bool = False):
+        """Emite as horas pendentes; so_fechadas=True deixa a hora corrente acumulando."""
+        atual = _hora_atual()
+        with self._lock:
+            prontas = [k for k in self._contagens if not so_fechadas or k[2] < atual]
+            contagens = [(k, self._contagens.pop(k)) for k in prontas]
+        pid = os.getpid()
+        for (tipo, especialidade, hora), c in contagens:
+            message_id = f"resumo-{tipo}-{especialidade}-{hora.replace(' ', 'T')}-{pid}"
+            if hora >= atual:   # hora ainda aberta (encerramento): o que vier depois do restart é outra linha
+                message_id += f"-parcial-{int(time.time())}"
+            try:
+                self._emitir({
+                    "tipo": tipo,
+                    "especialidade": especialidade,
+                    "contato": "",
+                    "whatsapp_nome": "",
+                    "timestamp_local": c.primeiro,
+                    "qtd": c.qtd,
+                    "contatos": len(c.contatos),
+                    "periodo": hora,
+                    "ultimo_timestamp_local": c.ultimo,
+                    "message_id": message_id,
+                })
+                self.resumos += 1
+                self.eventos_resumidos += c.qtd
+            except Exception as e:
+                print(f"❌ [ACESSOS] erro ao emitir resumo {tipo} {especialidade} {hora}:", e)
+
+    def metricas(self) -> dict:
+        with self._lock:
+            pendentes = len(self._contagens)
+        return {
+            "modo": ACESSOS_MODO,
+            "eventos": self.eventos,
+            "resumos": self.resumos,
+            "chaves_pendentes": pendentes,
+            "linhas_economizadas": self.eventos_resumidos - self.resumos,
+        }
@@ -0,0 +1,180 @@
+# agrupador_rajadas.py — junta textos em sequência do mesmo paciente num único turno
+# ==============================================================================
+# Ex.: "oi" / "quero consulta" / "dermato" digitados em 2s viram UM turno
+# "oi\nquero consulta\ndermato" → uma execução do responder, um acesso no Sheets
+# e no máximo uma chamada ao Claude.
+#
+# Desligado por padrão: com DEBOUNCE_MS > 0 toda mensagem de texto, mesmo sozinha,
+# espera a janela antes de o bot começar a responder. Vale ligar (ex.: 1500) só
+# se as rajadas forem frequentes a ponto de compensar essa latência.
+import os, threading, time
+
+from eventos_meta import EventoEntrada
+
+DEBOUNCE_MS       = int(os.getenv("DEBOUNCE_MS", "0"))       # 0 = desligado (padrão)
+DEBOUNCE_MAX_MS   = int(os.getenv("DEBOUNCE_MAX_MS", "5000")) # espera máxima desde a 1ª msg
+DEBOUNCE_MAX_MSGS = int(os.getenv("DEBOUNCE_MAX_MSGS", "6"))
+
+
+class _Rajada:
+    __slots__ = ("eventos", "primeira", "prazo")
+
+    def __init__(self, agora: float):
+        self.eventos = []
+        self.primeira = agora
+        self.prazo = agora
+
+
+class AgrupadorRajadas:
+    """
+    Segura mensagens de texto por wa_id durante janela_ms após a última recebida.
+    Qualquer mensagem que não seja texto (botão, áudio, imagem) esvazia a rajada
+    pendente antes de seguir, preservando a ordem.
+
+    Toda entrega acontece com o lock do agrupador: nada do mesmo wa_id passa na
+    frente de uma rajada que está saindo. Se o despacho recusar uma rajada (fila
+    cheia), ela volta para a espera e sai de novo depois — as mensagens dela já
+    receberam 200, então não podem ser descartadas.
+
+    despachar(ev) -> bool é quem entrega o turno (ex.: ExecutorPorRemetente).
+    contadores (opcional) é o CONTADORES do responder, usado para estimar a economia.
+    """
+
+    def __init__(self, despachar, janela_ms: int = DEBOUNCE_MS, max_ms: int = DEBOUNCE_MAX_MS,
+                 max_msgs: int = DEBOUNCE_MAX_MSGS, contadores: dict = None):
+        self._despachar = despachar
+        self.janela = janela_ms / 1000
+        self.max_espera = max(janela_ms, max_ms) / 1000
+        self.max_msgs = max(1, max_msgs)
+        self._contadores = contadores
+        self._rajadas = {}
+        self._cond = threading.Condition()
+        self._thread = None
+        self._pid = None
+
+        self.recebidas = 0
+        self.turnos = 0
+        self.agrupadas = 0        # mensagens que deixaram de gerar turno próprio
+        self.rejeitados = 0
+        self.reenfileiradas = 0
+
+    # ===== Entrada ============================================================
+    def adicionar(self, ev: EventoEntrada) -> bool:
+        """Retorna False só quando o despacho imediato foi recusado (fila cheia)."""
+        self.recebidas += 1
+        if self.janela <= 0:
+            return self._entregar(ev)
+
+        if ev.tipo != "text":
+            with self._cond:
+                rajada = self._rajadas.pop(ev.wa_id, None)
+                if rajada and not self._entregar(self._fundir(rajada.eventos)):
+                    # a rajada continua na frente; este evento volta para a Meta (503)
+                    self._devolver(ev.wa_id, rajada.eventos)
+                    return False
+                return self._entregar(ev)
+
+        self._garantir_thread()
+        agora = time.monotonic()
+        with self._cond:
+            rajada = self._rajadas.get(ev.wa_id)
+            if rajada is None:
+                rajada = _Rajada(agora)
+                self._rajadas[ev.wa_id] = rajada
+            rajada.eventos.append(ev)
+            rajada.prazo = min(agora + self.janela, rajada.primeira + self.max_espera)
+            if len(rajada.eventos) < self.max_msgs:
+                self._cond.notify()
+                return True
+            del self._rajadas[ev.wa_id]
+            if self._entregar(self._fundir(rajada.eventos)):
+                return True
+            # recusada: o que já tinha recebido 200 volta a esperar; este evento vai para a Meta (503)
+            self._devolver(ev.wa_id, rajada.eventos[:-1])
+            return False
+
+    # ===== Fusão / entrega ====================================================
+    def _fundir(self, eventos) -> EventoEntrada:
+        if len(eventos) == 1:
+            return eventos[0]
+        primeiro, ultimo = eventos[0], eventos[-1]
+        corpo = "\n".join(((e.msg.get("text") or {}).get("body") or "").strip() for e in eventos)
+        msg = dict(ultimo.msg)
+        msg["text"] = {"body": corpo.strip()}
+        msg["_agrupadas"] = len(eventos)
+        print(f"🧩 [RAJADA] {len(eventos)} mensagens de {primeiro.wa_id} num único turno")
+        return EventoEntrada(primeiro.wa_id, ultimo.nome or primeiro.nome, ultimo.message_id,
+                             "text", msg, primeiro.phone_number_id)
+
+    def _devolver(self, wa_id: str, eventos):
+        """Recoloca eventos recusados na frente da rajada do wa_id (chamado com o lock)."""
+        if not eventos:
+            return
+        agora = time.monotonic()
+        rajada = self._rajadas.get(wa_id)
+        if rajada is None:
+            rajada = self._rajadas[wa_id] = _Rajada(agora)
+        rajada.eventos[:0] = eventos
+        rajada.primeira = agora
+        rajada.prazo = agora + max(self.janela, 1.0)   # tenta de novo depois
+        self.reenfileiradas += 1
+        self._cond.notify()
+
+    def _entregar(self, ev: EventoEntrada) -> bool:
+        ok = self._despachar(ev)
+        if ok:
+            self.turnos += 1
+            self.agrupadas += ev.msg.get("_agrupadas", 1) - 1
+        else:
+            self.rejeitados += 1
+        return ok
+
+    # ===== Temporizador (uma thread para todos os pacientes) ==================
+    def _garantir_thread(self):
+        pid = os.getpid()
+        if self._pid == pid:
+            return
+        with self._cond:
+            if self._pid == pid:
+                return
+            self._thread = threading.Thread(target=self._loop, name="agrupador", daemon=True)
+            self._thread.start()
+            self._pid = pid
+
+    def _loop(self):
+        while True:
+            with self._cond:
+                agora = time.monotonic()
+                vencidas = [k for k, r in self._rajadas.items() if r.prazo <= agora]
+                prontas = [self._rajadas.pop(k) for k in vencidas]
+                if not prontas:
+                    proximo = min((r.prazo for r in self._rajadas.values()), default=None)
+                    self._cond.wait(None if proximo is None else max(0.0, proximo - agora))
+                    continue
+                # entrega ainda com o lock: um botão do mesmo wa_id não passa na frente
+                for wa_id, rajada in zip(vencidas, prontas):
+                    try:
+                        ok = self._entregar(self._fundir(rajada.eventos))
+                    except Exception as e:
+                        print("❌ [RAJADA] erro ao despachar:", e)
+                        ok = False
+                    if not ok:
+                        self._devolver(wa_id, rajada.eventos)
+
+    # ===== Observabilidade ====================================================
+    def metricas(self) -> dict:
+        m = {
+            "janela_ms": int(self.janela * 1000),
+            "pendentes": len(self._rajadas),
+            "recebidas": self.recebidas,
+            "turnos": self.turnos,
+            "turnos_economizados": self.agrupadas,
+            "rejeitados": self.rejeitados,
+            "reenfileiradas": self.reenfileiradas,
+        }
+        c = self._contadores
+        if c and c.get("turnos"):
+            # custo médio observado por turno × turnos que deixaram de existir
+            m["ia_chamadas_economizadas_est"] = round(self.agrupadas * c["ia_chamadas"] / c["turnos"], 1)
+            m["envios_economizados_est"] = round(self.agrupadas * c["envios"] / c["turnos"], 1)
+        return m
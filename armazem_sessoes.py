@@ -0,0 +1,498 @@
+# armazem_sessoes.py — estado de conversa compartilhado entre workers (memória, SQLite WAL ou Redis)
+# ==============================================================================
+# SESS, ULTIMO_ACESSO e _HIST_IA eram dicts do processo: com mais de um worker do
+# gunicorn, a segunda mensagem do paciente podia cair num worker que nunca viu o
+# "stage" dele. Aqui o estado vive num armazém com get / put / CAS por wa_id:
+#
+#   SESSAO_BACKEND=memoria   (padrão) dict do processo — um worker só, como antes
+#   SESSAO_BACKEND=sqlite    arquivo local em WAL (SESSAO_SQLITE_PATH) — vários workers na mesma máquina
+#   SESSAO_BACKEND=redis     servidor Redis (SESSAO_REDIS_URL) — vários workers/máquinas; precisa do pacote `redis`
+#
+# O código do bot continua usando SESS[wa] / SESS.get(wa) (MapaSessoes). Durante
+# um turno (turno(): uma mensagem processada), o que for lido fica num cache local
+# da thread; no fim do turno só o que mudou é gravado, com CAS pela versão lida.
+# Turnos do mesmo wa_id são serializados entre workers por uma trava no armazém
+# (travar/liberar, com prazo SESSAO_TRAVA_S); o CAS só falha se a trava venceu no
+# meio do turno, e aí o estado gravado pelo outro worker é mantido.
+#
+# Expiração: cada gravação carimba o prazo (agora + ttl_s do espaço). Sessões
+# paradas além do prazo somem sozinhas — ninguém precisa lembrar de "last_at".
+import os, json, sqlite3, threading, time
+from collections import OrderedDict
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Any, Dict, Optional, Tuple
+
+SESSAO_BACKEND     = os.getenv("SESSAO_BACKEND", "memoria").strip().lower()
+SESSAO_SQLITE_PATH = os.getenv("SESSAO_SQLITE_PATH", "sessoes.sqlite3").strip()
+SESSAO_REDIS_URL   = os.getenv("SESSAO_REDIS_URL", "redis://localhost:6379/0").strip()
+SESSAO_PREFIXO     = os.getenv("SESSAO_PREFIXO", "clinica").strip()
+SESSAO_VARREDURA_S = float(os.getenv("SESSAO_VARREDURA_S", "60"))   # sqlite: limpeza dos expirados
+SESSAO_TRAVA_S     = float(os.getenv("SESSAO_TRAVA_S", "30"))       # duração máxima de um turno
+SESSAO_TRAVA_ESPERA_S = float(os.getenv("SESSAO_TRAVA_ESPERA_S", "10"))
+
+
+# ===== Serialização (datetime de last_at vira {"__dt__": iso}) ================
+# Classes com formato próprio (ex.: sessao.Sessao) se registram com
+# registrar_tipo: viram {cls._etiqueta: obj.para_json()} e voltam por cls.de_json.
+_TIPOS: Dict[str, Any] = {}
+
+
+def registrar_tipo(cls):
+    _TIPOS[cls._etiqueta] = cls
+    return cls
+
+
+def _padrao(obj):
+    etiqueta = getattr(obj.__class__, "_etiqueta", None)
+    if etiqueta in _TIPOS:
+        return {etiqueta: obj.para_json()}
+    if isinstance(obj, datetime):
+        return {"__dt__": obj.isoformat()}
+    raise TypeError(f"tipo não serializável na sessão: {type(obj).__name__}")
+
+
+def _gancho(d):
+    if len(d) == 1:
+        if "__dt__" in d:
+            return datetime.fromisoformat(d["__dt__"])
+        for etiqueta, valor in d.items():
+            cls = _TIPOS.get(etiqueta)
+            if cls is not None:
+                return cls.de_json(valor)
+    return d
+
+
+def serializar(valor) -> str:
+    return json.dumps(valor, ensure_ascii=False, separators=(",", ":"), default=_padrao)
+
+
+def desserializar(texto):
+    return json.loads(texto, object_hook=_gancho)
+
+
+# ===== Backends ==============================================================
+class ArmazemMemoria:
+    """
+    dict do processo. Guarda o próprio objeto (sem cópia), igual aos dicts antigos.
+
+    Prazos num OrderedDict por espaço, em ordem de gravação: como o ttl é o mesmo
+    para o espaço inteiro, a ordem de gravação já é a ordem de vencimento (faz o
+    papel de um min-heap). Regravar move a chave para o fim e expirar só olha a
+    frente — O(1) amortizado, sem varrer as sessões.
+    """
+    compartilhado = False
+    nome = "memoria"
+
+    def __init__(self):
+        self._dados: Dict[Tuple[str, str], Tuple[int, Any]] = {}
+        self._prazos: Dict[str, OrderedDict] = {}   # espaco -> chave -> expira_em
+        self._qtd: Dict[str, int] = {}
+        self._lock = threading.Lock()
+        self.expiradas: Dict[str, int] = {}
+
+    def _gravar(self, espaco, chave, versao, valor, ttl_s):
+        # chamado com self._lock adquirido
+        if (espaco, chave) not in self._dados:
+            self._qtd[espaco] = self._qtd.get(espaco, 0) + 1
+        self._dados[(espaco, chave)] = (versao, valor)
+        if ttl_s:
+            prazos = self._prazos.setdefault(espaco, OrderedDict())
+            prazos[chave] = time.time() + ttl_s
+            prazos.move_to_end(chave)
+        elif espaco in self._prazos:
+            self._prazos[espaco].pop(chave, None)
+
+    def _remover(self, espaco, chave):
+        # chamado com self._lock adquirido
+        if self._dados.pop((espaco, chave), None) is not None:
+            self._qtd[espaco] -= 1
+        prazos = self._prazos.get(espaco)
+        if prazos:
+            prazos.pop(chave, None)
+
+    def _expirar(self, agora: float):
+        # chamado com self._lock adquirido
+        for espaco, prazos in self._prazos.items():
+            while prazos:
+                chave, prazo = next(iter(prazos.items()))
+                if prazo > agora:
+                    break
+                prazos.popitem(last=False)
+                self._dados.pop((espaco, chave), None)
+                self._qtd[espaco] -= 1
+                self.expiradas[espaco] = self.expiradas.get(espaco, 0) + 1
+
+    def get(self, espaco: str, chave: str) -> Tuple[Any, int]:
+        with self._lock:
+            self._expirar(time.time())
+            item = self._dados.get((espaco, chave))
+        return (item[1], item[0]) if item else (None, 0)
+
+    def put(self, espaco: str, chave: str, valor, ttl_s: Optional[float] = None) -> int:
+        with self._lock:
+            self._expirar(time.time())
+            versao = self._dados.get((espaco, chave), (0, None))[0] + 1
+            self._gravar(espaco, chave, versao, valor, ttl_s)
+        return versao
+
+    def cas(self, espaco: str, chave: str, valor, versao: int, ttl_s: Optional[float] = None) -> bool:
+        with self._lock:
+            self._expirar(time.time())
+            if self._dados.get((espaco, chave), (0, None))[0] != versao:
+                return False
+            self._gravar(espaco, chave, versao + 1, valor, ttl_s)
+        return True
+
+    def delete(self, espaco: str, chave: str):
+        with self._lock:
+            self._remover(espaco, chave)
+
+    def quantidade(self, espaco: str) -> int:
+        with self._lock:
+            self._expirar(time.time())
+            return self._qtd.get(espaco, 0)
+
+
+class ArmazemSQLite:
+    """
+    Tabela kv em WAL. Uma conexão por processo (gunicorn faz fork depois do import).
+    Leituras ignoram o que já venceu; a limpeza roda no máximo a cada
+    SESSAO_VARREDURA_S, pelo índice em expira_em (sem varrer a tabela).
+    """
+    compartilhado = True
+    nome = "sqlite"
+
+    _VIVA = "(expira_em IS NULL OR expira_em > ?)"
+
+    def __init__(self, caminho: str = SESSAO_SQLITE_PATH):
+        self.caminho = caminho
+        self._db = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self._proxima_varredura = 0.0
+        self.expiradas: Dict[str, int] = {}
+
+    def _conexao(self):
+        pid = os.getpid()
+        if self._pid != pid:
+            self._db = sqlite3.connect(self.caminho, timeout=5, check_same_thread=False, isolation_level=None)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA synchronous=NORMAL")
+            self._db.execute("""
+                CREATE TABLE IF NOT EXISTS sessoes (
+                    espaco TEXT NOT NULL, chave TEXT NOT NULL,
+                    versao INTEGER NOT NULL, valor TEXT NOT NULL,
+                    expira_em REAL,
+                    PRIMARY KEY (espaco, chave)
+                )""")
+            colunas = [c[1] for c in self._db.execute("PRAGMA table_info(sessoes)")]
+            if "expira_em" not in colunas:   # arquivo criado antes da expiração
+                self._db.execute("ALTER TABLE sessoes ADD COLUMN expira_em REAL")
+            self._db.execute("CREATE INDEX IF NOT EXISTS sessoes_expira ON sessoes (expira_em)")
+            self._db.execute("""
+                CREATE TABLE IF NOT EXISTS travas (
+                    chave TEXT PRIMARY KEY, dono TEXT NOT NULL, expira_em REAL NOT NULL
+                )""")
+            self._pid = pid
+        return self._db
+
+    def _varrer(self, db, agora: float):
+        # chamado com self._lock adquirido
+        if agora < self._proxima_varredura:
+            return
+        self._proxima_varredura = agora + SESSAO_VARREDURA_S
+        for (espaco,) in db.execute("DELETE FROM sessoes WHERE expira_em <= ? RETURNING espaco", (agora,)).fetchall():
+            self.expiradas[espaco] = self.expiradas.get(espaco, 0) + 1
+
+    @staticmethod
+    def _prazo(agora: float, ttl_s):
+        return agora + ttl_s if ttl_s else None
+
+    def get(self, espaco, chave):
+        with self._lock:
+            linha = self._conexao().execute(
+                f"SELECT valor, versao FROM sessoes WHERE espaco = ? AND chave = ? AND {self._VIVA}",
+                (espaco, chave, time.time())).fetchone()
+        return (desserializar(linha[0]), linha[1]) if linha else (None, 0)
+
+    def put(self, espaco, chave, valor, ttl_s=None) -> int:
+        agora = time.time()
+        with self._lock:
+            db = self._conexao()
+            linha = db.execute(
+                "INSERT INTO sessoes (espaco, chave, versao, valor, expira_em) VALUES (?, ?, 1, ?, ?) "
+                "ON CONFLICT (espaco, chave) DO UPDATE SET versao = versao + 1, valor = excluded.valor, "
+                "expira_em = excluded.expira_em RETURNING versao",
+                (espaco, chave, serializar(valor), self._prazo(agora, ttl_s))).fetchone()
+            self._varrer(db, agora)
+        return linha[0]
+
+    def cas(self, espaco, chave, valor, versao, ttl_s=None) -> bool:
+        texto = serializar(valor)
+        agora = time.time()
+        prazo = self._prazo(agora, ttl_s)
+        with self._lock:
+            db = self._conexao()
+            if versao == 0:
+                # chave nova — ou uma vencida que a varredura ainda não apagou
+                cur = db.execute(
+                    "INSERT INTO sessoes (espaco, chave, versao, valor, expira_em) VALUES (?, ?, 1, ?, ?) "
+                    "ON CONFLICT (espaco, chave) DO UPDATE SET versao = versao + 1, valor = excluded.valor, "
+                    "expira_em = excluded.expira_em WHERE sessoes.expira_em <= ?",
+                    (espaco, chave, texto, prazo, agora))
+            else:
+                cur = db.execute("UPDATE sessoes SET versao = versao + 1, valor = ?, expira_em = ? "
+                                 "WHERE espaco = ? AND chave = ? AND versao = ?",
+                                 (texto, prazo, espaco, chave, versao))
+            self._varrer(db, agora)
+        return cur.rowcount == 1
+
+    def delete(self, espaco, chave):
+        with self._lock:
+            self._conexao().execute("DELETE FROM sessoes WHERE espaco = ? AND chave = ?", (espaco, chave))
+
+    def travar(self, chave, dono, ttl_s) -> bool:
+        agora = time.time()
+        with self._lock:
+            cur = self._conexao().execute(
+                "INSERT INTO travas (chave, dono, expira_em) VALUES (?, ?, ?) "
+                "ON CONFLICT (chave) DO UPDATE SET dono = excluded.dono, expira_em = excluded.expira_em "
+                "WHERE travas.expira_em <= ?",
+                (chave, dono, agora + ttl_s, agora))
+        return cur.rowcount == 1
+
+    def liberar(self, chave, dono):
+        with self._lock:
+            self._conexao().execute("DELETE FROM travas WHERE chave = ? AND dono = ?", (chave, dono))
+
+    def quantidade(self, espaco) -> int:
+        with self._lock:
+            return self._conexao().execute(
+                f"SELECT COUNT(*) FROM sessoes WHERE espaco = ? AND {self._VIVA}", (espaco, time.time())).fetchone()[0]
+
+
+class ArmazemRedis:
+    """
+    Hash por chave ({prefixo}:{espaco}:{wa_id} → v=versão, d=json).
+    O CAS roda num script Lua (atômico no servidor). Fala o protocolo Redis:
+    serve Redis, Valkey, KeyDB, Dragonfly... A expiração é a do próprio servidor
+    (PEXPIRE a cada gravação), então aqui não há contagem de expiradas.
+    """
+    compartilhado = True
+    nome = "redis"
+    expiradas = None
+
+    _LUA_CAS = """
+        local v = tonumber(redis.call('HGET', KEYS[1], 'v') or '0')
+        if v ~= tonumber(ARGV[1]) then return 0 end
+        redis.call('HSET', KEYS[1], 'v', v + 1, 'd', ARGV[2])
+        if tonumber(ARGV[3]) > 0 then redis.call('PEXPIRE', KEYS[1], ARGV[3]) end
+        return 1
+    """
+    _LUA_LIBERAR = """
+        if redis.call('GET', KEYS[1]) == ARGV[1] then return redis.call('DEL', KEYS[1]) end
+        return 0
+    """
+    _LUA_PUT = """
+        local v = redis.call('HINCRBY', KEYS[1], 'v', 1)
+        redis.call('HSET', KEYS[1], 'd', ARGV[1])
+        if tonumber(ARGV[2]) > 0 then redis.call('PEXPIRE', KEYS[1], ARGV[2]) end
+        return v
+    """
+
+    def __init__(self, url: str = SESSAO_REDIS_URL, prefixo: str = SESSAO_PREFIXO):
+        import redis   # opcional: só é exigido com SESSAO_BACKEND=redis
+        self._r = redis.Redis.from_url(url)
+        self.prefixo = prefixo
+        self._cas = self._r.register_script(self._LUA_CAS)
+        self._put = self._r.register_script(self._LUA_PUT)
+        self._liberar = self._r.register_script(self._LUA_LIBERAR)
+
+    def _k(self, espaco, chave) -> str:
+        return f"{self.prefixo}:{espaco}:{chave}"
+
+    def get(self, espaco, chave):
+        v, d = self._r.hmget(self._k(espaco, chave), "v", "d")
+        return (desserializar(d), int(v)) if d is not None else (None, 0)
+
+    def put(self, espaco, chave, valor, ttl_s=None) -> int:
+        ms = int((ttl_s or 0) * 1000)
+        return int(self._put(keys=[self._k(espaco, chave)], args=[serializar(valor), ms]))
+
+    def cas(self, espaco, chave, valor, versao, ttl_s=None) -> bool:
+        ms = int((ttl_s or 0) * 1000)
+        return bool(self._cas(keys=[self._k(espaco, chave)], args=[versao, serializar(valor), ms]))
+
+    def delete(self, espaco, chave):
+        self._r.delete(self._k(espaco, chave))
+
+    def travar(self, chave, dono, ttl_s) -> bool:
+        return bool(self._r.set(f"{self.prefixo}:trava:{chave}", dono, nx=True, px=int(ttl_s * 1000)))
+
+    def liberar(self, chave, dono):
+        self._liberar(keys=[f"{self.prefixo}:trava:{chave}"], args=[dono])
+
+    def quantidade(self, espaco) -> int:
+        return sum(1 for _ in self._r.scan_iter(match=f"{self.prefixo}:{espaco}:*", count=500))
+
+
+def criar_armazem(backend: str = SESSAO_BACKEND):
+    if backend == "sqlite":
+        return ArmazemSQLite()
+    if backend == "redis":
+        return ArmazemRedis()
+    return ArmazemMemoria()
+
+
+# ===== Fachada com cara de dict + cache por turno =============================
+_AUSENTE = object()
+_LOCAL = threading.local()
+
+
+class _Lido:
+    __slots__ = ("valor", "versao", "original")
+
+    def __init__(self, valor, versao, original):
+        self.valor = valor
+        self.versao = versao
+        self.original = original   # serialização no momento da leitura (detecta mutação in-place)
+
+
+class MapaSessoes:
+    """
+    SESS[wa] / SESS.get(wa) / wa in SESS / del SESS[wa] sobre um espaço do armazém.
+    ttl_s: cada gravação vale por ttl_s segundos (None = não expira).
+    """
+
+    def __init__(self, armazem, espaco: str, ttl_s: Optional[float] = None):
+        self.armazem = armazem
+        self.espaco = espaco
+        self.ttl_s = ttl_s
+        self.conflitos = 0
+        self.gravacoes = 0
+        _MAPAS.append(self)
+
+    def _cache(self) -> Optional[dict]:
+        turno = getattr(_LOCAL, "turno", None)
+        return turno.setdefault(self, {}) if turno is not None else None
+
+    def _ler(self, chave):
+        cache = self._cache()
+        if cache is None:
+            return self.armazem.get(self.espaco, chave)[0]
+        item = cache.get(chave)
+        if item is None:
+            valor, versao = self.armazem.get(self.espaco, chave)
+            original = serializar(valor) if valor is not None else None
+            item = cache[chave] = _Lido(valor, versao, original)
+        return item.valor
+
+    def get(self, chave, padrao=None):
+        valor = self._ler(chave)
+        return padrao if valor is None else valor
+
+    def __getitem__(self, chave):
+        valor = self._ler(chave)
+        if valor is None:
+            raise KeyError(chave)
+        return valor
+
+    def __contains__(self, chave) -> bool:
+        return self._ler(chave) is not None
+
+    def __setitem__(self, chave, valor):
+        cache = self._cache()
+        if cache is None:
+            self.armazem.put(self.espaco, chave, valor, self.ttl_s)
+            self.gravacoes += 1
+            return
+        self._ler(chave)
+        cache[chave].valor = valor
+
+    def __delitem__(self, chave):
+        cache = self._cache()
+        if cache is None:
+            self.armazem.delete(self.espaco, chave)
+            return
+        self._ler(chave)
+        cache[chave].valor = None
+
+    def pop(self, chave, padrao=None):
+        valor = self.get(chave, _AUSENTE)
+        if valor is _AUSENTE:
+            return padrao
+        del self[chave]
+        return valor
+
+    def _confirmar(self, cache: dict):
+        for chave, item in cache.items():
+            if item.valor is None:
+                if item.versao:
+                    self.armazem.delete(self.espaco, chave)
+                continue
+            atual = serializar(item.valor)
+            if atual == item.original:
+                continue
+            self.gravacoes += 1
+            if not self.armazem.cas(self.espaco, chave, item.valor, item.versao, self.ttl_s):
+                # Só acontece se a trava do turno venceu e outro worker gravou no meio:
+                # o turno não dá para refazer (mensagens já saíram), então fica o que está gravado.
+                self.conflitos += 1
+                print(f"⚠️ [SESSAO] conflito em {self.espaco}:{chave} — mantendo a versão gravada")
+
+    def __len__(self) -> int:
+        return self.armazem.quantidade(self.espaco)
+
+    def metricas(self) -> dict:
+        expiradas = self.armazem.expiradas
+        return {
+            "vivas": len(self),
+            "ttl_s": self.ttl_s,
+            "expiradas": expiradas.get(self.espaco, 0) if expiradas is not None else None,
+            "gravacoes": self.gravacoes,
+            "conflitos": self.conflitos,
+        }
+
+
+_MAPAS = []
+
+
+def _travar(armazem, chave: str, dono: str) -> bool:
+    limite = time.monotonic() + SESSAO_TRAVA_ESPERA_S
+    espera = 0.01
+    while not armazem.travar(chave, dono, SESSAO_TRAVA_S):
+        if time.monotonic() >= limite:
+            print(f"⚠️ [SESSAO] trava de {chave} ocupada há {SESSAO_TRAVA_ESPERA_S:.0f}s — seguindo sem ela")
+            return False
+        time.sleep(espera)
+        espera = min(espera * 2, 0.2)
+    return True
+
+
+@contextmanager
+def turno(chave: Optional[str] = None):
+    """
+    Um turno = uma mensagem processada. Leituras ficam no cache da thread e o que
+    mudou é gravado no fim (CAS). Com chave (o wa_id), turnos do mesmo contato em
+    workers diferentes esperam um pelo outro. Com o backend em memória não há o
+    que fazer: o executor já serializa por wa_id dentro do processo.
+    """
+    compartilhado = next((m.armazem for m in _MAPAS if m.armazem.compartilhado), None)
+    if compartilhado is None or getattr(_LOCAL, "turno", None) is not None:
+        yield
+        return
+    dono = f"{os.getpid()}:{threading.get_ident()}:{time.monotonic_ns()}"
+    travado = bool(chave) and _travar(compartilhado, chave, dono)
+    _LOCAL.turno = {}
+    try:
+        yield
+    finally:
+        caches, _LOCAL.turno = _LOCAL.turno, None
+        for mapa, cache in caches.items():
+            try:
+                mapa._confirmar(cache)
+            except Exception as e:
+                print(f"❌ [SESSAO] erro ao gravar {mapa.espaco}:", e)
+        if travado:
+            compartilhado.liberar(chave, dono)
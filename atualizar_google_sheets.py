@@ -1,31 +1,125 @@
-import gspread
-from google.oauth2.service_account import Credentials
-import os
+import os, atexit, threading
 from dotenv import load_dotenv
 
+from indice_contatos import indice
+from planilhas_google import com_aba
+
 # Carrega variáveis de ambiente
 load_dotenv()
 
 CAMINHO_CREDENCIAL = os.getenv("GOOGLE_SHEETS_CREDENTIALS_PATH")
 SHEET_ID = '1Xke33HzOXW78CjX7sVm9OORZmw7dvUN2YzjBXcVQ0II'
 NOME_ABA = 'Página1'
+COLUNA_INTERESSE = "C"
 
-def atualizar_interesse_google_sheets(numero, novo_interesse):
-    try:
-        SCOPES = ['https://www.googleapis.com/auth/spreadsheets']
-        creds = Credentials.from_service_account_file(CAMINHO_CREDENCIAL, scopes=SCOPES)
-        client = gspread.authorize(creds)
-        planilha = client.open_by_key(SHEET_ID)
-        aba = planilha.worksheet(NOME_ABA)
+# Mudanças de interesse são juntadas por INTERESSE_AGRUPAR_MS e gravadas num único
+# batch_update (0 = grava na hora, uma chamada por mudança)
+INTERESSE_AGRUPAR_MS = int(os.getenv("INTERESSE_AGRUPAR_MS", "1000"))
 
-        col_numeros = aba.col_values(1)
+INDICE = indice(SHEET_ID, NOME_ABA)
+
+_PENDENTES = {}          # numero -> interesse (vale o último)
+_ADIAMENTOS = {}         # numero -> quantas vezes voltou para a fila sem conferir
+INTERESSE_MAX_ADIAMENTOS = 3
+_LOCK = threading.Lock() # protege _PENDENTES, _ADIAMENTOS e _TIMER
+_TIMER = None
+
+def atualizar_interesse_google_sheets(numero, novo_interesse):
+    agendar_interesse(numero, novo_interesse)
+    if INTERESSE_AGRUPAR_MS <= 0:
+        descarregar_interesses()
 
-        for idx, num in enumerate(col_numeros[1:], start=2):  # pula o cabeçalho
-            if num.strip() == numero:
-                aba.update_cell(idx, 3, novo_interesse)  # coluna 3 = interesse
-                print(f"✏️ Interesse atualizado no Google Sheets: {numero} -> {novo_interesse}")
-                return
-        print(f"⚠️ Número não encontrado na planilha: {numero}")
+def agendar_interesse(numero, novo_interesse):
+    """Guarda a mudança; a gravação sai junto com as outras pendentes."""
+    global _TIMER
+    with _LOCK:
+        _PENDENTES[(numero or "").strip()] = novo_interesse
+        if INTERESSE_AGRUPAR_MS > 0 and _TIMER is None:
+            _TIMER = threading.Timer(INTERESSE_AGRUPAR_MS / 1000, descarregar_interesses)
+            _TIMER.daemon = True
+            _TIMER.start()
 
+def descarregar_interesses():
+    """Grava todas as mudanças pendentes com um batch_update."""
+    global _TIMER
+    with _LOCK:
+        pendentes = dict(_PENDENTES)
+        _PENDENTES.clear()
+        _TIMER = None
+    if not pendentes:
+        return
+    try:
+        # com_aba pode chamar _gravar_lote duas vezes (handle velho): o que volta
+        # para a fila só é decidido depois, com o resultado final
+        linhas, fora = com_aba(SHEET_ID, NOME_ABA, CAMINHO_CREDENCIAL, lambda aba: _gravar_lote(aba, pendentes))
     except Exception as e:
         print("❌ Erro ao atualizar interesse no Google Sheets:", e)
+        return
+    _readiar(pendentes, fora)
+    for numero, interesse in pendentes.items():
+        if numero in fora:
+            continue
+        if numero in linhas:
+            print(f"✏️ Interesse atualizado no Google Sheets: {numero} -> {interesse}")
+        else:
+            print(f"⚠️ Número não encontrado na planilha: {numero}")
+
+atexit.register(descarregar_interesses)
+
+def _linhas_conferidas(aba, pendentes):
+    """
+    número -> linha pelo índice, conferindo na planilha (uma leitura só da coluna A
+    nessas linhas) que cada número ainda está onde o índice diz. Se alguém inseriu
+    ou apagou linhas na mão, reindexa e confere de novo.
+    Devolve (conferidas, fora_do_lugar): o que ainda não bate depois de reindexar
+    fica de fora desta gravação.
+    """
+    for tentativa in range(2):
+        linhas = {}
+        for numero in pendentes:
+            linha = INDICE.linha(aba, numero)
+            if linha and linha >= 2:          # linha 1 = cabeçalho
+                linhas[numero] = linha
+        if not linhas:
+            return linhas, []
+        valores = aba.batch_get([f"A{l}" for l in linhas.values()])
+        atuais = [(v[0][0] if v and v[0] else "").strip() for v in valores]
+        fora = [n for a, n in zip(atuais, linhas) if a != n]
+        if not fora:
+            return linhas, []
+        if tentativa:
+            return {n: l for n, l in linhas.items() if n not in fora}, fora
+        print("🔄 [CONTATOS] linhas mudaram de lugar — reindexando antes de gravar")
+        INDICE.sincronizar(aba)
+
+def _readiar(pendentes, fora):
+    """Devolve para a próxima descarga o que não deu para conferir (sem apagar mudança mais nova)."""
+    global _TIMER
+    with _LOCK:
+        for numero in pendentes:
+            if numero not in fora:
+                _ADIAMENTOS.pop(numero, None)
+                continue
+            vezes = _ADIAMENTOS.get(numero, 0) + 1
+            if vezes > INTERESSE_MAX_ADIAMENTOS:
+                _ADIAMENTOS.pop(numero, None)
+                print(f"❌ Interesse de {numero} descartado: linha não confere após {INTERESSE_MAX_ADIAMENTOS} tentativas")
+                continue
+            _ADIAMENTOS[numero] = vezes
+            print(f"⏳ Interesse de {numero} volta para a fila: linha não confere na planilha")
+            _PENDENTES.setdefault(numero, pendentes[numero])
+        if fora and _PENDENTES and _TIMER is None:
+            _TIMER = threading.Timer(max(INTERESSE_AGRUPAR_MS, 1000) / 1000, descarregar_interesses)
+            _TIMER.daemon = True
+            _TIMER.start()
+
+def _gravar_lote(aba, pendentes):
+    with INDICE.lock:
+        linhas, fora = _linhas_conferidas(aba, pendentes)
+        if linhas:
+            aba.batch_update(
+                [{"range": f"{COLUNA_INTERESSE}{linha}", "values": [[pendentes[numero]]]}
+                 for numero, linha in linhas.items()],
+                value_input_option="USER_ENTERED",
+            )
+    return linhas, fora
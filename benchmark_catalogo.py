@@ -0,0 +1,68 @@
+# benchmark_catalogo.py — custo de montar o payload a cada envio x catálogo pré-renderizado
+#
+# Uso: python benchmark_catalogo.py [--n 100000]
+#
+# "dict + dumps" é o que _send_text/_send_buttons faziam em todo envio: montar
+# o dicionário, aplicar os limites de tamanho e serializar para JSON.
+# "catálogo" só concatena os pedaços de bytes já prontos com o destinatário.
+import argparse, json, time
+
+import responder_clinica as r
+
+
+def _dict_botoes(to, body, botoes):
+    return json.dumps({
+        "messaging_product": "whatsapp",
+        "to": to,
+        "type": "interactive",
+        "interactive": {
+            "type": "button",
+            "body": {"text": body[:1024]},
+            "action": {"buttons": [{"type": "reply", "reply": b} for b in botoes[:3]]},
+        },
+    }, ensure_ascii=False).encode("utf-8")
+
+
+def _dict_texto(to, texto):
+    return json.dumps({"messaging_product": "whatsapp", "to": to, "type": "text",
+                       "text": {"preview_url": False, "body": texto[:4096]}},
+                      ensure_ascii=False).encode("utf-8")
+
+
+def medir(fn, n):
+    inicio = time.perf_counter()
+    for i in range(n):
+        fn(i)
+    return (time.perf_counter() - inicio) / n * 1e6
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--n", type=int, default=100_000)
+    args = ap.parse_args()
+
+    casos = {
+        "boas_vindas": (
+            lambda i: _dict_botoes(f"5511{i:09d}", r._welcome_named("Ana"), r.BTN_ROOT),
+            lambda i: r.CATALOGO.item("boas_vindas").render(to=f"5511{i:09d}", nome="Ana"),
+        ),
+        "menu_exame": (
+            lambda i: _dict_texto(f"5511{i:09d}", r._exame_menu_texto()),
+            lambda i: r.CATALOGO.item("menu_exame").render(to=f"5511{i:09d}"),
+        ),
+        "endereco": (
+            lambda i: _dict_texto(f"5511{i:09d}", r.TXT_ENDERECO),
+            lambda i: r.CATALOGO.item("endereco").render(to=f"5511{i:09d}"),
+        ),
+    }
+
+    print(f"n={args.n}")
+    print(f"{'mensagem':>12} {'dict+dumps µs':>14} {'catálogo µs':>12} {'economia µs':>12} {'x':>6}")
+    for nome, (antigo, novo) in casos.items():
+        assert json.loads(antigo(0)) == json.loads(novo(0)), nome
+        t_antigo, t_novo = medir(antigo, args.n), medir(novo, args.n)
+        print(f"{nome:>12} {t_antigo:>14.2f} {t_novo:>12.2f} {t_antigo - t_novo:>12.2f} {t_antigo / t_novo:>6.1f}")
+
+
+if __name__ == "__main__":
+    main()
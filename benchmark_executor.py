@@ -0,0 +1,50 @@
+# benchmark_executor.py — vazão do ExecutorPorRemetente x número de pacientes simultâneos
+#
+# Uso: python benchmark_executor.py [--workers 8] [--msgs 20] [--latencia-ms 50]
+#
+# Cada "mensagem" dorme latencia-ms (simula Claude/Graph API). Com um único
+# remetente a vazão fica presa em 1000/latência msg/s (ordem garantida);
+# com vários remetentes ela escala até o número de workers.
+import argparse, threading, time
+
+from executor_remetente import ExecutorPorRemetente
+
+
+def rodar(remetentes: int, msgs: int, workers: int, latencia: float):
+    ex = ExecutorPorRemetente(workers=workers, max_pendentes=remetentes * msgs + 1, nome="bench")
+    vistos = {f"55119{r:06d}": [] for r in range(remetentes)}
+    lock = threading.Lock()
+
+    def tratar(wa_id, seq):
+        time.sleep(latencia)
+        with lock:
+            vistos[wa_id].append(seq)
+
+    inicio = time.perf_counter()
+    for seq in range(msgs):
+        for wa_id in vistos:
+            ex.submeter(wa_id, tratar, wa_id, seq)
+    ex.aguardar()
+    dur = time.perf_counter() - inicio
+
+    em_ordem = all(v == list(range(msgs)) for v in vistos.values())
+    m = ex.metricas()
+    return remetentes * msgs / dur, em_ordem, m["espera_ms"]["p95"], m["raias_ativas"]
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--workers", type=int, default=8)
+    ap.add_argument("--msgs", type=int, default=20, help="mensagens por remetente")
+    ap.add_argument("--latencia-ms", type=float, default=50.0)
+    args = ap.parse_args()
+
+    print(f"workers={args.workers}  msgs/remetente={args.msgs}  latência={args.latencia_ms}ms")
+    print(f"{'remetentes':>10} {'msg/s':>10} {'ordem':>7} {'espera p95 ms':>14} {'raias restantes':>16}")
+    for remetentes in (1, 2, 4, 8, 16, 32):
+        vazao, ordem, p95, restantes = rodar(remetentes, args.msgs, args.workers, args.latencia_ms / 1000)
+        print(f"{remetentes:>10} {vazao:>10.1f} {'ok' if ordem else 'FALHOU':>7} {p95:>14.1f} {restantes:>16}")
+
+
+if __name__ == "__main__":
+    main()
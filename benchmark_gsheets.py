@@ -0,0 +1,72 @@
+# benchmark_gsheets.py — linhas/s gravando no Sheets: uma chamada por linha x agrupado por aba
+#
+# Uso: python benchmark_gsheets.py [--linhas 500] [--produtores 8] [--latencia-ms 250] [--build-ms 40]
+#      python benchmark_gsheets.py --real --aba Bench   (usa CLINICA_SHEET_ID / GOOGLE_CREDENTIALS_JSON)
+#
+# Simulado: cada values().append custa latencia-ms e montar o service custa build-ms
+# (o _service() antigo montava credencial + discovery a cada linha).
+# "antes" = build + append por linha; "depois" = AgrupadorAbas + append_many.
+import argparse, threading, time
+
+import gsheets_client as gs
+
+ABAS = ("Interacoes", "Solicitacoes", "Pesquisa")
+
+
+def produzir(adicionar, linhas: int, produtores: int):
+    def trabalho(p):
+        for i in range(p, linhas, produtores):
+            adicionar(ABAS[i % len(ABAS)], [time.strftime("%H:%M:%S"), f"bench-{p}", "evento", i])
+    threads = [threading.Thread(target=trabalho, args=(p,)) for p in range(produtores)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--linhas", type=int, default=500)
+    ap.add_argument("--produtores", type=int, default=8)
+    ap.add_argument("--latencia-ms", type=float, default=250.0)
+    ap.add_argument("--build-ms", type=float, default=40.0)
+    ap.add_argument("--real", action="store_true")
+    ap.add_argument("--aba", default="Bench")
+    args = ap.parse_args()
+
+    if args.real:
+        global ABAS
+        ABAS = (args.aba,)
+
+        def por_linha(aba, linha):
+            gs._LOCAL.service = None            # força o custo antigo de montar o service
+            gs.append_many(aba, [linha])
+        gravar_lote = gs.append_many
+    else:
+        def por_linha(aba, linha):
+            time.sleep((args.build_ms + args.latencia_ms) / 1000)
+
+        def gravar_lote(aba, linhas):
+            time.sleep(args.latencia_ms / 1000)
+
+    inicio = time.perf_counter()
+    produzir(por_linha, args.linhas, args.produtores)
+    antes = args.linhas / (time.perf_counter() - inicio)
+
+    agrupador = gs.AgrupadorAbas(gravar=gravar_lote)
+    inicio = time.perf_counter()
+    produzir(agrupador.adicionar, args.linhas, args.produtores)
+    agrupador.descarregar()
+    depois = args.linhas / (time.perf_counter() - inicio)
+    m = agrupador.metricas()
+
+    print(f"linhas={args.linhas} produtores={args.produtores} "
+          f"{'real' if args.real else f'latência={args.latencia_ms}ms build={args.build_ms}ms'}")
+    print(f"{'modo':>10} {'linhas/s':>10} {'chamadas':>9}")
+    print(f"{'antes':>10} {antes:>10.1f} {args.linhas:>9}")
+    print(f"{'depois':>10} {depois:>10.1f} {m['chamadas']:>9}   (janela {gs.GSHEETS_AGRUPAR_MS}ms, "
+          f"{m['linhas_por_chamada']['media']} linhas/chamada)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+# benchmark_sessoes.py — memória por sessão e custo de despacho: dict aninhado x Sessao (__slots__)
+#
+# Uso: python benchmark_sessoes.py [--contatos 100000]
+#
+# "dict" é o formato antigo ({"route","stage","data":{...},"last_at"}) com as
+# comparações por texto do _responder_mensagem; "Sessao" usa sessao.py, com
+# atributos e as constantes Rota/Etapa.
+import argparse, time, tracemalloc
+from datetime import datetime
+
+from armazem_sessoes import desserializar, serializar
+from sessao import _TZ_SP, ROTAS_FORMULARIO, Etapa, Rota, Sessao
+
+_ROTAS = ["consulta", "exames", "retorno", "sugestao", "root"]
+_ETAPAS = ["forma", "convenio", "especialidade_num", "exame_num", "origem_menu", "await_text", "nome", ""]
+_ATIVAS = {"consulta", "exames", "retorno", "resultado", "pesquisa", "editar_endereco"}
+
+
+def _dados(i: int) -> dict:
+    """Sessão típica no meio do fluxo de consulta (8 campos)."""
+    return {
+        "tipo": "consulta", "contato": f"5511{i:09d}", "wa_id": f"5511{i:09d}", "whatsapp_nome": f"Contato {i}",
+        "forma": "Convênio", "convenio": "Unimed", "especialidade": "Pediatria", "_pac_decidido": True,
+    }
+
+
+def criar_dict(i: int, agora: datetime) -> dict:
+    return {"route": _ROTAS[i % 5], "stage": _ETAPAS[i % 8], "data": _dados(i), "last_at": agora}
+
+
+def criar_sessao(i: int, agora: datetime) -> Sessao:
+    return Sessao(_ROTAS[i % 5], _ETAPAS[i % 8], _dados(i), agora)
+
+
+def despachar_dict(ses: dict) -> int:
+    # mesma ordem de testes do ramo de texto do _responder_mensagem
+    if ses.get("route") in {"consulta", "exames"} and ses.get("stage") == "paciente_doc_choice":
+        return 1
+    if ses.get("route") == "sugestao" and ses.get("stage") == "await_text":
+        return 2
+    if ses.get("stage") == "origem_menu":
+        return 3
+    if ses.get("stage") == "origem_outros_texto":
+        return 4
+    if ses.get("stage") == "origem_panfleto_codigo":
+        return 5
+    if ses.get("route") == "exames" and ses.get("stage") == "exame_num":
+        return 6
+    if ses.get("route") in _ATIVAS and ses.get("stage"):
+        return 7 if ses["data"].get("forma") else 8
+    return 0
+
+
+_AGENDAMENTO = frozenset({Rota.CONSULTA, Rota.EXAMES})
+
+
+def despachar_sessao(ses: Sessao) -> int:
+    if ses.route in _AGENDAMENTO and ses.stage == Etapa.PACIENTE_DOC_CHOICE:
+        return 1
+    if ses.route == Rota.SUGESTAO and ses.stage == Etapa.AGUARDA_TEXTO:
+        return 2
+    if ses.stage == Etapa.ORIGEM_MENU:
+        return 3
+    if ses.stage == Etapa.ORIGEM_OUTROS_TEXTO:
+        return 4
+    if ses.stage == Etapa.ORIGEM_PANFLETO_CODIGO:
+        return 5
+    if ses.route == Rota.EXAMES and ses.stage == Etapa.EXAME_NUM:
+        return 6
+    if ses.route in ROTAS_FORMULARIO and ses.stage:
+        return 7 if ses.data.forma else 8
+    return 0
+
+
+def medir_memoria(criar, n: int, agora: datetime):
+    tracemalloc.start()
+    base = tracemalloc.get_traced_memory()[0]
+    sessoes = {f"5511{i:09d}": criar(i, agora) for i in range(n)}
+    usado = tracemalloc.get_traced_memory()[0] - base
+    tracemalloc.stop()
+    return sessoes, usado
+
+
+def medir(fn, itens) -> float:
+    inicio = time.perf_counter()
+    for item in itens:
+        fn(item)
+    return (time.perf_counter() - inicio) / len(itens) * 1e6
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--contatos", type=int, default=100_000)
+    args = ap.parse_args()
+    n = args.contatos
+    agora = datetime.now(_TZ_SP)
+
+    antigos, mem_antigo = medir_memoria(criar_dict, n, agora)
+    novos, mem_novo = medir_memoria(criar_sessao, n, agora)
+    l_antigos, l_novos = list(antigos.values()), list(novos.values())
+    assert [despachar_dict(s) for s in l_antigos] == [despachar_sessao(s) for s in l_novos]
+
+    amostra = max(1, n // 10)
+    j_antigo = [serializar(s) for s in l_antigos[:amostra]]
+    j_novo = [serializar(s) for s in l_novos[:amostra]]
+
+    linhas = [
+        ("memória / sessão (bytes)", mem_antigo / n, mem_novo / n),
+        ("criar sessão (µs)", medir(lambda i: criar_dict(i, agora), range(n)),
+                              medir(lambda i: criar_sessao(i, agora), range(n))),
+        ("despacho (µs)", medir(despachar_dict, l_antigos), medir(despachar_sessao, l_novos)),
+        ("serializar (µs)", medir(serializar, l_antigos[:amostra]), medir(serializar, l_novos[:amostra])),
+        ("desserializar (µs)", medir(desserializar, j_antigo), medir(desserializar, j_novo)),
+        ("json / sessão (bytes)", sum(map(len, j_antigo)) / amostra, sum(map(len, j_novo)) / amostra),
+    ]
+    print(f"contatos={n}")
+    print(f"{'':>26} {'dict':>10} {'Sessao':>10} {'x':>6}")
+    for nome, antigo, novo in linhas:
+        print(f"{nome:>26} {antigo:>10.2f} {novo:>10.2f} {antigo / novo:>6.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,147 @@
+# caixa_saida.py — outbox local (SQLite): o que tem de sair mesmo que o processo caia
+# ==============================================================================
+# Todo item é gravado aqui ANTES de qualquer tentativa de envio e só sai quando o
+# destino confirma. Se o processo cair, o Render reiniciar ou o destino ficar fora
+# do ar, o item continua no disco e é reenviado depois. Usada por:
+#   - fila_webapp     registros do WebApp do Sheets (SHEETS_OUTBOX_PATH)
+#   - gsheets_client  lotes do AgrupadorAbas que esgotaram as tentativas
+#   - agendador_envios fila de disparos de campanha
+#
+# A chave é escolhida por quem grava e identifica o item (no Sheets, o message_id
+# do registro): gravar duas vezes o mesmo item não duplica a fila.
+#
+# Vários workers do gunicorn podem apontar para o mesmo arquivo: cada um "reserva"
+# os itens que vai enviar (proxima_em = agora + reserva_s), então duas threads não
+# pegam o mesmo item ao mesmo tempo. Se o processo morrer com itens reservados,
+# eles voltam a ficar disponíveis quando a reserva vence.
+import os, json, sqlite3, threading, time
+from typing import List, Tuple
+
+SHEETS_OUTBOX_PATH      = os.getenv("SHEETS_OUTBOX_PATH", "outbox_sheets.sqlite3").strip()  # vazio = só memória
+SHEETS_OUTBOX_MAX       = int(os.getenv("SHEETS_OUTBOX_MAX", "50000"))
+SHEETS_OUTBOX_RESERVA_S = float(os.getenv("SHEETS_OUTBOX_RESERVA_S", "300"))
+
+
+class CaixaSaida:
+
+    def __init__(self, caminho: str = SHEETS_OUTBOX_PATH, max_itens: int = SHEETS_OUTBOX_MAX,
+                 reserva_s: float = SHEETS_OUTBOX_RESERVA_S):
+        self.caminho = caminho or ":memory:"
+        self.max_itens = max_itens
+        self.reserva_s = reserva_s
+        self._lock = threading.Lock()
+        self._db = None
+        self._pid = None
+        self._qtd = 0
+
+        self.gravados = 0
+        self.repetidos = 0
+        self.confirmados = 0
+        self.adiados = 0
+
+    # ===== Conexão (uma por processo: gunicorn faz fork depois do import) =====
+    def _conexao(self):
+        pid = os.getpid()
+        if self._pid != pid:
+            self._db = sqlite3.connect(self.caminho, timeout=5, check_same_thread=False, isolation_level=None)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("""
+                CREATE TABLE IF NOT EXISTS outbox (
+                    chave TEXT PRIMARY KEY,
+                    ts REAL NOT NULL,
+                    payload TEXT NOT NULL,
+                    tentativas INTEGER NOT NULL DEFAULT 0,
+                    proxima_em REAL NOT NULL,
+                    ultimo_erro TEXT
+                )""")
+            self._db.execute("CREATE INDEX IF NOT EXISTS outbox_proxima ON outbox (proxima_em)")
+            self._qtd = self._db.execute("SELECT COUNT(*) FROM outbox").fetchone()[0]
+            self._pid = pid
+            if self._qtd:
+                print(f"📦 [OUTBOX] {self._qtd} registro(s) pendente(s) em {self.caminho}")
+        return self._db
+
+    # ===== API ================================================================
+    def cheia(self) -> bool:
+        with self._lock:
+            self._conexao()
+            return self._qtd >= self.max_itens
+
+    def gravar(self, chave: str, registro: dict, reservar: bool = True) -> bool:
+        """
+        Grava o registro (se a chave ainda não existe). Com reservar=True, quem
+        gravou fica dono do envio imediato; a varredura só o pega se a reserva vencer.
+        """
+        agora = time.time()
+        proxima = agora + self.reserva_s if reservar else agora
+        with self._lock:
+            cur = self._conexao().execute(
+                "INSERT OR IGNORE INTO outbox (chave, ts, payload, proxima_em) VALUES (?,?,?,?)",
+                (chave, agora, json.dumps(registro, ensure_ascii=False), proxima),
+            )
+            novo = cur.rowcount == 1
+            if novo:
+                self._qtd += 1
+        if novo:
+            self.gravados += 1
+        else:
+            self.repetidos += 1
+        return novo
+
+    def reservar(self, limite: int) -> List[Tuple[str, dict]]:
+        """Pega até `limite` registros vencidos (mais antigos primeiro) e os reserva."""
+        agora = time.time()
+        with self._lock:
+            db = self._conexao()
+            db.execute("BEGIN IMMEDIATE")
+            try:
+                linhas = db.execute(
+                    "SELECT chave, payload FROM outbox WHERE proxima_em <= ? ORDER BY ts LIMIT ?",
+                    (agora, limite),
+                ).fetchall()
+                db.executemany("UPDATE outbox SET proxima_em = ? WHERE chave = ?",
+                               [(agora + self.reserva_s, c) for c, _ in linhas])
+                db.execute("COMMIT")
+            except Exception:
+                db.execute("ROLLBACK")
+                raise
+        return [(c, json.loads(p)) for c, p in linhas]
+
+    def confirmar(self, chaves: List[str]):
+        if not chaves:
+            return
+        with self._lock:
+            cur = self._conexao().executemany("DELETE FROM outbox WHERE chave = ?", [(c,) for c in chaves])
+            self._qtd = max(0, self._qtd - cur.rowcount)
+        self.confirmados += len(chaves)
+
+    def adiar(self, chaves: List[str], espera_s: float, erro: str = ""):
+        """Devolve os registros para a fila, com nova tentativa daqui a espera_s."""
+        if not chaves:
+            return
+        proxima = time.time() + espera_s
+        with self._lock:
+            self._conexao().executemany(
+                "UPDATE outbox SET tentativas = tentativas + 1, proxima_em = ?, ultimo_erro = ? WHERE chave = ?",
+                [(proxima, erro[:300], c) for c in chaves],
+            )
+        self.adiados += len(chaves)
+
+    def pendentes(self) -> Tuple[int, float]:
+        """(quantidade, idade em segundos do registro mais antigo)."""
+        with self._lock:
+            qtd, mais_antigo = self._conexao().execute("SELECT COUNT(*), MIN(ts) FROM outbox").fetchone()
+            self._qtd = qtd
+        return qtd, (time.time() - mais_antigo) if mais_antigo else 0.0
+
+    def metricas(self) -> dict:
+        qtd, idade = self.pendentes()
+        return {
+            "arquivo": self.caminho,
+            "pendentes": qtd,
+            "idade_mais_antigo_s": round(idade, 1),
+            "gravados": self.gravados,
+            "repetidos": self.repetidos,
+            "confirmados": self.confirmados,
+            "adiados": self.adiados,
+        }
@@ -0,0 +1,107 @@
+# catalogo_mensagens.py — payloads fixos (menus, botões, cartões) pré-serializados
+# ==============================================================================
+# Menus e respostas fixas só mudam no destinatário (e às vezes no primeiro nome).
+# Cada item é serializado para JSON uma única vez e guardado como pedaços de bytes
+# com "buracos" para os campos variáveis; no caminho quente só se concatena.
+import json
+from typing import Callable, Dict, List, Optional
+
+_MARCA = "\u2063{}\u2063"   # separador invisível: nunca aparece nos textos reais
+
+
+def _json_str(valor) -> bytes:
+    """Valor como conteúdo de string JSON (sem as aspas), já em bytes."""
+    return json.dumps(str(valor), ensure_ascii=False)[1:-1].encode("utf-8")
+
+
+class ModeloPayload:
+    """Payload JSON compilado: pedaços fixos intercalados com campos variáveis."""
+    __slots__ = ("partes", "campos", "tipo", "texto", "botoes")
+
+    def __init__(self, payload: dict, campos=("to",), texto: str = "", botoes: Optional[list] = None):
+        bruto = json.dumps(payload, ensure_ascii=False)
+        self.partes = []
+        self.campos = []
+        marcas = {_json_str(_MARCA.format(c)).decode("utf-8"): c for c in campos}
+        # Divide o JSON nos marcadores, na ordem em que aparecem
+        while True:
+            pos, achado = min(((bruto.find(m), m) for m in marcas if m in bruto), default=(-1, None))
+            if achado is None:
+                break
+            self.partes.append(bruto[:pos].encode("utf-8"))
+            self.campos.append(marcas[achado])
+            bruto = bruto[pos + len(achado):]
+        self.partes.append(bruto.encode("utf-8"))
+        self.tipo = payload.get("type") or "text"
+        self.texto = texto          # body original (para mesclar com texto retido)
+        self.botoes = botoes
+
+    def texto_com(self, **valores) -> str:
+        """Body original com os campos preenchidos (caminho sem pré-serialização)."""
+        t = self.texto
+        for campo in self.campos:
+            t = t.replace(marca(campo), str(valores.get(campo, "")))
+        return t
+
+    def render(self, **valores) -> bytes:
+        partes = self.partes
+        saida = [partes[0]]
+        for i, campo in enumerate(self.campos, start=1):
+            saida.append(_json_str(valores.get(campo, "")))
+            saida.append(partes[i])
+        return b"".join(saida)
+
+
+def marca(campo: str) -> str:
+    """Marcador de campo variável para usar dentro dos textos do catálogo."""
+    return _MARCA.format(campo)
+
+
+def modelo_texto(texto: str, campos=("to",)) -> ModeloPayload:
+    payload = {"messaging_product": "whatsapp", "to": marca("to"), "type": "text",
+               "text": {"preview_url": False, "body": texto[:4096]}}
+    return ModeloPayload(payload, campos, texto=texto)
+
+
+def modelo_botoes(body: str, botoes: List[Dict[str, str]], campos=("to",)) -> ModeloPayload:
+    btns = botoes[:3]  # WhatsApp permite no máximo 3 botões
+    payload = {
+        "messaging_product": "whatsapp",
+        "to": marca("to"),
+        "type": "interactive",
+        "interactive": {
+            "type": "button",
+            "body": {"text": body[:1024]},
+            "action": {"buttons": [{"type": "reply", "reply": b} for b in btns]},
+        },
+    }
+    return ModeloPayload(payload, campos, texto=body, botoes=btns)
+
+
+class CatalogoMensagens:
+    """
+    definicoes() -> {chave: ModeloPayload} monta o catálogo inteiro.
+    versao() -> valor barato que muda quando os catálogos de origem mudam
+    (listas de especialidades/exames, botões, links). Mudou → recompila.
+    """
+
+    def __init__(self, definicoes: Callable[[], Dict[str, ModeloPayload]], versao: Callable[[], object]):
+        self._definicoes = definicoes
+        self._versao = versao
+        self._itens: Dict[str, ModeloPayload] = {}
+        self._versao_atual = None
+        self.compilacoes = 0
+
+    def invalidar(self):
+        self._versao_atual = None
+
+    def item(self, chave: str) -> ModeloPayload:
+        v = self._versao()
+        if v != self._versao_atual:
+            self._itens = self._definicoes()
+            self._versao_atual = v
+            self.compilacoes += 1
+        return self._itens[chave]
+
+    def metricas(self) -> dict:
+        return {"itens": len(self._itens), "compilacoes": self.compilacoes}
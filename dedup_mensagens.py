@@ -0,0 +1,209 @@
+# dedup_mensagens.py — deduplicação de message_id com janela de tempo e tamanho máximo
+# (e, mais abaixo, de solicitações repetidas numa janela de minutos)
+# ==============================================================================
+import os, sqlite3, threading, time
+from collections import OrderedDict, deque
+
+DEDUP_TTL_S       = int(os.getenv("DEDUP_TTL_S", str(24 * 3600)))   # Meta reenvia por horas
+DEDUP_MAX_ITENS   = int(os.getenv("DEDUP_MAX_ITENS", "50000"))
+DEDUP_SQLITE_PATH = os.getenv("DEDUP_SQLITE_PATH", "").strip()     # vazio = só memória
+
+
+class DedupTTL:
+    """
+    Conjunto de ids já vistos, limitado por tempo (ttl_s) e por quantidade (max_itens).
+
+    OrderedDict em ordem de chegada: o id mais antigo está sempre na frente,
+    então expirar por tempo e despejar por tamanho custam O(1) amortizado.
+
+    Com caminho_sqlite, cada id novo é gravado no disco (write-through): sobrevive a
+    restart e é compartilhado entre workers do gunicorn que apontem para o mesmo arquivo.
+    """
+
+    def __init__(self, ttl_s: int = DEDUP_TTL_S, max_itens: int = DEDUP_MAX_ITENS,
+                 caminho_sqlite: str = DEDUP_SQLITE_PATH):
+        self.ttl_s = ttl_s
+        self.max_itens = max_itens
+        self._itens = OrderedDict()
+        self._lock = threading.Lock()
+        self._db = None
+        self._gravacoes = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.expirados = 0
+        self.despejados = 0
+
+        if caminho_sqlite:
+            self._abrir_sqlite(caminho_sqlite)
+
+    # ===== Persistência (opcional) ============================================
+    def _abrir_sqlite(self, caminho: str):
+        self._db = sqlite3.connect(caminho, timeout=5, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("CREATE TABLE IF NOT EXISTS dedup (chave TEXT PRIMARY KEY, ts REAL NOT NULL)")
+        self._db.execute("CREATE INDEX IF NOT EXISTS dedup_ts ON dedup (ts)")
+
+        corte = time.time() - self.ttl_s
+        self._db.execute("DELETE FROM dedup WHERE ts < ?", (corte,))
+        linhas = self._db.execute(
+            "SELECT chave, ts FROM (SELECT chave, ts FROM dedup ORDER BY ts DESC LIMIT ?) ORDER BY ts",
+            (self.max_itens,),
+        ).fetchall()
+        for chave, ts in linhas:
+            self._itens[chave] = ts
+        print(f"[DEDUP] {len(linhas)} ids recarregados de {caminho}")
+
+    def _gravar_sqlite(self, chave: str, agora: float) -> bool:
+        """Grava o id; retorna False se outro processo já tinha gravado dentro da janela."""
+        cur = self._db.execute("INSERT OR IGNORE INTO dedup (chave, ts) VALUES (?, ?)", (chave, agora))
+        if cur.rowcount == 0:
+            ts = self._db.execute("SELECT ts FROM dedup WHERE chave = ?", (chave,)).fetchone()
+            if ts and ts[0] >= agora - self.ttl_s:
+                return False
+            self._db.execute("UPDATE dedup SET ts = ? WHERE chave = ?", (agora, chave))
+
+        # Limpeza do disco de tempos em tempos (usa o índice em ts, sem varrer tudo)
+        self._gravacoes += 1
+        if self._gravacoes % 1000 == 0:
+            self._db.execute("DELETE FROM dedup WHERE ts < ?", (agora - self.ttl_s,))
+        return True
+
+    # ===== API ================================================================
+    def marcar_se_novo(self, chave: str) -> bool:
+        """True se o id é novo (e passa a ser lembrado); False se é repetido."""
+        agora = time.time()
+        with self._lock:
+            self._expirar(agora)
+
+            ts = self._itens.get(chave)
+            if ts is not None:
+                self.hits += 1
+                return False
+
+            if self._db is not None:
+                try:
+                    if not self._gravar_sqlite(chave, agora):
+                        self._itens[chave] = agora
+                        self.hits += 1
+                        return False
+                except sqlite3.Error as e:
+                    print("[DEDUP] erro sqlite:", e)
+
+            self._itens[chave] = agora
+            self.misses += 1
+            while len(self._itens) > self.max_itens:
+                self._itens.popitem(last=False)
+                self.despejados += 1
+            return True
+
+    def esquecer(self, chave: str):
+        """Remove o id (ex.: evento não pôde ser enfileirado e a Meta vai reenviar)."""
+        with self._lock:
+            self._itens.pop(chave, None)
+            if self._db is not None:
+                try:
+                    self._db.execute("DELETE FROM dedup WHERE chave = ?", (chave,))
+                except sqlite3.Error as e:
+                    print("[DEDUP] erro sqlite:", e)
+
+    def __contains__(self, chave) -> bool:
+        with self._lock:
+            ts = self._itens.get(chave)
+            return ts is not None and ts >= time.time() - self.ttl_s
+
+    def __len__(self) -> int:
+        return len(self._itens)
+
+    def _expirar(self, agora: float):
+        # chamado com self._lock adquirido
+        corte = agora - self.ttl_s
+        while self._itens:
+            chave, ts = next(iter(self._itens.items()))
+            if ts >= corte:
+                break
+            self._itens.popitem(last=False)
+            self.expirados += 1
+
+    # ===== Observabilidade ====================================================
+    def metricas(self) -> dict:
+        return {
+            "itens": len(self._itens),
+            "max_itens": self.max_itens,
+            "ttl_s": self.ttl_s,
+            "persistente": self._db is not None,
+            "hits": self.hits,
+            "misses": self.misses,
+            "expirados": self.expirados,
+            "despejados": self.despejados,
+        }
+
+
+# ===== Janela deslizante por minuto (solicitações repetidas) =================
+SOLICITACAO_JANELA_MIN = int(os.getenv("SOLICITACAO_JANELA_MIN", "5"))
+
+
+class JanelaDedup:
+    """
+    "Já vi esta chave nos últimos janela_min minutos?" com um balde (set) por
+    minuto: os baldes mais velhos que a janela saem inteiros da frente do deque,
+    então a memória fica limitada ao que chegou dentro da janela.
+
+    Com um armazém compartilhado (armazem_sessoes, sqlite/redis) a marcação é um
+    CAS de versão 0 com ttl = janela: insere só se a chave não existe (ou já
+    venceu), atômico entre workers.
+    """
+
+    def __init__(self, janela_min: int = SOLICITACAO_JANELA_MIN, armazem=None, espaco: str = "solicitacoes"):
+        self.janela_min = max(1, janela_min)
+        self.armazem = armazem if armazem is not None and armazem.compartilhado else None
+        self.espaco = espaco
+        self._baldes = deque()   # (minuto, set de chaves), do mais antigo para o atual
+        self._lock = threading.Lock()
+
+        self.novas = 0
+        self.suprimidas = 0
+
+    def _rotacionar(self, minuto: int):
+        # chamado com self._lock adquirido
+        while self._baldes and self._baldes[0][0] <= minuto - self.janela_min:
+            self._baldes.popleft()
+        if not self._baldes or self._baldes[-1][0] != minuto:
+            self._baldes.append((minuto, set()))
+
+    def marcar_se_nova(self, chave: str) -> bool:
+        """True se a chave é nova na janela (e passa a contar); False se é repetida."""
+        if self.armazem is not None:
+            try:
+                nova = self.armazem.cas(self.espaco, chave, int(time.time()), 0, self.janela_min * 60)
+            except Exception as e:
+                print("[DEDUP] erro no armazém, usando só a memória:", e)
+            else:
+                with self._lock:
+                    if nova:
+                        self.novas += 1
+                    else:
+                        self.suprimidas += 1
+                return nova
+
+        minuto = int(time.time() // 60)
+        with self._lock:
+            self._rotacionar(minuto)
+            if any(chave in chaves for _, chaves in self._baldes):
+                self.suprimidas += 1
+                return False
+            self._baldes[-1][1].add(chave)
+            self.novas += 1
+            return True
+
+    def metricas(self) -> dict:
+        with self._lock:
+            self._rotacionar(int(time.time() // 60))
+            chaves = sum(len(c) for _, c in self._baldes)
+        return {
+            "janela_min": self.janela_min,
+            "compartilhada": self.armazem is not None,
+            "chaves_na_janela": chaves if self.armazem is None else None,
+            "novas": self.novas,
+            "suprimidas": self.suprimidas,
+        }
@@ -0,0 +1,52 @@
+# eventos_meta.py — normalização dos eventos de mensagem recebidos da Meta
+# ==============================================================================
+from typing import List
+
+
+class EventoEntrada:
+    """Uma mensagem recebida, já separada do envelope entry/changes/value."""
+    __slots__ = ("wa_id", "nome", "message_id", "tipo", "msg", "phone_number_id")
+
+    def __init__(self, wa_id: str, nome: str, message_id: str, tipo: str, msg: dict,
+                 phone_number_id: str = ""):
+        self.wa_id = wa_id
+        self.nome = nome
+        self.message_id = message_id
+        self.tipo = tipo
+        self.msg = msg
+        self.phone_number_id = phone_number_id
+
+    def __repr__(self):
+        return f"EventoEntrada({self.wa_id!r}, {self.tipo!r}, {self.message_id!r})"
+
+
+def extrair_eventos(data: dict) -> List[EventoEntrada]:
+    """
+    Percorre todos os entry → changes → messages do payload em uma única passada.
+    A Meta pode agrupar várias mensagens (de um ou mais pacientes) na mesma entrega.
+    """
+    eventos = []
+    for entry in data.get("entry") or []:
+        for change in entry.get("changes") or []:
+            value = change.get("value") or {}
+            messages = value.get("messages")
+            if not messages:
+                continue
+
+            contacts = value.get("contacts") or []
+            nomes = {c.get("wa_id"): (c.get("profile") or {}).get("name") or "" for c in contacts}
+            phone_number_id = (value.get("metadata") or {}).get("phone_number_id", "")
+
+            for msg in messages:
+                wa_id = msg.get("from")
+                if not wa_id:
+                    continue
+                eventos.append(EventoEntrada(
+                    wa_id=wa_id,
+                    nome=nomes.get(wa_id, ""),
+                    message_id=msg.get("id") or "",
+                    tipo=msg.get("type") or "",
+                    msg=msg,
+                    phone_number_id=phone_number_id,
+                ))
+    return eventos
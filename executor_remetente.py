@@ -0,0 +1,138 @@
+# executor_remetente.py — mensagens do mesmo wa_id em ordem, pacientes diferentes em paralelo
+# ==============================================================================
+import os, threading, time
+from collections import deque
+
+from fila_eventos import FilaEventos
+from metricas import Estatistica
+
+EXECUTOR_WORKERS      = int(os.getenv("WEBHOOK_WORKERS", "4"))
+EXECUTOR_MAX_PENDENTES = int(os.getenv("WEBHOOK_FILA_MAX", "1000"))
+# Quantas mensagens seguidas uma raia processa antes de ceder o worker
+EXECUTOR_QUANTUM      = int(os.getenv("WEBHOOK_QUANTUM", "8"))
+
+
+class _Raia:
+    """Fila serial de um remetente. Existe só enquanto houver trabalho pendente."""
+    __slots__ = ("chave", "tarefas", "ativa")
+
+    def __init__(self, chave):
+        self.chave = chave
+        self.tarefas = deque()
+        self.ativa = False
+
+
+class ExecutorPorRemetente:
+    """
+    Uma raia serial por chave (wa_id), multiplexada sobre o pool fixo da FilaEventos.
+    - mesma chave: executa na ordem de chegada, nunca em paralelo (estágios do SESS)
+    - chaves diferentes: rodam em paralelo, até o número de workers
+    - raia vazia é descartada na hora (memória proporcional a quem está conversando)
+    """
+
+    def __init__(self, workers: int = EXECUTOR_WORKERS, max_pendentes: int = EXECUTOR_MAX_PENDENTES,
+                 quantum: int = EXECUTOR_QUANTUM, nome: str = "remetentes"):
+        # Cada raia ocupa no máximo uma vaga no pool, então o pool nunca enche
+        # antes do limite de pendentes.
+        self._pool = FilaEventos(workers=workers, maxsize=max_pendentes + 1, nome=nome)
+        self._raias = {}
+        self._lock = threading.Lock()
+        self.max_pendentes = max_pendentes
+        self.quantum = max(1, quantum)
+        self.nome = nome
+
+        self._pendentes = 0
+        self.submetidos = 0
+        self.processados = 0
+        self.erros = 0
+        self.rejeitados = 0
+        self.raias_criadas = 0
+        self.raias_recuperadas = 0
+        self.espera_ms = Estatistica()
+        self.processamento_ms = Estatistica()
+
+    # ===== Produção ===========================================================
+    def submeter(self, chave, fn, *args) -> bool:
+        """Enfileira fn(*args) na raia da chave. False se o limite de pendentes estourou."""
+        with self._lock:
+            if self._pendentes >= self.max_pendentes:
+                self.rejeitados += 1
+                print(f"⚠️ [{self.nome}] limite de pendentes ({self.max_pendentes}) — evento rejeitado")
+                return False
+            raia = self._raias.get(chave)
+            if raia is None:
+                raia = _Raia(chave)
+                self._raias[chave] = raia
+                self.raias_criadas += 1
+            raia.tarefas.append((time.monotonic(), fn, args))
+            self._pendentes += 1
+            self.submetidos += 1
+            agendar = not raia.ativa
+            raia.ativa = True
+
+        if agendar:
+            self._pool.submeter(self._drenar, raia)
+        return True
+
+    # ===== Consumo ============================================================
+    def _drenar(self, raia: _Raia):
+        for _ in range(self.quantum):
+            with self._lock:
+                if not raia.tarefas:
+                    self._recuperar(raia)
+                    return
+                t_fila, fn, args = raia.tarefas.popleft()
+                self._pendentes -= 1
+
+            inicio = time.monotonic()
+            self.espera_ms.registrar((inicio - t_fila) * 1000)
+            try:
+                fn(*args)
+                self.processados += 1
+            except Exception as e:
+                self.erros += 1
+                print(f"❌ [{self.nome}] erro na raia {raia.chave}:", e)
+            finally:
+                self.processamento_ms.registrar((time.monotonic() - inicio) * 1000)
+
+        # Quantum esgotado: volta para o fim da fila do pool para não monopolizar um worker
+        with self._lock:
+            if not raia.tarefas:
+                self._recuperar(raia)
+                return
+        self._pool.submeter(self._drenar, raia)
+
+    def _recuperar(self, raia: _Raia):
+        # chamado com self._lock adquirido
+        raia.ativa = False
+        if self._raias.get(raia.chave) is raia:
+            del self._raias[raia.chave]
+            self.raias_recuperadas += 1
+
+    def aguardar(self):
+        """Bloqueia até todas as raias esvaziarem (uso em scripts/benchmarks)."""
+        while True:
+            self._pool.aguardar()
+            with self._lock:
+                if not self._raias:
+                    return
+
+    # ===== Observabilidade ====================================================
+    def metricas(self) -> dict:
+        with self._lock:
+            raias_ativas = len(self._raias)
+            pendentes = self._pendentes
+        return {
+            "pendentes": pendentes,
+            "max_pendentes": self.max_pendentes,
+            "raias_ativas": raias_ativas,
+            "raias_criadas": self.raias_criadas,
+            "raias_recuperadas": self.raias_recuperadas,
+            "submetidos": self.submetidos,
+            "processados": self.processados,
+            "erros": self.erros,
+            "rejeitados": self.rejeitados,
+            "espera_ms": self.espera_ms.resumo(),
+            "processamento_ms": self.processamento_ms.resumo(),
+            "pool": self._pool.metricas(),
+        }
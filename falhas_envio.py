@@ -0,0 +1,161 @@
+# falhas_envio.py — classificação de erros da Graph API e fila de envios mortos (dead-letter)
+# ==============================================================================
+# Uso (reprocessar depois de corrigir token, template, etc.):
+#   python falhas_envio.py listar [--limite 50]
+#   python falhas_envio.py reenviar [--limite 50] [--id 12]
+import os, json, random, sqlite3, sys, threading, time
+
+from whatsapp_client import RespostaEnvio
+
+WA_TENTATIVAS      = int(os.getenv("WA_TENTATIVAS", "4"))
+WA_BACKOFF_BASE_S  = float(os.getenv("WA_BACKOFF_BASE_S", "0.5"))
+WA_BACKOFF_MAX_S   = float(os.getenv("WA_BACKOFF_MAX_S", "8"))
+WA_DEADLETTER_PATH = os.getenv("WA_DEADLETTER_PATH", "envios_falhos.sqlite3").strip()
+
+# Vale tentar de novo: instabilidade / limite de taxa da Meta
+CODIGOS_TEMPORARIOS = {1, 2, 4, 17, 341, 80007, 130429, 131000, 131016, 131048, 131056, 133004}
+# Não adianta repetir: token, permissão, destinatário, janela de 24h, template, parâmetros
+CODIGOS_PERMANENTES = {10, 100, 190, 200, 131008, 131009, 131021, 131026, 131047, 131051,
+                       132000, 132001, 132005, 132007, 132012, 132015, 132016, 133010}
+
+OK, TEMPORARIO, PERMANENTE, INCERTO = "ok", "temporario", "permanente", "incerto"
+
+
+def classificar(resp: RespostaEnvio) -> str:
+    """
+    POST /messages não é idempotente: só se repete o que a Meta com certeza não
+    entregou — conexão que nem abriu, ou 429/5xx com corpo de erro. Timeout de
+    leitura e 5xx sem corpo (proxy no meio) ficam INCERTO: não repetem e vão para
+    a fila morta, para alguém conferir antes de reenviar.
+    """
+    if resp.ok:
+        return OK
+    if resp.status_code == 0:
+        return TEMPORARIO if resp.nao_enviado else INCERTO
+    if resp.erro_codigo in CODIGOS_PERMANENTES:
+        return PERMANENTE
+    if resp.erro_codigo in CODIGOS_TEMPORARIOS:
+        return TEMPORARIO
+    if resp.status_code == 429 or resp.status_code >= 500:
+        return TEMPORARIO if resp.texto else INCERTO
+    return PERMANENTE
+
+
+def espera_backoff(tentativa: int) -> float:
+    """Exponencial com jitter total: uniforme entre 0 e base·2^tentativa (limitado)."""
+    teto = min(WA_BACKOFF_MAX_S, WA_BACKOFF_BASE_S * (2 ** tentativa))
+    return random.uniform(0, teto)
+
+
+class FilaMorta:
+    """Tabela SQLite com os envios que falharam de vez. Aberta só na primeira falha."""
+
+    def __init__(self, caminho: str = WA_DEADLETTER_PATH):
+        self.caminho = caminho
+        self._db = None
+        self._lock = threading.Lock()
+        self.registrados = 0
+        self.reenviados = 0
+
+    def _conexao(self):
+        if self._db is None:
+            self._db = sqlite3.connect(self.caminho, timeout=5, check_same_thread=False, isolation_level=None)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("""
+                CREATE TABLE IF NOT EXISTS envios_falhos (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    ts REAL NOT NULL,
+                    tipo TEXT, prioridade INTEGER, destino TEXT,
+                    payload TEXT NOT NULL,
+                    status_code INTEGER, erro_codigo INTEGER, erro_msg TEXT,
+                    classe TEXT, tentativas INTEGER,
+                    reenviado_em REAL
+                )""")
+        return self._db
+
+    def registrar(self, payload, tipo: str, prioridade: int, resp: RespostaEnvio,
+                  classe: str, tentativas: int):
+        if isinstance(payload, (bytes, bytearray)):
+            payload = json.loads(payload)
+        try:
+            with self._lock:
+                self._conexao().execute(
+                    "INSERT INTO envios_falhos (ts, tipo, prioridade, destino, payload, status_code, "
+                    "erro_codigo, erro_msg, classe, tentativas) VALUES (?,?,?,?,?,?,?,?,?,?)",
+                    (time.time(), tipo, prioridade, payload.get("to"), json.dumps(payload, ensure_ascii=False),
+                     resp.status_code, resp.erro_codigo, (resp.erro_msg or "")[:500], classe, tentativas),
+                )
+            self.registrados += 1
+            print(f"🪦 [ENVIOS] falha {classe} p/ {payload.get('to')} após {tentativas} tentativa(s): "
+                  f"{resp.erro_codigo or resp.status_code} {resp.erro_msg[:120]}")
+        except sqlite3.Error as e:
+            print("❌ [ENVIOS] não consegui gravar dead-letter:", e, json.dumps(payload, ensure_ascii=False))
+
+    def pendentes(self, limite: int = 50, id_: int = None) -> list:
+        with self._lock:
+            sql = ("SELECT id, ts, tipo, prioridade, payload, erro_codigo, erro_msg, classe "
+                   "FROM envios_falhos WHERE reenviado_em IS NULL")
+            args = ()
+            if id_ is not None:
+                sql += " AND id = ?"
+                args = (id_,)
+            sql += " ORDER BY id LIMIT ?"
+            return self._conexao().execute(sql, args + (limite,)).fetchall()
+
+    def marcar_reenviado(self, id_: int):
+        with self._lock:
+            self._conexao().execute("UPDATE envios_falhos SET reenviado_em = ? WHERE id = ?", (time.time(), id_))
+        self.reenviados += 1
+
+    def contar_pendentes(self) -> int:
+        if self._db is None and not os.path.exists(self.caminho):
+            return 0
+        with self._lock:
+            return self._conexao().execute(
+                "SELECT COUNT(*) FROM envios_falhos WHERE reenviado_em IS NULL").fetchone()[0]
+
+    def metricas(self) -> dict:
+        return {
+            "registrados": self.registrados,
+            "reenviados": self.reenviados,
+            "pendentes": self.contar_pendentes(),
+        }
+
+
+# ===== Replay ================================================================
+def reenviar(limite: int = 50, id_: int = None):
+    from agendador_envios import agendador
+
+    fila = agendador().fila_morta
+    linhas = fila.pendentes(limite, id_)
+    ok = 0
+    for id_linha, _ts, tipo, prioridade, payload, *_ in linhas:
+        resp = agendador().enviar(json.loads(payload), prioridade=prioridade, tipo=tipo, registrar_falha=False)
+        if resp.ok:
+            fila.marcar_reenviado(id_linha)
+            ok += 1
+        print(f"{'✅' if resp.ok else '❌'} #{id_linha} {tipo}: {resp!r}")
+    print(f"Reenviados {ok}/{len(linhas)}")
+
+
+def _main(argv):
+    import argparse
+    ap = argparse.ArgumentParser(description="Envios WhatsApp que falharam de vez")
+    ap.add_argument("acao", choices=["listar", "reenviar"])
+    ap.add_argument("--limite", type=int, default=50)
+    ap.add_argument("--id", type=int, default=None)
+    args = ap.parse_args(argv)
+
+    if args.acao == "listar":
+        for id_linha, ts, tipo, _p, payload, codigo, msg, classe in FilaMorta().pendentes(args.limite, args.id):
+            quando = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(ts))
+            destino = json.loads(payload).get("to")
+            print(f"#{id_linha} {quando} {tipo} → {destino} [{classe} {codigo}] {msg}")
+    else:
+        from dotenv import load_dotenv
+        load_dotenv()
+        reenviar(args.limite, args.id)
+
+
+if __name__ == "__main__":
+    _main(sys.argv[1:])
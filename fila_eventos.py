@@ -0,0 +1,96 @@
+# fila_eventos.py — fila de ingestão do webhook (responde 200 na hora, processa em background)
+# ==============================================================================
+import os, queue, threading, time
+
+from metricas import Estatistica
+
+FILA_MAX     = int(os.getenv("WEBHOOK_FILA_MAX", "1000"))
+FILA_WORKERS = int(os.getenv("WEBHOOK_WORKERS", "4"))
+
+
+class FilaEventos:
+    """
+    Fila limitada + pool fixo de threads.
+    O webhook só valida e chama submeter(); os workers executam o trabalho pesado
+    (transcrição, Claude, Graph API, Apps Script) fora da thread da requisição.
+
+    As threads são criadas no primeiro submeter() — importante com gunicorn,
+    que faz fork dos workers depois de importar o módulo.
+    """
+
+    def __init__(self, workers: int = FILA_WORKERS, maxsize: int = FILA_MAX, nome: str = "fila"):
+        self.nome = nome
+        self.workers = max(1, workers)
+        self._fila = queue.Queue(maxsize=maxsize)
+        self._lock = threading.Lock()
+        self._threads = []
+        self._pid = None
+
+        self.enfileirados = 0
+        self.processados = 0
+        self.erros = 0
+        self.rejeitados = 0
+        self.espera_ms = Estatistica()
+        self.processamento_ms = Estatistica()
+
+    # ===== Ciclo de vida ======================================================
+    def _garantir_workers(self):
+        pid = os.getpid()
+        if self._pid == pid:
+            return
+        with self._lock:
+            if self._pid == pid:
+                return
+            self._threads = []
+            for i in range(self.workers):
+                t = threading.Thread(target=self._loop, name=f"{self.nome}-{i}", daemon=True)
+                t.start()
+                self._threads.append(t)
+            self._pid = pid
+
+    # ===== Produção ===========================================================
+    def submeter(self, fn, *args) -> bool:
+        """Enfileira fn(*args). Retorna False se a fila estiver cheia (backpressure)."""
+        self._garantir_workers()
+        try:
+            self._fila.put_nowait((time.monotonic(), fn, args))
+        except queue.Full:
+            self.rejeitados += 1
+            print(f"⚠️ [{self.nome}] fila cheia ({self._fila.maxsize}) — evento rejeitado")
+            return False
+        self.enfileirados += 1
+        return True
+
+    # ===== Consumo ============================================================
+    def _loop(self):
+        while True:
+            t_fila, fn, args = self._fila.get()
+            inicio = time.monotonic()
+            self.espera_ms.registrar((inicio - t_fila) * 1000)
+            try:
+                fn(*args)
+                self.processados += 1
+            except Exception as e:
+                self.erros += 1
+                print(f"❌ [{self.nome}] erro ao processar evento:", e)
+            finally:
+                self.processamento_ms.registrar((time.monotonic() - inicio) * 1000)
+                self._fila.task_done()
+
+    def aguardar(self):
+        """Bloqueia até a fila esvaziar (uso em scripts/simulações)."""
+        self._fila.join()
+
+    # ===== Observabilidade ====================================================
+    def metricas(self) -> dict:
+        return {
+            "profundidade": self._fila.qsize(),
+            "capacidade": self._fila.maxsize,
+            "workers": self.workers,
+            "enfileirados": self.enfileirados,
+            "processados": self.processados,
+            "erros": self.erros,
+            "rejeitados": self.rejeitados,
+            "espera_ms": self.espera_ms.resumo(),
+            "processamento_ms": self.processamento_ms.resumo(),
+        }
@@ -0,0 +1,209 @@
+# fila_webapp.py — gravação write-behind no WebApp do Apps Script (lotes por tamanho/tempo)
+# ==============================================================================
+# O Apps Script costuma levar 2–8s por POST. Em vez de o paciente esperar, os
+# registros (acessos, solicitações, pesquisas, sugestões) entram numa fila e uma
+# thread os envia em lote: um único POST com a lista de linhas, disparado quando
+# o lote enche (SHEETS_LOTE_MAX) ou quando o mais antigo passa de SHEETS_FLUSH_MS.
+#
+# Contrato do lote: {"secret", "rota": "chatbot_lote", "registros": [ {...}, ... ]}
+#   resposta esperada: {"ok": true, "gravados": <len(registros)>}
+# O POST em lote só é usado com SHEETS_LOTE_ATIVO=1, depois de publicar um intake
+# com a rota "chatbot_lote": o doPost antigo não conhece a rota e gravaria o corpo
+# do lote como uma linha. Desligado (padrão), a fila continua juntando os
+# registros, mas envia linha a linha. Se o WebApp responder e não reconhecer o
+# lote, o modo individual passa a valer neste processo.
+#
+# Durabilidade: cada registro passa antes pela CaixaSaida (SQLite). A fila em
+# memória é só o caminho rápido; o que falhar, ou ficar para trás num restart,
+# é reenviado pela varredura periódica da outbox.
+import os, queue, threading, time
+from typing import Callable, List, Optional
+
+from caixa_saida import CaixaSaida
+from falhas_envio import espera_backoff
+from metricas import Estatistica
+
+SHEETS_LOTE_ATIVO  = os.getenv("SHEETS_LOTE_ATIVO", "0").strip().lower() in ("1", "true", "sim")
+SHEETS_LOTE_MAX    = int(os.getenv("SHEETS_LOTE_MAX", "25"))
+SHEETS_FLUSH_MS    = int(os.getenv("SHEETS_FLUSH_MS", "2000"))
+SHEETS_FILA_MAX    = int(os.getenv("SHEETS_FILA_MAX", "2000"))
+SHEETS_TENTATIVAS  = int(os.getenv("SHEETS_TENTATIVAS", "3"))
+SHEETS_REENVIO_S   = float(os.getenv("SHEETS_REENVIO_S", "60"))     # pausa após esgotar as tentativas
+SHEETS_VARREDURA_S = float(os.getenv("SHEETS_VARREDURA_S", "15"))   # outbox: procura pendentes vencidos
+
+
+class FilaWebApp:
+    """
+    postar_lote(registros) -> bool   um POST com vários registros: True = gravou,
+                                     False = erro (tenta de novo), None = lote sem suporte
+    postar_um(registro)    -> bool   POST de um registro (modo antigo / fallback)
+
+    Backpressure: com a outbox cheia (SHEETS_OUTBOX_MAX), enfileirar() devolve False
+    e quem chamou grava de forma síncrona — o produtor é que desacelera.
+    Com a fila em memória cheia o registro fica só no disco e sai na varredura.
+    """
+
+    def __init__(self, postar_lote: Callable[[List[dict]], Optional[bool]], postar_um: Callable[[dict], bool],
+                 caixa: Optional[CaixaSaida] = None, max_lote: int = SHEETS_LOTE_MAX,
+                 janela_ms: int = SHEETS_FLUSH_MS, max_pendentes: int = SHEETS_FILA_MAX, nome: str = "sheets",
+                 lote_ativo: bool = SHEETS_LOTE_ATIVO):
+        self.nome = nome
+        self._postar_lote = postar_lote
+        self._postar_um = postar_um
+        self.caixa = caixa or CaixaSaida()
+        self.max_lote = max(1, max_lote)
+        self.janela = janela_ms / 1000.0
+        self._fila = queue.Queue(maxsize=max_pendentes)
+        self._lock = threading.Lock()
+        self._pid = None
+        self.lote_suportado = lote_ativo
+
+        self.enfileirados = 0
+        self.so_disco = 0
+        self.rejeitados = 0
+        self.gravados = 0
+        self.adiados = 0
+        self.lotes = 0
+        self.varreduras = 0
+        self.tamanho_lote = Estatistica()
+        self.flush_ms = Estatistica()
+        self.espera_ms = Estatistica()
+
+    # ===== Ciclo de vida ======================================================
+    def iniciar(self):
+        """Sobe a thread de envio neste processo (idempotente, barato)."""
+        pid = os.getpid()
+        if self._pid == pid:
+            return
+        with self._lock:
+            if self._pid == pid:
+                return
+            threading.Thread(target=self._loop, name=self.nome, daemon=True).start()
+            self._pid = pid
+
+    # ===== Produção ===========================================================
+    def enfileirar(self, registro: dict, chave: str) -> bool:
+        self.iniciar()
+        if self.caixa.cheia():
+            self.rejeitados += 1
+            print(f"⚠️ [{self.nome}] outbox cheia ({self.caixa.max_itens}) — gravando de forma síncrona")
+            return False
+        rapido = not self._fila.full()
+        if not self.caixa.gravar(chave, registro, reservar=rapido):
+            return True                       # mesma chave já está na outbox
+        if rapido:
+            try:
+                self._fila.put_nowait((time.monotonic(), chave, registro))
+                self.enfileirados += 1
+                return True
+            except queue.Full:
+                self.caixa.adiar([chave], 0)
+        self.so_disco += 1
+        return True
+
+    # ===== Consumo ============================================================
+    def _loop(self):
+        self._varrer()
+        ultima_varredura = time.monotonic()
+        while True:
+            try:
+                primeiro = self._fila.get(timeout=SHEETS_VARREDURA_S)
+            except queue.Empty:
+                primeiro = None
+            if primeiro is not None:
+                lote = [primeiro]
+                prazo = primeiro[0] + self.janela
+                while len(lote) < self.max_lote:
+                    resta = prazo - time.monotonic()
+                    if resta <= 0:
+                        break
+                    try:
+                        lote.append(self._fila.get(timeout=resta))
+                    except queue.Empty:
+                        break
+                try:
+                    self._gravar(lote)
+                except Exception as e:
+                    print(f"❌ [{self.nome}] erro ao gravar lote:", e)
+                finally:
+                    for _ in lote:
+                        self._fila.task_done()
+            if time.monotonic() - ultima_varredura >= SHEETS_VARREDURA_S:
+                self._varrer()
+                ultima_varredura = time.monotonic()
+
+    def _varrer(self):
+        """Reenvia o que está vencido na outbox (falhas anteriores, restart, fila cheia)."""
+        try:
+            while True:
+                itens = self.caixa.reservar(self.max_lote)
+                if not itens:
+                    return
+                self.varreduras += 1
+                agora = time.monotonic()
+                self._gravar([(agora, c, r) for c, r in itens])
+        except Exception as e:
+            print(f"❌ [{self.nome}] erro na varredura da outbox:", e)
+
+    def _gravar(self, lote):
+        agora = time.monotonic()
+        for t_fila, _, _ in lote:
+            self.espera_ms.registrar((agora - t_fila) * 1000)
+        pares = [(c, r) for _, c, r in lote]
+
+        inicio = time.monotonic()
+        for tentativa in range(SHEETS_TENTATIVAS):
+            restantes = self._enviar(pares)
+            if len(restantes) < len(pares):
+                faltam = {c for c, _ in restantes}
+                self.caixa.confirmar([c for c, _ in pares if c not in faltam])
+            pares = restantes
+            if not pares:
+                break
+            if tentativa < SHEETS_TENTATIVAS - 1:
+                time.sleep(espera_backoff(tentativa))
+        if pares:
+            self.adiados += len(pares)
+            self.caixa.adiar([c for c, _ in pares], SHEETS_REENVIO_S, "WebApp não confirmou")
+            print(f"⏳ [{self.nome}] {len(pares)} registro(s) ficam na outbox; nova tentativa em {SHEETS_REENVIO_S:.0f}s")
+
+        self.lotes += 1
+        self.gravados += len(lote) - len(pares)
+        self.tamanho_lote.registrar(len(lote))
+        self.flush_ms.registrar((time.monotonic() - inicio) * 1000)
+
+    def _enviar(self, pares: List[tuple]) -> List[tuple]:
+        """Tenta gravar; devolve os (chave, registro) que ainda faltam."""
+        if self.lote_suportado and len(pares) > 1:
+            gravou = self._postar_lote([r for _, r in pares])
+            if gravou:
+                return []
+            if gravou is False:
+                return pares
+            self.lote_suportado = False
+            print(f"ℹ️ [{self.nome}] WebApp não aceitou lote — seguindo linha a linha")
+        return [(c, r) for c, r in pares if not self._postar_um(r)]
+
+    def aguardar(self):
+        """Bloqueia até a fila em memória esvaziar (scripts / encerramento)."""
+        if self._pid == os.getpid():
+            self._fila.join()
+
+    # ===== Observabilidade ====================================================
+    def metricas(self) -> dict:
+        return {
+            "fila_memoria": self._fila.qsize(),
+            "capacidade": self._fila.maxsize,
+            "lote_suportado": self.lote_suportado,
+            "enfileirados": self.enfileirados,
+            "so_disco": self.so_disco,
+            "rejeitados_sincronos": self.rejeitados,
+            "gravados": self.gravados,
+            "adiados": self.adiados,
+            "lotes": self.lotes,
+            "varreduras": self.varreduras,
+            "tamanho_lote": self.tamanho_lote.resumo(),
+            "flush_ms": self.flush_ms.resumo(),
+            "espera_ms": self.espera_ms.resumo(),
+            "outbox": self.caixa.metricas(),
+        }
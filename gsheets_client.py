@@ -1,27 +1,218 @@
 # gsheets_client.py
-import os, json
-from google.oauth2.service_account import Credentials
-from googleapiclient.discovery import build
+import os, json, atexit, threading, time
+from uuid import uuid4
+
+from caixa_saida import CaixaSaida
+from falhas_envio import espera_backoff
+from metricas import Estatistica
 
 SCOPES = ["https://www.googleapis.com/auth/spreadsheets"]
 SHEET_ID = os.getenv("CLINICA_SHEET_ID")
 
+# Agrupamento de linhas por aba (0 = cada _append vai direto para a API)
+GSHEETS_AGRUPAR_MS = int(os.getenv("GSHEETS_AGRUPAR_MS", "1000"))
+GSHEETS_LOTE_MAX   = int(os.getenv("GSHEETS_LOTE_MAX", "200"))
+GSHEETS_TENTATIVAS = int(os.getenv("GSHEETS_TENTATIVAS", "3"))
+# Lotes que esgotaram as tentativas vão para uma outbox SQLite e são reenviados depois
+GSHEETS_OUTBOX_PATH = os.getenv("GSHEETS_OUTBOX_PATH", "outbox_gsheets.sqlite3").strip()
+GSHEETS_REENVIO_S   = float(os.getenv("GSHEETS_REENVIO_S", "60"))
+
+# ===== Cliente (credencial única no processo, service por thread) =====
+# As credenciais guardam o access token e o renovam sozinhas quando expira.
+# O service do googleapiclient usa httplib2, que não é thread-safe: um por thread.
+_CREDS = None
+_CREDS_LOCK = threading.Lock()
+_LOCAL = threading.local()
+
+def _credenciais():
+  global _CREDS
+  if _CREDS is None:
+    with _CREDS_LOCK:
+      if _CREDS is None:
+        creds_json = os.getenv("GOOGLE_CREDENTIALS_JSON")
+        if not creds_json:
+          raise RuntimeError("Env var GOOGLE_CREDENTIALS_JSON ausente")
+        from google.oauth2.service_account import Credentials
+        info = json.loads(creds_json)
+        _CREDS = Credentials.from_service_account_info(info, scopes=SCOPES)
+  return _CREDS
+
 def _service():
-  creds_json = os.getenv("GOOGLE_CREDENTIALS_JSON")
-  if not creds_json:
-    raise RuntimeError("Env var GOOGLE_CREDENTIALS_JSON ausente")
-  info = json.loads(creds_json)
-  creds = Credentials.from_service_account_info(info, scopes=SCOPES)
-  return build("sheets", "v4", credentials=creds, cache_discovery=False)
+  svc = getattr(_LOCAL, "service", None)
+  if svc is None or getattr(_LOCAL, "pid", None) != os.getpid():
+    from googleapiclient.discovery import build
+    svc = _LOCAL.service = build("sheets", "v4", credentials=_credenciais(), cache_discovery=False)
+    _LOCAL.pid = os.getpid()
+  return svc
 
-def _append(aba: str, values: list):
-  body = {"values": [values]}
+def append_many(aba: str, rows: list):
+  """Várias linhas na mesma aba com uma única chamada values().append."""
+  if not rows:
+    return None
+  body = {"values": [list(r) for r in rows]}
   return _service().spreadsheets().values().append(
     spreadsheetId=SHEET_ID, range=f"{aba}!A:Z",
     valueInputOption="USER_ENTERED",
     insertDataOption="INSERT_ROWS", body=body
   ).execute()
 
+# ===== Agrupamento por aba =====
+class AgrupadorAbas:
+  """
+  Junta as linhas pendentes de cada aba e grava tudo numa chamada por aba:
+  quando uma aba chega a max_lote linhas ou quando a mais antiga passa de janela_ms.
+  Lote que falha em todas as tentativas vai para a outbox (CaixaSaida) e é
+  reenviado a cada GSHEETS_REENVIO_S — inclusive o que sobrou de um restart.
+  """
+
+  def __init__(self, gravar=append_many, janela_ms: int = GSHEETS_AGRUPAR_MS,
+               max_lote: int = GSHEETS_LOTE_MAX, caixa: CaixaSaida = None):
+    self._gravar = gravar
+    self.caixa = caixa or CaixaSaida(GSHEETS_OUTBOX_PATH)
+    self.janela = janela_ms / 1000.0
+    self.max_lote = max(1, max_lote)
+    self._pendentes = {}          # aba -> [linhas]
+    self._inicio = {}             # aba -> monotonic da linha mais antiga
+    self._cond = threading.Condition()
+    self._pid = None
+    self._gravando = 0
+
+    self.linhas = 0
+    self.chamadas = 0
+    self.perdidas = 0
+    self.na_outbox = 0
+    self.reenviadas = 0
+    self.linhas_por_chamada = Estatistica()
+    self.flush_ms = Estatistica()
+
+  def _garantir_thread(self):
+    pid = os.getpid()
+    if self._pid != pid:
+      with self._cond:
+        if self._pid != pid:
+          threading.Thread(target=self._loop, name="gsheets", daemon=True).start()
+          self._pid = pid
+
+  def adicionar(self, aba: str, linha: list):
+    self._garantir_thread()
+    with self._cond:
+      fila = self._pendentes.setdefault(aba, [])
+      if not fila:
+        self._inicio[aba] = time.monotonic()
+      fila.append(linha)
+      if len(fila) == 1 or len(fila) >= self.max_lote:
+        self._cond.notify()       # novo prazo ou lote cheio
+
+  def _vencidas(self, agora: float) -> list:
+    return [aba for aba, linhas in self._pendentes.items()
+            if linhas and (len(linhas) >= self.max_lote or agora - self._inicio[aba] >= self.janela)]
+
+  def _loop(self):
+    proxima_varredura = time.monotonic()   # já na subida: pega a outbox de um processo anterior
+    while True:
+      with self._cond:
+        while True:
+          agora = time.monotonic()
+          prontas = self._vencidas(agora)
+          if prontas or agora >= proxima_varredura:
+            break
+          prazos = [self._inicio[a] + self.janela for a, l in self._pendentes.items() if l]
+          self._cond.wait(timeout=min(prazos + [proxima_varredura]) - agora)
+        lotes = [(aba, self._pendentes.pop(aba)) for aba in prontas]
+        self._gravando += 1
+      try:
+        for aba, linhas in lotes:
+          self._descarregar(aba, linhas)
+        if agora >= proxima_varredura:
+          proxima_varredura = agora + GSHEETS_REENVIO_S
+          self._reenviar()
+      finally:
+        with self._cond:
+          self._gravando -= 1
+          self._cond.notify_all()
+
+  def _descarregar(self, aba: str, linhas: list):
+    inicio = time.monotonic()
+    for tentativa in range(GSHEETS_TENTATIVAS):
+      try:
+        self._gravar(aba, linhas)
+        break
+      except Exception as e:
+        print(f"[GSHEETS] erro ao gravar {len(linhas)} linha(s) em {aba} (tentativa {tentativa + 1}):", e)
+        if tentativa < GSHEETS_TENTATIVAS - 1:
+          time.sleep(espera_backoff(tentativa))
+    else:
+      self._guardar(aba, linhas)
+      return
+    self.linhas += len(linhas)
+    self.chamadas += 1
+    self.linhas_por_chamada.registrar(len(linhas))
+    self.flush_ms.registrar((time.monotonic() - inicio) * 1000)
+
+  def _guardar(self, aba: str, linhas: list):
+    try:
+      self.caixa.gravar(f"{aba}-{uuid4().hex}", {"aba": aba, "linhas": linhas}, reservar=False)
+    except Exception as e:
+      self.perdidas += len(linhas)
+      print(f"❌ [GSHEETS] linhas não gravadas em {aba} ({e}):", json.dumps(linhas, ensure_ascii=False, default=str))
+      return
+    self.na_outbox += len(linhas)
+    print(f"📦 [GSHEETS] {len(linhas)} linha(s) de {aba} na outbox; nova tentativa em {GSHEETS_REENVIO_S:.0f}s")
+
+  def _reenviar(self):
+    """Tenta de novo os lotes que estão na outbox (um append por lote)."""
+    if not self.na_outbox and not os.path.exists(self.caixa.caminho):
+      return
+    try:
+      itens = self.caixa.reservar(50)
+    except Exception as e:
+      print("❌ [GSHEETS] erro ao ler a outbox:", e)
+      return
+    for chave, item in itens:
+      try:
+        self._gravar(item["aba"], item["linhas"])
+      except Exception as e:
+        self.caixa.adiar([chave], GSHEETS_REENVIO_S, str(e))
+        continue
+      self.caixa.confirmar([chave])
+      self.reenviadas += len(item["linhas"])
+      self.linhas += len(item["linhas"])
+      self.chamadas += 1
+
+  def descarregar(self):
+    """Grava já tudo que está pendente e espera terminar (scripts / encerramento)."""
+    if self._pid != os.getpid():
+      return
+    with self._cond:
+      for aba in self._inicio:
+        self._inicio[aba] = float("-inf")
+      self._cond.notify_all()
+      while any(self._pendentes.values()) or self._gravando:
+        self._cond.wait(timeout=1)
+
+  def metricas(self) -> dict:
+    with self._cond:
+      pendentes = {aba: len(l) for aba, l in self._pendentes.items() if l}
+    return {
+      "pendentes_por_aba": pendentes,
+      "linhas": self.linhas,
+      "chamadas": self.chamadas,
+      "perdidas": self.perdidas,
+      "na_outbox": self.na_outbox,
+      "reenviadas": self.reenviadas,
+      "linhas_por_chamada": self.linhas_por_chamada.resumo(),
+      "flush_ms": self.flush_ms.resumo(),
+    }
+
+AGRUPADOR = AgrupadorAbas()
+atexit.register(AGRUPADOR.descarregar)
+
+def _append(aba: str, values: list):
+  if GSHEETS_AGRUPAR_MS > 0:
+    AGRUPADOR.adicionar(aba, values)
+    return {"enfileirado": True, "aba": aba}
+  return append_many(aba, [values])
+
 # atalhos usados pelo bot
 def salvar_paciente(cpf, nome, data_nasc, endereco, contato,
                     tipo_atend, conv_part, esp_ou_exame, origem, ts_criado, ts_atualizado):
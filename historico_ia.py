@@ -0,0 +1,197 @@
+# historico_ia.py — histórico curto por contato para o fallback de IA (responder_ia)
+# ==============================================================================
+# O histórico vai inteiro no prompt a cada chamada: quanto menor, mais rápida e
+# barata a resposta. Aqui ele é limitado por um orçamento estimado de tokens
+# (HIST_IA_TOKENS), não só por quantidade de mensagens:
+#
+#   - por contato: deque(maxlen=HIST_IA_MAX_MSGS) em pares pergunta/resposta;
+#     passando do orçamento, saem os pares mais antigos (o último fica sempre)
+#   - no processo: no máximo HIST_IA_MAX_CONTATOS conversas (LRU) e quem ficou
+#     parado mais de HIST_IA_TTL_S sai numa varredura em segundo plano
+#
+# Com armazém compartilhado (SESSAO_BACKEND=sqlite/redis) o histórico continua
+# no armazém (espaço "hist_ia", expirado por ele) com o mesmo corte por orçamento.
+import os, threading, time
+from collections import OrderedDict, deque
+from typing import Dict, List
+
+from armazem_sessoes import MapaSessoes
+
+HIST_IA_MAX_MSGS     = int(os.getenv("HIST_IA_MAX_MSGS", "10"))
+HIST_IA_TOKENS       = int(os.getenv("HIST_IA_TOKENS", "800"))       # estimativa, só do histórico
+HIST_IA_MAX_CONTATOS = int(os.getenv("HIST_IA_MAX_CONTATOS", "5000"))
+HIST_IA_TTL_S        = int(os.getenv("HIST_IA_TTL_S", "3600"))
+HIST_IA_VARREDURA_S  = float(os.getenv("HIST_IA_VARREDURA_S", "60"))
+
+
+def estimar_tokens(texto: str) -> int:
+    """~4 caracteres por token em português, mais o custo fixo de cada mensagem."""
+    return len(texto) // 4 + 4
+
+
+def _limitar(texto: str, orcamento: int) -> str:
+    # uma mensagem sozinha não passa de metade do orçamento (texto colado, etc.)
+    limite = max(200, orcamento * 2)
+    return texto if len(texto) <= limite else texto[:limite] + "…"
+
+
+def cortar(msgs: List[dict], orcamento: int, max_msgs: int) -> List[dict]:
+    """Mantém os pares mais recentes que cabem no orçamento (o último par sempre fica)."""
+    msgs = msgs[-max_msgs:]
+    total = sum(estimar_tokens(m["content"]) for m in msgs)
+    inicio = 0
+    while total > orcamento and len(msgs) - inicio > 2:
+        total -= estimar_tokens(msgs[inicio]["content"]) + estimar_tokens(msgs[inicio + 1]["content"])
+        inicio += 2
+    return msgs[inicio:]
+
+
+class _Conversa:
+    __slots__ = ("msgs", "tokens", "ts")
+
+    def __init__(self, max_msgs: int):
+        self.msgs = deque(maxlen=max_msgs)
+        self.tokens = 0
+        self.ts = 0.0
+
+
+class HistoricoIA:
+    """Histórico em memória do processo: ring buffer por contato + LRU global + expiração."""
+    compartilhado = False
+
+    def __init__(self, max_msgs: int = HIST_IA_MAX_MSGS, orcamento: int = HIST_IA_TOKENS,
+                 max_contatos: int = HIST_IA_MAX_CONTATOS, ttl_s: float = HIST_IA_TTL_S,
+                 varredura_s: float = HIST_IA_VARREDURA_S):
+        self.max_msgs = max(2, max_msgs - max_msgs % 2)   # sempre pares pergunta/resposta
+        self.orcamento = orcamento
+        self.max_contatos = max_contatos
+        self.ttl_s = ttl_s
+        self.varredura_s = varredura_s
+        self._conversas: "OrderedDict[str, _Conversa]" = OrderedDict()   # ordem = última gravação
+        self._lock = threading.Lock()
+        self._pid = None
+
+        self.leituras = 0
+        self.tokens_lidos = 0
+        self.cortadas = 0
+        self.expiradas = 0
+        self.despejadas = 0
+
+    def _garantir_thread(self):
+        pid = os.getpid()
+        if self._pid == pid:
+            return
+        with self._lock:
+            if self._pid == pid:
+                return
+            threading.Thread(target=self._loop, name="historico-ia", daemon=True).start()
+            self._pid = pid
+
+    def _loop(self):
+        while True:
+            time.sleep(self.varredura_s)
+            with self._lock:
+                self._expirar(time.time())
+
+    def _expirar(self, agora: float):
+        # chamado com self._lock adquirido; a mais antiga está sempre na frente
+        corte = agora - self.ttl_s
+        while self._conversas:
+            conversa = next(iter(self._conversas.values()))
+            if conversa.ts >= corte:
+                break
+            self._conversas.popitem(last=False)
+            self.expiradas += 1
+
+    def recentes(self, wa_id: str) -> List[dict]:
+        with self._lock:
+            conversa = self._conversas.get(wa_id)
+            if conversa is None or conversa.ts < time.time() - self.ttl_s:
+                return []
+            self.leituras += 1
+            self.tokens_lidos += conversa.tokens
+            return list(conversa.msgs)
+
+    def adicionar(self, wa_id: str, pergunta: str, resposta: str):
+        self._garantir_thread()
+        agora = time.time()
+        with self._lock:
+            conversa = self._conversas.pop(wa_id, None) or _Conversa(self.max_msgs)
+            self._conversas[wa_id] = conversa   # volta para o fim: mais recente
+            msgs = conversa.msgs
+            for papel, texto in (("user", pergunta), ("assistant", resposta)):
+                texto = _limitar(texto or "", self.orcamento)
+                if len(msgs) == msgs.maxlen:
+                    conversa.tokens -= estimar_tokens(msgs[0]["content"])   # o append tira da esquerda
+                msgs.append({"role": papel, "content": texto})
+                conversa.tokens += estimar_tokens(texto)
+            while conversa.tokens > self.orcamento and len(msgs) > 2:
+                for _ in range(2):
+                    conversa.tokens -= estimar_tokens(msgs.popleft()["content"])
+                self.cortadas += 2
+            conversa.ts = agora
+
+            self._expirar(agora)
+            while len(self._conversas) > self.max_contatos:
+                self._conversas.popitem(last=False)
+                self.despejadas += 1
+
+    def __len__(self) -> int:
+        return len(self._conversas)
+
+    def metricas(self) -> dict:
+        with self._lock:
+            contatos = len(self._conversas)
+            mensagens = sum(len(c.msgs) for c in self._conversas.values())
+        return {
+            "contatos": contatos,
+            "max_contatos": self.max_contatos,
+            "mensagens": mensagens,
+            "orcamento_tokens": self.orcamento,
+            "tokens_medios_prompt": round(self.tokens_lidos / self.leituras, 1) if self.leituras else 0,
+            "cortadas_orcamento": self.cortadas,
+            "expiradas": self.expiradas,
+            "despejadas": self.despejadas,
+        }
+
+
+class HistoricoCompartilhado:
+    """Mesma interface, guardado no armazém de sessões (vários workers)."""
+    compartilhado = True
+
+    def __init__(self, armazem, max_msgs: int = HIST_IA_MAX_MSGS, orcamento: int = HIST_IA_TOKENS,
+                 ttl_s: float = HIST_IA_TTL_S):
+        self.mapa = MapaSessoes(armazem, "hist_ia", ttl_s=ttl_s)
+        self.max_msgs = max(2, max_msgs - max_msgs % 2)
+        self.orcamento = orcamento
+        self.leituras = 0
+        self.tokens_lidos = 0
+
+    def recentes(self, wa_id: str) -> List[dict]:
+        msgs = (self.mapa.get(wa_id) or {}).get("msgs") or []
+        if msgs:
+            self.leituras += 1
+            self.tokens_lidos += sum(estimar_tokens(m["content"]) for m in msgs)
+        return list(msgs)
+
+    def adicionar(self, wa_id: str, pergunta: str, resposta: str):
+        msgs = (self.mapa.get(wa_id) or {}).get("msgs") or []
+        msgs = msgs + [{"role": "user", "content": _limitar(pergunta or "", self.orcamento)},
+                       {"role": "assistant", "content": _limitar(resposta or "", self.orcamento)}]
+        self.mapa[wa_id] = {"msgs": cortar(msgs, self.orcamento, self.max_msgs), "ts": time.time()}
+
+    def __len__(self) -> int:
+        return len(self.mapa)
+
+    def metricas(self) -> Dict[str, object]:
+        return {
+            **self.mapa.metricas(),
+            "orcamento_tokens": self.orcamento,
+            "tokens_medios_prompt": round(self.tokens_lidos / self.leituras, 1) if self.leituras else 0,
+        }
+
+
+def criar_historico(armazem):
+    if armazem.compartilhado:
+        return HistoricoCompartilhado(armazem)
+    return HistoricoIA()
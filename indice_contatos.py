@@ -0,0 +1,146 @@
+# indice_contatos.py — índice em memória número → linha da planilha de contatos
+# ==============================================================================
+# Em vez de baixar a coluna A inteira a cada gravação, a coluna é lida uma vez
+# (ou carregada de um snapshot local) e o índice é atualizado a cada append.
+#
+# Ressincroniza (lê a coluna de novo) quando:
+#   - passou CONTATOS_RESYNC_S desde a última leitura (edições manuais, exclusões);
+#   - a "versão" não bate: o append da API devolve a linha onde a linha entrou;
+#     se não for a linha seguinte à última conhecida, alguém inseriu/apagou linhas.
+import os, json, re, threading, time
+from typing import Dict, Optional
+
+CONTATOS_RESYNC_S      = float(os.getenv("CONTATOS_RESYNC_S", "900"))
+CONTATOS_SNAPSHOT_PATH = os.getenv("CONTATOS_SNAPSHOT_PATH", "").strip()   # prefixo; vazio = sem snapshot
+
+_RE_LINHA = re.compile(r"![A-Z]+(\d+)")
+
+
+def linha_do_append(resposta) -> Optional[int]:
+    """Linha gravada, a partir da resposta de append_row (updates.updatedRange)."""
+    try:
+        faixa = resposta["updates"]["updatedRange"]
+    except (TypeError, KeyError):
+        return None
+    m = _RE_LINHA.search(faixa)
+    return int(m.group(1)) if m else None
+
+
+class IndiceContatos:
+
+    def __init__(self, chave: str, resync_s: float = CONTATOS_RESYNC_S, snapshot: str = CONTATOS_SNAPSHOT_PATH):
+        self.chave = chave
+        self.resync_s = resync_s
+        self.snapshot = snapshot
+        self.lock = threading.RLock()      # quem consulta e depois grava segura o lock
+        self._linhas: Dict[str, int] = {}
+        self._ultima_linha = 0
+        self._sincronizado_em = 0.0        # time.time() da última leitura da coluna
+
+        self.consultas = 0
+        self.resyncs = 0
+        self.divergencias = 0
+
+        if snapshot:
+            self._ler_snapshot()
+
+    # ===== Carga ==============================================================
+    def sincronizar(self, aba):
+        """Relê a coluna A inteira e reconstrói o índice."""
+        with self.lock:
+            valores = aba.col_values(1)
+            linhas = {}
+            for i, v in enumerate(valores, start=1):
+                n = (v or "").strip()
+                if n and n not in linhas:
+                    linhas[n] = i
+            self._linhas = linhas
+            self._ultima_linha = len(valores)
+            self._sincronizado_em = time.time()
+            self.resyncs += 1
+            self._gravar_snapshot()
+
+    def _garantir(self, aba):
+        if time.time() - self._sincronizado_em >= self.resync_s:
+            self.sincronizar(aba)
+
+    def invalidar(self):
+        with self.lock:
+            self._sincronizado_em = 0.0
+
+    # ===== Consulta / atualização incremental =================================
+    def linha(self, aba, numero: str) -> Optional[int]:
+        with self.lock:
+            self._garantir(aba)
+            self.consultas += 1
+            return self._linhas.get((numero or "").strip())
+
+    def contem(self, aba, numero: str) -> bool:
+        return self.linha(aba, numero) is not None
+
+    def registrar_append(self, numero: str, resposta=None):
+        """Atualiza o índice depois de um append; confere a versão pela linha devolvida."""
+        with self.lock:
+            esperada = self._ultima_linha + 1
+            linha = linha_do_append(resposta) or esperada
+            if linha != esperada:
+                self.divergencias += 1
+                self.invalidar()
+                print(f"🔄 [CONTATOS] planilha mudou fora do bot (linha {linha}, esperada {esperada}) — reindexando")
+            self._linhas.setdefault((numero or "").strip(), linha)
+            self._ultima_linha = max(self._ultima_linha, linha)
+
+    # ===== Snapshot local (opcional) ==========================================
+    # Gravado só na ressincronização: um snapshot defasado é detectado no próximo
+    # append (linha devolvida ≠ esperada) e provoca uma releitura.
+    def _ler_snapshot(self):
+        try:
+            with open(self.snapshot, encoding="utf-8") as f:
+                dados = json.load(f)
+            if dados.get("chave") != self.chave:
+                return
+            self._linhas = dados["linhas"]
+            self._ultima_linha = dados["ultima_linha"]
+            self._sincronizado_em = dados["ts"]
+            print(f"[CONTATOS] {len(self._linhas)} números carregados de {self.snapshot}")
+        except FileNotFoundError:
+            pass
+        except (ValueError, KeyError) as e:
+            print("[CONTATOS] snapshot ignorado:", e)
+
+    def _gravar_snapshot(self):
+        if not self.snapshot:
+            return
+        tmp = self.snapshot + ".tmp"
+        try:
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump({"chave": self.chave, "ts": self._sincronizado_em,
+                           "ultima_linha": self._ultima_linha, "linhas": self._linhas}, f)
+            os.replace(tmp, self.snapshot)
+        except OSError as e:
+            print("[CONTATOS] não consegui gravar snapshot:", e)
+
+    def metricas(self) -> dict:
+        return {
+            "numeros": len(self._linhas),
+            "ultima_linha": self._ultima_linha,
+            "idade_s": round(time.time() - self._sincronizado_em, 1) if self._sincronizado_em else None,
+            "consultas": self.consultas,
+            "resyncs": self.resyncs,
+            "divergencias": self.divergencias,
+        }
+
+
+# ===== Um índice por planilha/aba =============================================
+_INDICES: Dict[tuple, IndiceContatos] = {}
+_LOCK = threading.Lock()
+
+
+def indice(sheet_id: str, nome_aba: str) -> IndiceContatos:
+    chave = (sheet_id, nome_aba)
+    with _LOCK:
+        idx = _INDICES.get(chave)
+        if idx is None:
+            snapshot = f"{CONTATOS_SNAPSHOT_PATH}-{sheet_id}-{nome_aba}.json" if CONTATOS_SNAPSHOT_PATH else ""
+            idx = _INDICES[chave] = IndiceContatos(f"{sheet_id}/{nome_aba}", snapshot=snapshot)
+        return idx
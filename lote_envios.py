@@ -0,0 +1,87 @@
+# lote_envios.py — junta "texto + botões" seguidos num único interactive
+# ==============================================================================
+# Dentro de um turno, o último texto enviado a um paciente fica retido.
+# Se a próxima mensagem for de botões para o mesmo número e o texto couber no
+# limite do body (1024), sai tudo num único interactive: uma ida à Graph API e
+# uma notificação no celular. Caso contrário, o texto sai antes, como sempre.
+import threading
+from contextlib import contextmanager
+
+LIMITE_BODY_INTERACTIVE = 1024
+SEPARADOR = "\n\n"
+
+
+class LoteEnvios:
+
+    def __init__(self, enviar_texto):
+        self._enviar_texto = enviar_texto     # envio imediato (to, text)
+        self._local = threading.local()
+        self.mesclados = 0                    # idas à Graph API economizadas
+        self.nao_couberam = 0
+
+    @contextmanager
+    def turno(self):
+        """Ativa a retenção durante o processamento de uma mensagem."""
+        self._local.ativo = True
+        self._local.pendente = None
+        try:
+            yield
+        finally:
+            self.descarregar()
+            self._local.ativo = False
+
+    def ativo(self) -> bool:
+        return getattr(self._local, "ativo", False)
+
+    def reter_texto(self, to: str, text: str, enviar=None) -> bool:
+        """
+        Retém o texto se houver turno ativo. False = quem chamou deve enviar já.
+        enviar (opcional): envio pronto a usar se o texto não for mesclado.
+        """
+        if not self.ativo():
+            return False
+        self.descarregar()
+        self._local.pendente = (to, text, enviar)
+        return True
+
+    def pendente_para(self, to: str) -> bool:
+        pendente = getattr(self._local, "pendente", None)
+        return bool(pendente) and pendente[0] == to
+
+    def mesclar_com_botoes(self, to: str, body: str) -> str:
+        """
+        Devolve o body final dos botões. Se havia texto retido para o mesmo
+        número e ele cabe, o texto vai no body; senão é enviado antes.
+        """
+        pendente = getattr(self._local, "pendente", None)
+        if not pendente:
+            return body
+        self._local.pendente = None
+        p_to, p_text, _ = pendente
+        if p_to == to:
+            unido = f"{p_text}{SEPARADOR}{body}"
+            if len(unido) <= LIMITE_BODY_INTERACTIVE:
+                self.mesclados += 1
+                return unido
+            self.nao_couberam += 1
+        self._enviar(pendente)
+        return body
+
+    def descarregar(self):
+        pendente = getattr(self._local, "pendente", None)
+        if pendente:
+            self._local.pendente = None
+            self._enviar(pendente)
+
+    def _enviar(self, pendente):
+        to, text, enviar = pendente
+        if enviar is not None:
+            enviar()
+        else:
+            self._enviar_texto(to, text)
+
+    def metricas(self) -> dict:
+        return {
+            "viagens_economizadas": self.mesclados,
+            "nao_couberam": self.nao_couberam,
+        }
@@ -0,0 +1,37 @@
+# metricas.py — contadores e estatísticas leves em memória (expostos em /metricas)
+import threading
+from collections import deque
+
+
+class Estatistica:
+    """
+    Acumula amostras (ex.: latência em ms) e devolve média, máximo e p95.
+    O p95 é calculado sobre as últimas N amostras (janela fixa, memória constante).
+    """
+
+    def __init__(self, janela: int = 512):
+        self._lock = threading.Lock()
+        self._amostras = deque(maxlen=janela)
+        self.qtd = 0
+        self.total = 0.0
+        self.maximo = 0.0
+
+    def registrar(self, valor: float):
+        with self._lock:
+            self.qtd += 1
+            self.total += valor
+            if valor > self.maximo:
+                self.maximo = valor
+            self._amostras.append(valor)
+
+    def resumo(self) -> dict:
+        with self._lock:
+            amostras = sorted(self._amostras)
+            qtd, total, maximo = self.qtd, self.total, self.maximo
+        p95 = amostras[min(len(amostras) - 1, int(len(amostras) * 0.95))] if amostras else 0.0
+        return {
+            "qtd": qtd,
+            "media": round(total / qtd, 2) if qtd else 0.0,
+            "p95": round(p95, 2),
+            "max": round(maximo, 2),
+        }
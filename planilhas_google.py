@@ -0,0 +1,113 @@
+# planilhas_google.py — cliente gspread autorizado uma vez + cache de planilhas/abas com TTL
+# ==============================================================================
+# Antes, cada gravação relia o JSON da service account, chamava gspread.authorize,
+# open_by_key e worksheet(...): várias idas ao Google antes de escrever a linha.
+# Aqui o cliente é criado uma vez por arquivo de credencial (o token é renovado
+# pelo google-auth) e os handles de planilha/aba ficam guardados por GSPREAD_TTL_S.
+#
+# Uso:
+#   from planilhas_google import aba
+#   ws = aba(SHEET_ID, "Página1", CAMINHO_CREDENCIAL)
+import os, threading, time
+
+GSPREAD_TTL_S = float(os.getenv("GSPREAD_TTL_S", "600"))
+SCOPES = ["https://www.googleapis.com/auth/spreadsheets"]
+
+_LOCK = threading.RLock()
+_CLIENTES = {}       # caminho da credencial -> gspread.Client
+_PLANILHAS = {}      # (caminho, sheet_id) -> (expira_em, Spreadsheet)
+_ABAS = {}           # (caminho, sheet_id, nome) -> (expira_em, Worksheet)
+CONTADORES = {"hits": 0, "aberturas": 0, "autorizacoes": 0}
+
+
+def cliente(caminho_credencial: str):
+    """gspread.Client autorizado com a service account (um por arquivo, por processo)."""
+    cli = _CLIENTES.get(caminho_credencial)
+    if cli is None:
+        with _LOCK:
+            cli = _CLIENTES.get(caminho_credencial)
+            if cli is None:
+                import gspread
+                from google.oauth2.service_account import Credentials
+                creds = Credentials.from_service_account_file(caminho_credencial, scopes=SCOPES)
+                cli = _CLIENTES[caminho_credencial] = gspread.authorize(creds)
+                CONTADORES["autorizacoes"] += 1
+    return cli
+
+
+def planilha(sheet_id: str, caminho_credencial: str):
+    chave = (caminho_credencial, sheet_id)
+    agora = time.monotonic()
+    item = _PLANILHAS.get(chave)
+    if item and item[0] > agora:
+        CONTADORES["hits"] += 1
+        return item[1]
+    with _LOCK:
+        item = _PLANILHAS.get(chave)
+        if item and item[0] > agora:
+            return item[1]
+        sh = cliente(caminho_credencial).open_by_key(sheet_id)
+        _PLANILHAS[chave] = (agora + GSPREAD_TTL_S, sh)
+        CONTADORES["aberturas"] += 1
+        return sh
+
+
+def aba(sheet_id: str, nome: str, caminho_credencial: str, criar=None):
+    """
+    Worksheet pelo nome (nome=None → primeira aba).
+    criar(planilha) -> Worksheet: chamado se a aba não existir.
+    """
+    chave = (caminho_credencial, sheet_id, nome)
+    agora = time.monotonic()
+    item = _ABAS.get(chave)
+    if item and item[0] > agora:
+        CONTADORES["hits"] += 1
+        return item[1]
+    with _LOCK:
+        item = _ABAS.get(chave)
+        if item and item[0] > agora:
+            return item[1]
+        import gspread
+        sh = planilha(sheet_id, caminho_credencial)
+        if nome is None:
+            ws = sh.sheet1
+        else:
+            try:
+                ws = sh.worksheet(nome)
+            except gspread.exceptions.WorksheetNotFound:
+                if criar is None:
+                    raise
+                ws = criar(sh)
+        _ABAS[chave] = (agora + GSPREAD_TTL_S, ws)
+        CONTADORES["aberturas"] += 1
+        return ws
+
+
+def invalidar(sheet_id: str = None):
+    """Esquece handles (de uma planilha ou de todas) — usar após erro de API."""
+    with _LOCK:
+        for cache in (_PLANILHAS, _ABAS):
+            for chave in [c for c in cache if sheet_id is None or c[1] == sheet_id]:
+                del cache[chave]
+
+
+def com_aba(sheet_id: str, nome: str, caminho_credencial: str, fn, criar=None):
+    """
+    Executa fn(worksheet). Se o handle estiver velho (aba apagada/renomeada),
+    invalida o cache e tenta mais uma vez com handles novos.
+    """
+    import gspread
+    try:
+        return fn(aba(sheet_id, nome, caminho_credencial, criar))
+    except gspread.exceptions.APIError as e:
+        # 400/404 = range/aba que não existe mais; 429/5xx não se resolvem trocando o handle
+        if getattr(getattr(e, "response", None), "status_code", 0) not in (400, 404):
+            raise
+    except gspread.exceptions.WorksheetNotFound:
+        pass
+    invalidar(sheet_id)
+    return fn(aba(sheet_id, nome, caminho_credencial, criar))
+
+
+def metricas() -> dict:
+    return dict(CONTADORES, planilhas=len(_PLANILHAS), abas=len(_ABAS))
@@ -0,0 +1,76 @@
+# registro_sheets.py — normalização única (uma passada) dos registros enviados ao WebApp
+# ==============================================================================
+# Antes o registro era normalizado duas vezes (_map_to_captacao e _post_webapp),
+# com cópia do dict em cada etapa e as chaves antigas de origem duplicadas.
+# Aqui a tabela de apelidos é resolvida uma vez e aplicada numa passada só,
+# direto no dict recebido.
+#
+# Chaves antigas (origem, origem_panfleto_codigo, origem_texto) só são enviadas
+# com SHEETS_COMPAT_LEGADO=1 — o intake atual lê origem_cliente/panfleto_codigo/
+# origem_outro_texto (colunas P/Q/R).
+import os
+from uuid import uuid4
+from typing import Dict, Tuple
+
+SHEETS_COMPAT_LEGADO = os.getenv("SHEETS_COMPAT_LEGADO", "0").strip().lower() in ("1", "true", "sim")
+
+# campo oficial -> apelidos aceitos, em ordem de preferência
+ALIASES: Dict[str, Tuple[str, ...]] = {
+    "contato":            ("fone", "telefone", "wa_id"),
+    "whatsapp_nome":      ("nome_whatsapp", "nome_cap", "nome"),
+    "origem_cliente":     ("origem", "origemCliente"),                                   # P
+    "panfleto_codigo":    ("panfleto_codigo_raw", "origem_panfleto_codigo",
+                           "panfletoCodigo", "panfletoCodigoRaw"),                       # Q
+    "origem_outro_texto": ("origem_texto", "origemOutroTexto"),                          # R
+}
+
+# chave antiga -> campo oficial que ela espelha
+LEGADO: Dict[str, str] = {
+    "origem":                 "origem_cliente",
+    "origem_panfleto_codigo": "panfleto_codigo",
+    "origem_texto":           "origem_outro_texto",
+}
+
+
+class EsquemaSheets:
+    """Tabela de apelidos resolvida uma vez (campo → chaves a consultar, em ordem)."""
+    __slots__ = ("compat", "_cadeias")
+
+    def __init__(self, aliases: Dict[str, Tuple[str, ...]] = ALIASES, compat: bool = SHEETS_COMPAT_LEGADO):
+        self.compat = compat
+        self._cadeias = tuple((campo, (campo,) + apelidos) for campo, apelidos in aliases.items())
+
+    def normalizar(self, data: dict, secret: str, rota: str = "chatbot") -> dict:
+        """
+        Normaliza NO PRÓPRIO dict (quem chama passa um dict novo, não o da sessão).
+        Campos oficiais: primeiro valor não vazio entre o campo e seus apelidos, sem espaços.
+        Flags internas do fluxo (_pac_outro, _origem_done, ...) não vão para o Sheets.
+        """
+        for chave in [k for k in data if k[:1] == "_"]:
+            del data[chave]
+        g = data.get
+        for campo, chaves in self._cadeias:
+            v = ""
+            for chave in chaves:
+                v = g(chave)
+                if v:
+                    break
+            v = v or ""
+            data[campo] = v.strip() if v.__class__ is str else v
+        if not g("message_id"):
+            # é a chave da outbox: um carimbo de ms colidia entre registros do mesmo instante
+            data["message_id"] = f"auto-{uuid4().hex}"
+        if not g("forma") and g("tipo"):   # 'forma' (fallback de 'tipo')
+            data["forma"] = data["tipo"]
+        if self.compat:
+            for antiga, oficial in LEGADO.items():
+                data[antiga] = data[oficial]
+        else:
+            for antiga in LEGADO:
+                data.pop(antiga, None)
+        data["secret"] = secret
+        data["rota"] = rota
+        return data
+
+
+ESQUEMA = EsquemaSheets()
@@ -1,35 +1,49 @@
 # responder_clinica.py — Clínica Luma (Especialidades: lista numerada por texto; Exames: lista numerada)
 # ==============================================================================
-import os, re, json, requests
+import os, re, json, requests, atexit
 import time
 from datetime import datetime
 from zoneinfo import ZoneInfo
 from typing import Dict, Any, List
 
+from agendador_envios import agendador as _envios, HANDOFF, CAMPANHA
+from lote_envios import LoteEnvios
+from catalogo_mensagens import CatalogoMensagens, marca, modelo_botoes, modelo_texto
+from fila_webapp import FilaWebApp
+from registro_sheets import ESQUEMA
+from agregador_acessos import ACESSOS_MODO, AgregadorAcessos
+from armazem_sessoes import MapaSessoes, criar_armazem, turno as turno_sessao
+from historico_ia import criar_historico
+from dedup_mensagens import JanelaDedup
+from sessao import ROTAS_FORMULARIO, Etapa, Rota, Sessao, etapa
+
 # ===== Variáveis de ambiente ==================================================
 WA_ACCESS_TOKEN    = os.getenv("WA_ACCESS_TOKEN", "").strip() or os.getenv("ACCESS_TOKEN", "").strip()
 WA_PHONE_NUMBER_ID = os.getenv("WA_PHONE_NUMBER_ID", "").strip() or os.getenv("PHONE_NUMBER_ID", "").strip()
 CLINICA_SHEETS_URL    = os.getenv("CLINICA_SHEETS_URL", "").strip()
 CLINICA_SHEETS_SECRET = os.getenv("CLINICA_SHEETS_SECRET", "").strip()
+SHEETS_MODO           = os.getenv("SHEETS_MODO", "fila").strip().lower()   # "fila" (write-behind) ou "inline"
 
 NOME_EMPRESA   = os.getenv("NOME_EMPRESA", "Clínica Luma").strip()
 LINK_SITE      = os.getenv("LINK_SITE", "https://www.lumaclinicadafamilia.com.br").strip()
 LINK_INSTAGRAM = os.getenv("LINK_INSTAGRAM", "https://www.instagram.com/luma_clinicamedica").strip()
 
-GRAPH_URL = f"https://graph.facebook.com/v20.0/{WA_PHONE_NUMBER_ID}/messages" if WA_PHONE_NUMBER_ID else ""
-HEADERS   = {"Authorization": f"Bearer {WA_ACCESS_TOKEN}", "Content-Type": "application/json"}
 
-# Evitar duplicatas no mesmo minuto (memória do processo)
-_ULTIMAS_CHAVES = set()
+# Sessão expira após X minutos sem interação (cada gravação em SESS renova o prazo)
+SESSION_TTL_MIN = int(os.getenv("SESSION_TTL_MIN", "120"))
+
+# Janela em que um novo contato não gera outro "acesso_inicial"
+ACESSO_JANELA_S = 1800
 
-# Sessão expira após X minutos sem interação
-SESSION_TTL_MIN = 120
+# Custo observado por turno (usado para estimar a economia do agrupador de rajadas)
+CONTADORES: Dict[str, int] = {"turnos": 0, "ia_chamadas": 0, "envios": 0}
 
 # ===== Persistência via WebApp ===============================================
 def _post_webapp(payload: dict) -> dict:
     """
     Envia JSON para o WebApp (rota 'chatbot').
     Garante message_id único, normaliza contato/whatsapp_nome e P/Q/R, e loga o que foi enviado.
+    No modo "fila" o registro vai para a outbox local e sai em lote em background.
     """
     if not (CLINICA_SHEETS_URL and CLINICA_SHEETS_SECRET):
         # >>> ATENÇÃO:
@@ -39,64 +53,18 @@ def _post_webapp(payload: dict) -> dict:
         print("[SHEETS] Config ausente (CLINICA_SHEETS_URL/SECRET).")
         return {"ok": False, "erro": "config ausente"}
 
-    # Base do payload: rota/secret no BODY (aceitos pelo intake)
-    data = {"secret": CLINICA_SHEETS_SECRET, "rota": "chatbot"}
-    data.update(payload or {})
-
-    # message_id único (evita dedupe)
-    if not data.get("message_id"):
-        data["message_id"] = f"auto-{int(datetime.now().timestamp()*1000)}"
-
-    # Normalização contato / whatsapp_nome
-    data["contato"] = (
-        data.get("contato")
-        or data.get("fone")
-        or data.get("telefone")
-        or data.get("wa_id")   # ← NOVO fallback
-        or ""
-    )
-
-    data["whatsapp_nome"] = (
-        data.get("whatsapp_nome")
-        or data.get("nome_whatsapp")
-        or data.get("nome_cap")
-        or data.get("nome")
-        or ""
-    )
-
-    # 'forma' (fallback de 'tipo', se for o caso)
-    if not data.get("forma") and data.get("tipo"):
-        data["forma"] = data.get("tipo")
-
-    # ---------------- P / Q / R ----------------
-    # P: origem_cliente
-    data["origem_cliente"] = (
-        data.get("origem_cliente")
-        or data.get("origem")
-        or data.get("origemCliente")
-        or ""
-    )
-    # Q: panfleto_codigo
-    data["panfleto_codigo"] = (
-        data.get("panfleto_codigo")
-        or data.get("panfleto_codigo_raw")
-        or data.get("origem_panfleto_codigo")
-        or data.get("panfletoCodigo")
-        or data.get("panfletoCodigoRaw")
-        or ""
-    )
-    # R: origem_outro_texto
-    data["origem_outro_texto"] = (
-        data.get("origem_outro_texto")
-        or data.get("origem_texto")
-        or data.get("origemOutroTexto")
-        or ""
-    )
+    data = _normalizar_webapp(payload)
+    # outbox pela message_id (única por registro); dedupe_key é só dica para o intake,
+    # com resolução de 1s — como chave, descartaria a 2ª solicitação do mesmo segundo
+    chave = data["message_id"]
+    if SHEETS_MODO != "inline" and FILA_SHEETS.enfileirar(data, chave):
+        return {"ok": True, "enfileirado": True}
+    return _postar_webapp_agora(data)
 
-    # Compatibilidade antiga
-    data["origem"]                 = data["origem_cliente"]
-    data["origem_panfleto_codigo"] = data["panfleto_codigo"]
-    data["origem_texto"]           = data["origem_outro_texto"]
+def _normalizar_webapp(payload: dict) -> dict:
+    # Uma passada só: apelidos → campos oficiais (contato, whatsapp_nome, P/Q/R),
+    # message_id único, rota/secret no BODY. O dict recebido é o próprio registro.
+    data = ESQUEMA.normalizar(payload if payload is not None else {}, CLINICA_SHEETS_SECRET)
 
     # Debug enxuto (mostra exatamente o que vai para o Sheets)
     dbg = {k: data.get(k) for k in [
@@ -105,9 +73,14 @@ def _post_webapp(payload: dict) -> dict:
     ]}
     print("[SEND→Sheets] url:", CLINICA_SHEETS_URL)
     print("[SEND→Sheets] campos:", json.dumps(dbg, ensure_ascii=False))
+    return data
 
+# Conexão keep-alive com o script.google.com (reaproveitada entre lotes)
+_HTTP_SHEETS = requests.Session()
+
+def _postar_webapp_agora(data: dict) -> dict:
     try:
-        r = requests.post(CLINICA_SHEETS_URL, json=data, timeout=12)
+        r = _HTTP_SHEETS.post(CLINICA_SHEETS_URL, json=data, timeout=12)
         r.raise_for_status()
         j = r.json()
         print("[SHEETS] resp:", j)
@@ -116,6 +89,41 @@ def _post_webapp(payload: dict) -> dict:
         print("[SHEETS] erro:", e)
         return {"ok": False, "erro": str(e)}
 
+def _postar_lote_webapp(registros: List[dict]):
+    """Um POST com todas as linhas. True = gravou, False = erro, None = intake sem rota de lote."""
+    corpo = {
+        "secret": CLINICA_SHEETS_SECRET,
+        "rota": "chatbot_lote",
+        "registros": [{k: v for k, v in r.items() if k != "secret"} for r in registros],
+    }
+    try:
+        r = _HTTP_SHEETS.post(CLINICA_SHEETS_URL, json=corpo, timeout=30)
+        r.raise_for_status()
+        j = r.json()
+    except Exception as e:
+        print("[SHEETS] erro no lote:", e)
+        return False
+    print(f"[SHEETS] lote {len(registros)} resp:", j)
+    # Só conta como gravado se o intake confirmar a quantidade de linhas do lote
+    return True if j.get("ok") is True and j.get("gravados") == len(registros) else None
+
+FILA_SHEETS = FilaWebApp(
+    _postar_lote_webapp,
+    lambda data: _postar_webapp_agora(data).get("ok") is not False,
+)
+atexit.register(FILA_SHEETS.aguardar)
+
+# Acessos (acesso_inicial / acesso_endereco): contados por tipo/especialidade/hora
+# e gravados como uma linha-resumo por hora fechada; ACESSOS_MODO=evento volta a uma linha por evento.
+ACESSOS = AgregadorAcessos(_post_webapp)
+
+def _registrar_acesso(registro: dict):
+    if ACESSOS_MODO == "evento":
+        _post_webapp(registro)
+        return
+    ACESSOS.contar(registro["tipo"], registro["especialidade"], registro["contato"],
+                   registro["whatsapp_nome"], registro["timestamp_local"])
+
 def _map_to_captacao(d: dict) -> dict:
     """
     Converte o 'data' do fluxo para o payload do WebApp,
@@ -123,10 +131,7 @@ def _map_to_captacao(d: dict) -> dict:
     """
     out = dict(d)  # <<< preserva especialidade/exame/forma/whatsapp_nome etc.
 
-    # Contato / identificação
-    out["message_id"]    = d.get("message_id") or out.get("message_id")
-    out["contato"]       = (d.get("contato") or "").strip()
-    out["whatsapp_nome"] = (d.get("whatsapp_nome") or "").strip()
+    # Contato / whatsapp_nome / P-Q-R são resolvidos em _post_webapp (registro_sheets)
 
     # Forma (Convênio/Particular) — intake aceita alias 'forma'/'tipo'
     if d.get("forma"):
@@ -174,42 +179,28 @@ def _map_to_captacao(d: dict) -> dict:
         out["paciente_cpf"]  = only_digits(cpf_self or "")
         out["paciente_nasc"] = (d.get("nasc") or "").strip()
 
-    # Marketing P / Q / R
-    out["origem_cliente"]      = (d.get("origem_cliente") or d.get("origem") or "").strip()           # P
-    out["panfleto_codigo"]     = (d.get("panfleto_codigo") or d.get("panfleto_codigo_raw") or "").strip()  # Q
-    out["origem_outro_texto"]  = (d.get("origem_outro_texto") or d.get("origem_texto") or "").strip()  # R
-
-    # Compatibilidade retro (se algum código seu antigo ainda ler esses nomes)
-    out["origem"]                 = out["origem_cliente"]
-    out["origem_panfleto_codigo"] = out["panfleto_codigo"]
-    out["origem_texto"]           = out["origem_outro_texto"]
-
     # >>> NOVO: sugestões livres (se houver)
     if d.get("sugestao_especialidade"):
         out["sugestao_especialidade"] = (d.get("sugestao_especialidade") or "").strip()
     if d.get("sugestao_exame"):
         out["sugestao_exame"] = (d.get("sugestao_exame") or "").strip()
 
-    # Remova chaves internas que não interessam no Sheets, se houver
-    out.pop("_pac_decidido", None)
-    out.pop("_origem_done", None)
-    out.pop("_compl_decidido", None)
-
     return out
 
 # Mantém as assinaturas usadas no resto do código:
 def _upsert_paciente(ss, d): return
 
 def _add_solicitacao(ss, d):
-    # chave simples: fone + item + forma + minuto
+    # chave: fone + tipo + item + forma + paciente — repetida dentro da janela não vai ao Sheets
     chave = f"{(d.get('contato') or '').strip()}|" \
+        f"{(d.get('tipo') or '').strip()}|" \
         f"{(d.get('especialidade') or d.get('exame') or '').strip()}|" \
-        f"{(d.get('forma') or '').strip()}"
+        f"{(d.get('forma') or '').strip()}|" \
+        f"{(d.get('paciente_nome') or d.get('nome') or '').strip().lower()}"
 
-    if chave in _ULTIMAS_CHAVES:
+    if not SOLICITACOES.marcar_se_nova(chave):
         print("[SHEETS] skip duplicate:", chave)
-    else:
-        _ULTIMAS_CHAVES.add(chave)
+        return
 
     # >>> NOVO: dedupe consciente por fluxo (consulta vs exames)
     payload = _map_to_captacao(d)
@@ -311,13 +302,23 @@ def _montar_endereco_via_cep(cep, numero, complemento=""):
     comp = f" - {complemento.strip()}" if complemento else ""
     return f"{log}, {numero}{comp} - {bai} - {cid}/{uf} – CEP {cep_fmt}".strip()
 
-def _send_text(to: str, text: str):
+def _send_text_agora(to: str, text: str):
+    CONTADORES["envios"] += 1
     if not (WA_ACCESS_TOKEN and WA_PHONE_NUMBER_ID):
         print("[MOCK→WA TEXT]", to, text); return
     payload = {"messaging_product":"whatsapp","to":to,"type":"text","text":{"preview_url":False,"body":text[:4096]}}
-    requests.post(GRAPH_URL, headers=HEADERS, json=payload, timeout=30)
+    _envios().enviar(payload)
+
+# Texto seguido de botões no mesmo turno vira um único interactive (ver lote_envios.py)
+LOTE = LoteEnvios(_send_text_agora)
+
+def _send_text(to: str, text: str):
+    if not LOTE.reter_texto(to, text):
+        _send_text_agora(to, text)
 
 def _send_buttons(to: str, body: str, buttons: List[Dict[str,str]]):
+    body = LOTE.mesclar_com_botoes(to, body)
+    CONTADORES["envios"] += 1
     btns = buttons[:3]  # WhatsApp permite no máximo 3 botões
 
     if not (WA_ACCESS_TOKEN and WA_PHONE_NUMBER_ID):
@@ -340,10 +341,10 @@ def _send_buttons(to: str, body: str, buttons: List[Dict[str,str]]):
         }
     }
 
-    r = requests.post(GRAPH_URL, headers=HEADERS, json=payload, timeout=30)
+    r = _envios().enviar(payload)
 
     print("📤 BUTTON STATUS:", r.status_code)
-    print("📤 BUTTON RESP:", r.text)
+    print("📤 BUTTON RESP:", r.texto)
 
 # ===== TEMPLATE COM IMAGEM (HEADER) =========================================
 
@@ -356,6 +357,8 @@ def _normalizar_dropbox(url: str) -> str:
     return u
 
 def _send_template_image(to: str, template_name: str, image_url: str, body_params: List[str]):
+    LOTE.descarregar()
+    CONTADORES["envios"] += 1
     if not (WA_ACCESS_TOKEN and WA_PHONE_NUMBER_ID):
         print("[MOCK→WA TEMPLATE IMG]", to, template_name, image_url, body_params)
         return
@@ -391,18 +394,16 @@ def _send_template_image(to: str, template_name: str, image_url: str, body_param
         }
     }
 
-    r = requests.post(GRAPH_URL, headers=HEADERS, json=payload, timeout=30)
+    r = _envios().enviar(payload, prioridade=CAMPANHA)
 
     print("📤 TEMPLATE STATUS:", r.status_code)
-    print("📤 TEMPLATE RESP:", r.text)
+    print("📤 TEMPLATE RESP:", r.texto)
 
 # ============================================================
 # DISPARO TEMPLATE SIMPLES (IGUAL OFICINA)
 # ============================================================
 
 def enviar_template_clinica_disparo(numero):
-    url = f"https://graph.facebook.com/v20.0/{WA_PHONE_NUMBER_ID}/messages"
-
     payload = {
         "messaging_product": "whatsapp",
         "recipient_type": "individual",
@@ -416,17 +417,12 @@ def enviar_template_clinica_disparo(numero):
         }
     }
 
-    headers = {
-        "Authorization": f"Bearer {WA_ACCESS_TOKEN}",
-        "Content-Type": "application/json"
-    }
-
-    response = requests.post(url, headers=headers, json=payload, timeout=30)
+    response = _envios().enviar(payload, prioridade=CAMPANHA)
 
     print("📤 TEMPLATE CLINICA STATUS:", response.status_code)
-    print("📤 TEMPLATE CLINICA BODY:", response.text)
+    print("📤 TEMPLATE CLINICA BODY:", response.texto)
 
-    return response.text
+    return response.texto
 
 # ===== Botões/UI ==============================================================
 LINK_DOCTORALIA = "https://www.doctoralia.com.br/clinicas/luma-clinica-da-familia"
@@ -441,6 +437,19 @@ _CANAIS = (
     f"☎️ Fixo: {TEL_FIXO}"
 )
 
+TXT_ENDERECO = (
+    "📍 *Endereço*\n"
+    "Rua Utrecht, 129 – Vila Rio Branco – CEP 03878-000 – São Paulo/SP\n"
+    f"🗺️ Ver no Maps: {LINK_MAPS}\n\n"
+    f"🌐 *Site*: {LINK_SITE}\n"
+    f"📷 *Instagram*: {LINK_INSTAGRAM}\n"
+    "📘 *Facebook*: Clinica Luma\n"
+    f"☎️ *Fixo*: {TEL_FIXO}\n"
+    f"💬 *WhatsApp*: {LINK_WHATSAPP}\n"
+    "✉️ *E-mail*: luma.centromed@gmail.com\n\n"
+    f"📅 *Agendamento online*: {LINK_DOCTORALIA}"
+)
+
 def _welcome_named(name):
 
     primeiro_nome = name.split()[0] if name else ""
@@ -509,8 +518,8 @@ def _especialidade_menu_texto():
     return "\n".join(linhas)
 
 def _ask_especialidade_num(wa_to, ses):
-    ses["stage"] = "especialidade_num"; SESS[wa_to] = ses
-    _send_text(wa_to, _especialidade_menu_texto())
+    ses.stage = Etapa.ESPECIALIDADE_NUM; SESS[wa_to] = ses
+    _send_catalogo(wa_to, "menu_especialidade")
 
 EXAMES_ORDER = [
     "Admissional / Demissional",   # ← NOVO exame incluído
@@ -529,8 +538,8 @@ def _exame_menu_texto():
     return "\n".join(linhas)
 
 def _ask_exame_num(wa_to, ses):
-    ses["stage"] = "exame_num"; SESS[wa_to] = ses
-    _send_text(wa_to, _exame_menu_texto())
+    ses.stage = Etapa.EXAME_NUM; SESS[wa_to] = ses
+    _send_catalogo(wa_to, "menu_exame")
 
 # ===== Validadores e normalização ============================================
 _RE_CPF  = re.compile(r"\D")
@@ -568,7 +577,7 @@ def _normalize(key, v):
     if key == "cep": return re.sub(r"\D", "", v)[:8]
     return v
 
-def _ask_forma(to): _send_buttons(to, "Convênio ou Particular?", BTN_FORMA)
+def _ask_forma(to): _send_catalogo(to, "forma")
 
 # ===== Origem (marketing) =====================================================
 def _origem_menu_texto():
@@ -583,6 +592,60 @@ def _origem_menu_texto():
         "Digite apenas o número da opção:"
     )
 
+# ===== Catálogo pré-renderizado ==============================================
+# Menus/botões fixos serializados uma vez; no envio só entra o 'to' (e o nome).
+# Recompila sozinho se as listas de especialidades/exames mudarem; para outras
+# mudanças em tempo de execução, chame CATALOGO.invalidar().
+_TXT_PACIENTE = "O atendimento é para você mesmo(a) ou para outro paciente (filho/dependente)?"
+_TXT_COMPLEMENTO = "Possui complemento (apto, bloco, sala)?"
+
+def _catalogo_definicoes():
+    return {
+        "boas_vindas":        modelo_botoes(_welcome_named(marca("nome")), BTN_ROOT, campos=("to", "nome")),
+        "posso_ajudar":       modelo_botoes("Posso ajudar em algo mais?", BTN_ROOT),
+        "forma":              modelo_botoes("Convênio ou Particular?", BTN_FORMA),
+        "mais2":              modelo_botoes("Outras opções:", BTN_MAIS_2),
+        "mais3":              modelo_botoes("Mais opções:", BTN_MAIS_3),
+        "mais4":              modelo_botoes("Opções finais:", BTN_MAIS_4),
+        "confirma":           modelo_botoes("Está correto?", BTN_CONFIRMA),
+        "paciente":           modelo_botoes(_TXT_PACIENTE, BTN_PACIENTE),
+        "complemento":        modelo_botoes(_TXT_COMPLEMENTO, BTN_COMPLEMENTO),
+        "menu_especialidade": modelo_texto(_especialidade_menu_texto()),
+        "menu_exame":         modelo_texto(_exame_menu_texto()),
+        "menu_origem":        modelo_texto(_origem_menu_texto()),
+        "endereco":           modelo_texto(TXT_ENDERECO),
+    }
+
+def _catalogo_versao():
+    return (tuple(ESPECIALIDADES_ORDER), tuple(EXAMES_ORDER), NOME_EMPRESA)
+
+CATALOGO = CatalogoMensagens(_catalogo_definicoes, _catalogo_versao)
+
+def _send_modelo(to: str, item, campos: dict):
+    CONTADORES["envios"] += 1
+    if not (WA_ACCESS_TOKEN and WA_PHONE_NUMBER_ID):
+        if item.botoes is None:
+            print("[MOCK→WA TEXT]", to, item.texto_com(**campos))
+        else:
+            print("[MOCK→WA BTNS]", to, item.texto_com(**campos), item.botoes)
+        return
+    _envios().enviar(item.render(to=to, **campos), tipo=item.tipo)
+
+def _send_catalogo(to: str, chave: str, **campos):
+    item = CATALOGO.item(chave)
+    if item.botoes is None:
+        if not LOTE.reter_texto(to, item.texto_com(**campos), lambda: _send_modelo(to, item, campos)):
+            _send_modelo(to, item, campos)
+        return
+    # Texto retido para o mesmo número: monta o payload para poder mesclar
+    if LOTE.pendente_para(to):
+        _send_buttons(to, item.texto_com(**campos), item.botoes); return
+    LOTE.descarregar()
+    _send_modelo(to, item, campos)
+
+def _send_boas_vindas(to: str, name: str):
+    _send_catalogo(to, "boas_vindas", nome=name.split()[0] if name else "")
+
 def _normalize_panfleto(raw: str):
     """Normaliza para 'P=1234' se houver dígitos; retorna (normalizado, raw)."""
     raw = (raw or "").strip()
@@ -610,33 +673,36 @@ def _enviar_alerta_handoff(wa_to, nome_cliente):
             "to": _HANDOFF_NUMERO,
             "text": {"body": msg}
         }
-        requests.post(GRAPH_URL, headers=HEADERS, json=payload, timeout=10)
+        _envios().enviar(payload, prioridade=HANDOFF, tipo="handoff", timeout=10)
         print("🔔 Alerta handoff Clínica enviado")
     except Exception as e:
         print("❌ Erro alerta handoff:", e)
 
-# ===== Histórico de conversa para IA =========================================
-_HIST_IA: dict = {}
-_HIST_TTL = 3600
+# ===== Estado por contato (memória / SQLite / Redis — ver armazem_sessoes.py) ==
+ARMAZEM = criar_armazem()
+
+# Solicitações repetidas (duplo clique em Confirmar, reenvio da Meta...) dentro
+# de SOLICITACAO_JANELA_MIN minutos não geram outra linha
+SOLICITACOES = JanelaDedup(armazem=ARMAZEM)
+
+# ===== Histórico de conversa para IA (ver historico_ia.py) ===================
+_HIST_IA = criar_historico(ARMAZEM)
 
 def _get_hist_ia(wa_to):
-    h = _HIST_IA.get(wa_to, {})
-    if time.time() - h.get("ts", 0) > _HIST_TTL:
-        return []
-    return list(h.get("msgs", []))
+    return _HIST_IA.recentes(wa_to)
 
 def _add_hist_ia(wa_to, user_msg, assistant_msg):
-    h = _HIST_IA.get(wa_to, {})
-    msgs = list(h.get("msgs", []))
-    msgs.append({"role": "user", "content": user_msg})
-    msgs.append({"role": "assistant", "content": assistant_msg})
-    _HIST_IA[wa_to] = {"msgs": msgs[-10:], "ts": time.time()}
+    _HIST_IA.adicionar(wa_to, user_msg, assistant_msg)
 
 # ===== Sessão ================================================================
-SESS: Dict[str, Dict[str, Any]] = {}
+SESS = MapaSessoes(ARMAZEM, "sess", ttl_s=SESSION_TTL_MIN * 60)
 
-# Controle inteligente de acessos recentes
-ULTIMO_ACESSO: Dict[str, float] = {}
+_ROTAS_AGENDAMENTO = frozenset({Rota.CONSULTA, Rota.EXAMES})
+_ROTAS_ENDERECO    = frozenset({Rota.CONSULTA, Rota.EXAMES, Rota.EDITAR_ENDERECO})
+_ROTAS_PACIENTE    = frozenset({Rota.RETORNO, Rota.RESULTADO})
+
+# Controle inteligente de acessos recentes (depois da janela a entrada não serve mais)
+ULTIMO_ACESSO = MapaSessoes(ARMAZEM, "ultimo_acesso", ttl_s=ACESSO_JANELA_S)
 
 # ============================================================
 # RESET DE SESSÃO (IGUAL OFICINA)
@@ -696,10 +762,10 @@ def _comuns_exames(d):
     return campos
 
 def _fields_for(route, d):
-    if route=="consulta":         return _comuns_consulta(d)
-    if route=="exames":           return _comuns_exames(d)
-    if route=="editar_endereco":  return [("cep","Informe seu CEP:"),("numero","Informe o número:")]
-    if route=="retorno":
+    if route == Rota.CONSULTA:         return _comuns_consulta(d)
+    if route == Rota.EXAMES:           return _comuns_exames(d)
+    if route == Rota.EDITAR_ENDERECO:  return [("cep","Informe seu CEP:"),("numero","Informe o número:")]
+    if route == Rota.RETORNO:
 
         # ===== CAMPOS ANTIGOS DESATIVADOS TEMPORARIAMENTE =====
         # return [("cpf","Informe o CPF:"), ("nasc","Data de nascimento (dd/mm/aaaa):")]
@@ -707,7 +773,7 @@ def _fields_for(route, d):
         # >>> NOVO FLUXO SIMPLIFICADO
         return [("nome","Informe o nome completo do paciente:")]
     
-    if route=="resultado":
+    if route == Rota.RESULTADO:
 
         # ===== CAMPOS ANTIGOS DESATIVADOS TEMPORARIAMENTE =====
         # return [("cpf","Informe o CPF:"), ("nasc","Data de nascimento (dd/mm/aaaa):")]
@@ -763,17 +829,34 @@ FECHAMENTO_FORA = {
 
 # ===== Handler principal ======================================================
 def responder_evento_mensagem(entry: dict) -> None:
+    """Processa TODAS as mensagens de todas as changes de um entry da Meta."""
+    for change in entry.get("changes") or []:
+        val      = change.get("value", {})
+        messages = val.get("messages") or []
+        contacts = val.get("contacts") or []
+        if not messages or not contacts:
+            continue
+
+        nomes = {c.get("wa_id"): (c.get("profile") or {}).get("name") or "" for c in contacts}
+        for msg in messages:
+            wa_to = msg.get("from") or contacts[0].get("wa_id")
+            profile_name = nomes.get(wa_to) or (contacts[0].get("profile") or {}).get("name") or ""
+            responder_mensagem(msg, wa_to, profile_name)
+
+def responder_mensagem(msg: dict, wa_to: str, profile_name: str = "") -> None:
+    """Processa UMA mensagem já normalizada (remetente + nome do perfil)."""
+    if CLINICA_SHEETS_URL and CLINICA_SHEETS_SECRET and SHEETS_MODO != "inline":
+        FILA_SHEETS.iniciar()   # drena a outbox que um processo anterior deixou
+    with turno_sessao(wa_to), LOTE.turno():
+        _responder_mensagem(msg, wa_to, profile_name)
+
+def _responder_mensagem(msg: dict, wa_to: str, profile_name: str) -> None:
     ss = None
 
-    val      = (entry.get("changes") or [{}])[0].get("value", {})
-    messages = val.get("messages", [])
-    contacts = val.get("contacts", [])
-    if not messages or not contacts:
+    if not wa_to:
         return
-
-    msg          = messages[0]
-    wa_to        = contacts[0].get("wa_id") or msg.get("from")
-    profile_name = (contacts[0].get("profile") or {}).get("name") or ""
+    profile_name = profile_name or ""
+    CONTADORES["turnos"] += 1
     mtype        = msg.get("type")
 
     # ===== cria/recupera sessão =====
@@ -782,20 +865,18 @@ def responder_evento_mensagem(entry: dict) -> None:
     today = now.strftime("%Y-%m-%d")
 
     if not ses:
-        ses = {
-            "route": "root",
-            "stage": "",
-            "data": {},
-            "last_at": now
-        }
-        SESS[wa_to] = ses
+        ses = Sessao(Rota.ROOT, last_at=now)
+    elif ses.__class__ is dict:
+        ses = Sessao(**ses)   # sessão gravada no formato antigo (armazém compartilhado)
     else:
-        ses["last_at"] = now
+        ses.last_at = now
+    SESS[wa_to] = ses   # renova o prazo da sessão a cada mensagem
 
     # 🔐 GARANTIR IDENTIFICAÇÃO DO CONTATO
-    ses["data"]["contato"] = wa_to
-    ses["data"]["wa_id"] = wa_to
-    ses["data"]["whatsapp_nome"] = profile_name
+    dados = ses.data
+    dados.contato = wa_to
+    dados.wa_id = wa_to
+    dados.whatsapp_nome = profile_name
 
     # ===== REGISTRO DE ACESSO INTELIGENTE =====
 
@@ -803,11 +884,11 @@ def responder_evento_mensagem(entry: dict) -> None:
     ultimo_acesso = ULTIMO_ACESSO.get(wa_to, 0)
 
     # Evita registrar múltiplos acessos em sequência rápida
-    if agora_ts - ultimo_acesso > 1800:  # 30 minutos
+    if agora_ts - ultimo_acesso > ACESSO_JANELA_S:  # 30 minutos
 
         try:
 
-            _post_webapp({
+            _registrar_acesso({
                 "tipo": "acesso_inicial",
                 "especialidade": "acesso_inicial",
                 "contato": wa_to,
@@ -834,14 +915,9 @@ def responder_evento_mensagem(entry: dict) -> None:
         if texto_btn in {"olá", "ola", "agendar consulta", "falar com atendente"}:
             reset_sessao(wa_to)
 
-            SESS[wa_to] = {
-                "route": "root",
-                "stage": "",
-                "data": {},
-                "last_at": _now_sp()
-            }
+            SESS[wa_to] = Sessao(Rota.ROOT, last_at=_now_sp())
 
-            _send_buttons(wa_to, _welcome_named(profile_name), BTN_ROOT)
+            _send_boas_vindas(wa_to, profile_name)
             return
 
     # ===== INTERACTIVE =======================================================
@@ -851,30 +927,30 @@ def responder_evento_mensagem(entry: dict) -> None:
         lr       = inter.get("list_reply") or {}
         bid_id   = (br.get("id") or lr.get("id") or "").strip()
         if not bid_id:
-            _send_buttons(wa_to, _welcome_named(profile_name), BTN_ROOT)
+            _send_boas_vindas(wa_to, profile_name)
             return
 
         # Menu raiz
         if bid_id == "op_consulta":
-            SESS[wa_to] = {"route":"consulta","stage":"forma","data":{"tipo":"consulta"}}
+            SESS[wa_to] = Sessao(Rota.CONSULTA, Etapa.FORMA, {"tipo":"consulta"})
             _ask_forma(wa_to); return
         if bid_id == "op_exames":
-            SESS[wa_to] = {"route":"exames","stage":"forma","data":{"tipo":"exames"}}
+            SESS[wa_to] = Sessao(Rota.EXAMES, Etapa.FORMA, {"tipo":"exames"})
             _ask_forma(wa_to); return
 
         # + Opções → Menus adicionais
         if bid_id == "op_mais":
-            SESS[wa_to] = {"route":"mais2","stage":"","data":{}}
-            _send_buttons(wa_to, "Outras opções:", BTN_MAIS_2); return
+            SESS[wa_to] = Sessao(Rota.MAIS2)
+            _send_catalogo(wa_to, "mais2"); return
         
         if bid_id == "op_retorno":
 
             # ===== CPF DESATIVADO =====
-            # SESS[wa_to] = {"route":"retorno","stage":"cpf","data":{"tipo":"retorno"}}
+            # SESS[wa_to] = Sessao(Rota.RETORNO, Etapa.CPF, {"tipo":"retorno"})
             # _send_text(wa_to, "Para prosseguir, informe o CPF do paciente:")
 
             # >>> NOVO
-            SESS[wa_to] = {"route":"retorno","stage":"nome","data":{"tipo":"retorno"}}
+            SESS[wa_to] = Sessao(Rota.RETORNO, Etapa.NOME, {"tipo":"retorno"})
             _send_text(wa_to, "Para prosseguir, informe o nome completo do paciente:")
             return
 
@@ -882,24 +958,24 @@ def responder_evento_mensagem(entry: dict) -> None:
         if bid_id == "op_resultado":
 
             # ===== CPF DESATIVADO =====
-            # SESS[wa_to] = {"route":"resultado","stage":"cpf","data":{"tipo":"resultado"}}
+            # SESS[wa_to] = Sessao(Rota.RESULTADO, Etapa.CPF, {"tipo":"resultado"})
             # _send_text(wa_to, "Para prosseguir, informe o CPF do paciente:")
 
             # >>> NOVO
-            SESS[wa_to] = {"route":"resultado","stage":"nome","data":{"tipo":"resultado"}}
+            SESS[wa_to] = Sessao(Rota.RESULTADO, Etapa.NOME, {"tipo":"resultado"})
             _send_text(wa_to, "Para prosseguir, informe o nome completo do paciente:")
             return
         
         if bid_id == "op_mais3":
-            SESS[wa_to] = {"route":"mais3","stage":"","data":{}}
-            _send_buttons(wa_to, "Mais opções:", BTN_MAIS_3); return
+            SESS[wa_to] = Sessao(Rota.MAIS3)
+            _send_catalogo(wa_to, "mais3"); return
         if bid_id == "op_endereco":
             # LOG leve do clique em Endereço (quem e quando)
             try:
                     # >>> LOG DE ACESSO AO ENDEREÇO
                     # Registra no Sheets toda vez que alguém clica em "Endereço".
                     # Isso permite medir interesse passivo mesmo sem agendamento.
-                    _post_webapp({
+                    _registrar_acesso({
                         "tipo": "acesso_endereco",         # Coluna E
                         "especialidade": "endereco",       # Coluna D (campo oficial)
                         "contato": (wa_to or "").strip(),
@@ -909,28 +985,16 @@ def responder_evento_mensagem(entry: dict) -> None:
             except Exception as e:
                 print("[LOG ENDERECO] aviso:", e)
 
-            txt = (
-                "📍 *Endereço*\n"
-                "Rua Utrecht, 129 – Vila Rio Branco – CEP 03878-000 – São Paulo/SP\n"
-                f"🗺️ Ver no Maps: {LINK_MAPS}\n\n"
-                f"🌐 *Site*: {LINK_SITE}\n"
-                f"📷 *Instagram*: {LINK_INSTAGRAM}\n"
-                "📘 *Facebook*: Clinica Luma\n"
-                f"☎️ *Fixo*: {TEL_FIXO}\n"
-                f"💬 *WhatsApp*: {LINK_WHATSAPP}\n"
-                "✉️ *E-mail*: luma.centromed@gmail.com\n\n"
-                f"📅 *Agendamento online*: {LINK_DOCTORALIA}"
-            )
-            _send_text(wa_to, txt)
-            _send_buttons(wa_to, "Posso ajudar em algo mais?", BTN_ROOT); return
+            _send_catalogo(wa_to, "endereco")
+            _send_catalogo(wa_to, "posso_ajudar"); return
 
         if bid_id == "op_editar_endereco":
-            SESS[wa_to] = {"route":"consulta","stage":"forma","data":{"tipo":"consulta"}}
+            SESS[wa_to] = Sessao(Rota.CONSULTA, Etapa.FORMA, {"tipo":"consulta"})
             _send_text(wa_to, "Vamos atualizar seus dados. Primeiro:")
             _ask_forma(wa_to); return
         if bid_id == "op_mais4":
-            SESS[wa_to] = {"route":"mais4","stage":"","data":{}}
-            _send_buttons(wa_to, "Opções finais:", BTN_MAIS_4); return
+            SESS[wa_to] = Sessao(Rota.MAIS4)
+            _send_catalogo(wa_to, "mais4"); return
         if bid_id == "op_sugestoes":
             _send_text(wa_to, MSG_SUGESTOES)
             _send_buttons(wa_to, "Selecione uma opção:", [
@@ -939,40 +1003,40 @@ def responder_evento_mensagem(entry: dict) -> None:
                 {"id":"op_voltar_root","title":"Voltar ao início"},
             ]); return
         if bid_id == "op_voltar_root":
-            SESS[wa_to] = {"route":"root","stage":"","data":{}}
-            _send_buttons(wa_to, _welcome_named(profile_name), BTN_ROOT); return
+            SESS[wa_to] = Sessao(Rota.ROOT)
+            _send_boas_vindas(wa_to, profile_name); return
 
         # Sugestões
         if bid_id == "sug_especialidades":
-            SESS[wa_to] = {"route":"sugestao","stage":"await_text","data":{"categoria":"especialidades"}}
+            SESS[wa_to] = Sessao(Rota.SUGESTAO, Etapa.AGUARDA_TEXTO, {"categoria":"especialidades"})
             _send_text(wa_to, "Digite quais *especialidades* você gostaria que a clínica oferecesse:"); return
         if bid_id == "sug_exames":
-            SESS[wa_to] = {"route":"sugestao","stage":"await_text","data":{"categoria":"exames"}}
+            SESS[wa_to] = Sessao(Rota.SUGESTAO, Etapa.AGUARDA_TEXTO, {"categoria":"exames"})
             _send_text(wa_to, "Digite quais *exames* você gostaria que a clínica oferecesse:"); return
 
         # Forma / paciente / doc / confirmar
         if bid_id in {"forma_convenio","forma_particular"}:
-            ses = SESS.get(wa_to) or {"route":"consulta","stage":"forma","data":{"tipo":"consulta"}}
-            ses["data"]["forma"] = "Convênio" if bid_id=="forma_convenio" else "Particular"
-            if ses.get("route") == "consulta":
-                if ses["data"]["forma"] == "Convênio" and not ses["data"].get("convenio"):
-                    ses["stage"] = "convenio"; SESS[wa_to] = ses
+            ses = SESS.get(wa_to) or Sessao(Rota.CONSULTA, Etapa.FORMA, {"tipo":"consulta"})
+            ses.data["forma"] = "Convênio" if bid_id=="forma_convenio" else "Particular"
+            if ses.route == Rota.CONSULTA:
+                if ses.data["forma"] == "Convênio" and not ses.data.get("convenio"):
+                    ses.stage = Etapa.CONVENIO; SESS[wa_to] = ses
                     _send_text(wa_to, "Qual o nome do convênio?"); return
                 _ask_especialidade_num(wa_to, ses); return
-            if ses.get("route") == "exames":
-                if ses["data"]["forma"] == "Convênio" and not ses["data"].get("convenio"):
-                    ses["stage"] = "convenio"; SESS[wa_to] = ses
+            if ses.route == Rota.EXAMES:
+                if ses.data["forma"] == "Convênio" and not ses.data.get("convenio"):
+                    ses.stage = Etapa.CONVENIO; SESS[wa_to] = ses
                     _send_text(wa_to, "Qual o nome do convênio?"); return
                 _ask_exame_num(wa_to, ses); return
             SESS[wa_to] = ses; _finaliza_ou_pergunta_proximo(ss, wa_to, ses); return
 
         if bid_id in {"pac_voce","pac_outro"}:
-            ses = SESS.get(wa_to) or {"route":"consulta","stage":"forma","data":{"tipo":"consulta"}}
+            ses = SESS.get(wa_to) or Sessao(Rota.CONSULTA, Etapa.FORMA, {"tipo":"consulta"})
             if bid_id == "pac_voce":
-                ses["stage"] = None; SESS[wa_to] = ses
+                ses.stage = Etapa.NENHUMA; SESS[wa_to] = ses
                 _finaliza_ou_pergunta_proximo(ss, wa_to, ses); return
             else:
-                ses["data"]["_pac_outro"] = True; ses["stage"] = "paciente_nome"; SESS[wa_to] = ses
+                ses.data["_pac_outro"] = True; ses.stage = Etapa.PACIENTE_NOME; SESS[wa_to] = ses
                 _send_text(wa_to, "Nome completo do paciente:"); return
 
         # ===== BLOCO CPF/RG DO PACIENTE DESATIVADO TEMPORARIAMENTE =====
@@ -980,41 +1044,41 @@ def responder_evento_mensagem(entry: dict) -> None:
 # Mantido aqui apenas para possível reativação futura.
 
 # if bid_id in {"pacdoc_sim","pacdoc_nao"}:
-#     ses = SESS.get(wa_to) or {"route":"consulta","stage":"forma","data":{"tipo":"consulta"}}
+#     ses = SESS.get(wa_to) or Sessao(Rota.CONSULTA, Etapa.FORMA, {"tipo":"consulta"})
 #     if bid_id == "pacdoc_sim":
-#         ses["stage"] = "paciente_doc"
+#         ses.stage = Etapa.PACIENTE_DOC
 #         SESS[wa_to] = ses
 #         _send_text(wa_to, "Informe o CPF ou RG do paciente:")
 #         return
 #     else:
-#         ses["data"]["paciente_documento"] = "Não possui"
-#         ses["stage"] = None
+#         ses.data["paciente_documento"] = "Não possui"
+#         ses.stage = Etapa.NENHUMA
 #         SESS[wa_to] = ses
 #         _finaliza_ou_pergunta_proximo(ss, wa_to, ses)
 #         return
 
 
         if bid_id in {"confirmar","corrigir"}:
-            ses = SESS.get(wa_to) or {"route":"root","stage":"","data":{}}
+            ses = SESS.get(wa_to) or Sessao(Rota.ROOT)
             if bid_id == "corrigir":
-                tipo_atual = (ses.get("data") or {}).get("tipo") or ("consulta" if ses.get("route")=="consulta" else "exames")
-                nova_route = "exames" if tipo_atual == "exames" else "consulta"
-                SESS[wa_to] = {"route": nova_route, "stage": "forma", "data": {"tipo": nova_route}}
+                tipo_atual = ses.data.get("tipo") or ("consulta" if ses.route == Rota.CONSULTA else "exames")
+                nova_route = Rota.EXAMES if tipo_atual == "exames" else Rota.CONSULTA
+                SESS[wa_to] = Sessao(nova_route, Etapa.FORMA, {"tipo": nova_route})
                 _send_text(wa_to, "Sem problemas! Vamos corrigir. Primeiro:"); _ask_forma(wa_to); return
-            ses["data"]["_confirmado"] = True; SESS[wa_to] = ses
+            ses.data["_confirmado"] = True; SESS[wa_to] = ses
             _finaliza_ou_pergunta_proximo(ss, wa_to, ses); return
 
         if bid_id == "compl_sim":
-            ses = SESS.get(wa_to) or {"route":"", "stage":"", "data":{}}
-            ses["data"]["_compl_decidido"] = True          # <--- NOVO
-            ses["stage"] = "complemento"; SESS[wa_to] = ses
+            ses = SESS.get(wa_to) or Sessao(Rota.NENHUMA)
+            ses.data["_compl_decidido"] = True          # <--- NOVO
+            ses.stage = Etapa.COMPLEMENTO; SESS[wa_to] = ses
             _send_text(wa_to, "Digite o complemento (apto, bloco, sala):"); return
         if bid_id == "compl_nao":
-            ses = SESS.get(wa_to) or {"route":"", "stage":"", "data":{}}
-            ses["data"]["complemento"] = ""; ses["stage"] = None; SESS[wa_to] = ses
+            ses = SESS.get(wa_to) or Sessao(Rota.NENHUMA)
+            ses.data["complemento"] = ""; ses.stage = Etapa.NENHUMA; SESS[wa_to] = ses
             _finaliza_ou_pergunta_proximo(ss, wa_to, ses); return
 
-        _send_buttons(wa_to, _welcome_named(profile_name), BTN_ROOT); return
+        _send_boas_vindas(wa_to, profile_name); return
     # ===== TEXTO ==============================================================
     if mtype == "text":
         body = (msg.get("text", {}).get("body") or "").strip()
@@ -1022,18 +1086,19 @@ def responder_evento_mensagem(entry: dict) -> None:
 
         # Áudio transcrito OU emoji puro: vai direto para IA, ignora etapa ativa
         if msg.get("_audio_transcricao") or (body and not any(c.isalpha() or c.isdigit() for c in body)):
-            SESS[wa_to] = {"route": "root", "stage": "", "data": {}, "last_at": now}
+            SESS[wa_to] = Sessao(Rota.ROOT, last_at=now)
             resposta_ia = None
             try:
                 from responder_ia import responder_com_ia
                 hist = _get_hist_ia(wa_to)
+                CONTADORES["ia_chamadas"] += 1
                 resposta_ia = responder_com_ia(body, profile_name or None, historico=hist)
             except Exception:
                 pass
             if resposta_ia:
                 _add_hist_ia(wa_to, body, resposta_ia)
                 _send_text(wa_to, resposta_ia)
-            _send_buttons(wa_to, _welcome_named(profile_name), BTN_ROOT)
+            _send_boas_vindas(wa_to, profile_name)
             return
 
         # HANDOFF — detectar antes de qualquer outra lógica
@@ -1047,7 +1112,7 @@ def responder_evento_mensagem(entry: dict) -> None:
                 f"📱 {LINK_WHATSAPP}\n"
                 f"☎️ {TEL_FIXO}"
             )
-            SESS[wa_to] = {"route": "root", "stage": "", "data": {}, "last_at": now}
+            SESS[wa_to] = Sessao(Rota.ROOT, last_at=now)
             return
 
         # reset manual da conversa
@@ -1056,164 +1121,159 @@ def responder_evento_mensagem(entry: dict) -> None:
 
                     reset_sessao(wa_to)
 
-                    SESS[wa_to] = {
-                        "route": "root",
-                        "stage": "",
-                        "data": {},
-                        "last_at": _now_sp()
-                    }
+                    SESS[wa_to] = Sessao(Rota.ROOT, last_at=_now_sp())
 
-                    _send_buttons(wa_to, _welcome_named(profile_name), BTN_ROOT)
+                    _send_boas_vindas(wa_to, profile_name)
                     return
 
         # decisões simples por texto (quando bot perguntou)
         ses_tmp = SESS.get(wa_to)
-        if ses_tmp and ses_tmp.get("route") in {"consulta","exames"} and ses_tmp.get("stage") == "paciente_doc_choice":
+        if ses_tmp and ses_tmp.route in _ROTAS_AGENDAMENTO and ses_tmp.stage == Etapa.PACIENTE_DOC_CHOICE:
             if low in {"sim","s","yes","y"}:
-                ses_tmp["stage"] = "paciente_doc"; SESS[wa_to] = ses_tmp
+                ses_tmp.stage = Etapa.PACIENTE_DOC; SESS[wa_to] = ses_tmp
                 _send_text(wa_to, "Informe o CPF ou RG do paciente:"); return
             if low in {"nao","não","n","no"}:
-                ses_tmp["data"]["paciente_documento"] = "Não possui"
-                ses_tmp["stage"] = None; SESS[wa_to] = ses_tmp
+                ses_tmp.data["paciente_documento"] = "Não possui"
+                ses_tmp.stage = Etapa.NENHUMA; SESS[wa_to] = ses_tmp
                 _finaliza_ou_pergunta_proximo(ss, wa_to, ses_tmp); return
 
         # sugestões aguardando texto
         ses = SESS.get(wa_to)
-        if ses and ses.get("route") == "sugestao" and ses.get("stage") == "await_text":
-            categoria = ses["data"].get("categoria",""); texto = body.strip()
+        if ses and ses.route == Rota.SUGESTAO and ses.stage == Etapa.AGUARDA_TEXTO:
+            categoria = ses.data.get("categoria",""); texto = body.strip()
             if not texto:
                 _send_text(wa_to, "Pode digitar sua sugestão, por favor?"); return
             _add_sugestao(ss, categoria, texto, wa_to)
             _send_text(wa_to, "🙏 Obrigado pela sugestão! Ela nos ajuda a melhorar a cada dia.")
-            SESS[wa_to] = {"route":"root","stage":"","data":{}}; return
+            SESS[wa_to] = Sessao(Rota.ROOT); return
 
         # ====== ORIGEM (marketing) — menu numerado / coleta P= =================
         ses = SESS.get(wa_to)
-        if ses and ses.get("stage") == "origem_menu":
+        if ses and ses.stage == Etapa.ORIGEM_MENU:
             escolha = re.sub(r"\D", "", body or "")
             if not escolha:
                 _send_text(wa_to, "Por favor, digite apenas um número (0 a 5).")
-                _send_text(wa_to, _origem_menu_texto()); return
+                _send_catalogo(wa_to, "menu_origem"); return
             op = int(escolha)
             if op == 0:
-                ses["data"]["origem_cliente"] = ""
-                ses["data"]["_origem_done"] = True
-                ses["stage"] = None; SESS[wa_to] = ses
+                ses.data["origem_cliente"] = ""
+                ses.data["_origem_done"] = True
+                ses.stage = Etapa.NENHUMA; SESS[wa_to] = ses
                 _finaliza_ou_pergunta_proximo(ss, wa_to, ses); return
             if op == 1:
-                ses["data"]["origem_cliente"] = "Instagram"
-                ses["data"]["_origem_done"] = True
-                ses["stage"] = None; SESS[wa_to] = ses
+                ses.data["origem_cliente"] = "Instagram"
+                ses.data["_origem_done"] = True
+                ses.stage = Etapa.NENHUMA; SESS[wa_to] = ses
                 _finaliza_ou_pergunta_proximo(ss, wa_to, ses); return
             if op == 2:
-                ses["data"]["origem_cliente"] = "Facebook"
-                ses["data"]["_origem_done"] = True
-                ses["stage"] = None; SESS[wa_to] = ses
+                ses.data["origem_cliente"] = "Facebook"
+                ses.data["_origem_done"] = True
+                ses.stage = Etapa.NENHUMA; SESS[wa_to] = ses
                 _finaliza_ou_pergunta_proximo(ss, wa_to, ses); return
             if op == 3:
-                ses["data"]["origem_cliente"] = "Google"
-                ses["data"]["_origem_done"] = True
-                ses["stage"] = None; SESS[wa_to] = ses
+                ses.data["origem_cliente"] = "Google"
+                ses.data["_origem_done"] = True
+                ses.stage = Etapa.NENHUMA; SESS[wa_to] = ses
                 _finaliza_ou_pergunta_proximo(ss, wa_to, ses); return
             if op == 4:  # Panfletos
-                ses["data"]["origem_cliente"] = "Panfleto"
-                ses["stage"] = "origem_panfleto_codigo"; SESS[wa_to] = ses
+                ses.data["origem_cliente"] = "Panfleto"
+                ses.stage = Etapa.ORIGEM_PANFLETO_CODIGO; SESS[wa_to] = ses
                 _send_text(wa_to, "P= ")  # apenas isso, aguardando o código
                 return
             if op == 5:  # Outros (aberto)
-                ses["data"]["origem_cliente"] = "Outros"   # <<< P = "Outros"
-                ses["data"]["origem_outro_texto"] = ""     # <<< limpa R
-                ses["stage"] = "origem_outros_texto"; SESS[wa_to] = ses
+                ses.data["origem_cliente"] = "Outros"   # <<< P = "Outros"
+                ses.data["origem_outro_texto"] = ""     # <<< limpa R
+                ses.stage = Etapa.ORIGEM_OUTROS_TEXTO; SESS[wa_to] = ses
                 _send_text(wa_to, "Pode nos dizer em poucas palavras de onde nos conheceu?"); return
             _send_text(wa_to, "Opção inválida. Escolha um número entre 0 e 5.")
-            _send_text(wa_to, _origem_menu_texto()); return
+            _send_catalogo(wa_to, "menu_origem"); return
 
-        if ses and ses.get("stage") == "origem_outros_texto":
+        if ses and ses.stage == Etapa.ORIGEM_OUTROS_TEXTO:
             texto = (body or "").strip()
-            ses["data"]["origem_cliente"] = "Outros"             # <<< P
-            ses["data"]["origem_outro_texto"] = texto            # <<< R
-            ses["data"]["_origem_done"] = True
-            ses["stage"] = None; SESS[wa_to] = ses
+            ses.data["origem_cliente"] = "Outros"             # <<< P
+            ses.data["origem_outro_texto"] = texto            # <<< R
+            ses.data["_origem_done"] = True
+            ses.stage = Etapa.NENHUMA; SESS[wa_to] = ses
             _finaliza_ou_pergunta_proximo(ss, wa_to, ses); return
 
-        if ses and ses.get("stage") == "origem_panfleto_codigo":
+        if ses and ses.stage == Etapa.ORIGEM_PANFLETO_CODIGO:
             code_norm, code_raw = _normalize_panfleto(body)
             if not code_norm:
                 _send_text(wa_to, "Código inválido. Responda com os números ou com P= seguido do código.")
                 _send_text(wa_to, "P= ")
                 return
-            ses["data"]["panfleto_codigo"] = code_norm
-            ses["data"]["panfleto_codigo_raw"] = code_raw
-            ses["data"]["_origem_done"] = True
-            ses["stage"] = None; SESS[wa_to] = ses
+            ses.data["panfleto_codigo"] = code_norm
+            ses.data["panfleto_codigo_raw"] = code_raw
+            ses.data["_origem_done"] = True
+            ses.stage = Etapa.NENHUMA; SESS[wa_to] = ses
             _finaliza_ou_pergunta_proximo(ss, wa_to, ses); return
         # ======================================================================
 
         # ====== EXAMES por número =============================================
-        if ses and ses.get("route") == "exames" and ses.get("stage") == "exame_num":
+        if ses and ses.route == Rota.EXAMES and ses.stage == Etapa.EXAME_NUM:
             txt = (body or "").strip()
             m = re.match(r"^\s*(\d{1,2})\s*$", txt)
             if not m:
                 _send_text(wa_to, "Por favor, digite apenas o número do exame.")
-                _send_text(wa_to, _exame_menu_texto()); return
+                _send_catalogo(wa_to, "menu_exame"); return
             idx = int(m.group(1))
             if not (1 <= idx <= len(EXAMES_ORDER)):
                 _send_text(wa_to, f"O número {idx} não está na lista. Tente novamente.")
-                _send_text(wa_to, _exame_menu_texto()); return
-            ses["data"]["exame"] = EXAMES_ORDER[idx-1]
-            ses["stage"] = None; SESS[wa_to] = ses
+                _send_catalogo(wa_to, "menu_exame"); return
+            ses.data["exame"] = EXAMES_ORDER[idx-1]
+            ses.stage = Etapa.NENHUMA; SESS[wa_to] = ses
             _finaliza_ou_pergunta_proximo(ss, wa_to, ses); return
         # ======================================================================
 
         # fluxo ativo por texto
         ses = SESS.get(wa_to)
-        active_routes = {"consulta","exames","retorno","resultado","pesquisa","editar_endereco"}
-        if ses and ses.get("route") in active_routes and ses.get("stage"):
+        if ses and ses.route in ROTAS_FORMULARIO and ses.stage:
             _continue_form(ss, wa_to, ses, body); return
         ses = SESS.get(wa_to)
-        if ses and ses.get("route") in active_routes and not ses.get("stage"):
+        if ses and ses.route in ROTAS_FORMULARIO and not ses.stage:
             _finaliza_ou_pergunta_proximo(ss, wa_to, ses); return
 
         # atalhos
         if "consulta" in low:
-            SESS[wa_to] = {"route":"consulta","stage":"forma","data":{"tipo":"consulta"}}; _ask_forma(wa_to); return
+            SESS[wa_to] = Sessao(Rota.CONSULTA, Etapa.FORMA, {"tipo":"consulta"}); _ask_forma(wa_to); return
         if "exame" in low:
-            SESS[wa_to] = {"route":"exames","stage":"forma","data":{"tipo":"exames"}}; _ask_forma(wa_to); return
+            SESS[wa_to] = Sessao(Rota.EXAMES, Etapa.FORMA, {"tipo":"exames"}); _ask_forma(wa_to); return
 
         # Fallback com IA conversacional antes de mostrar o menu
         resposta_ia = None
         try:
             from responder_ia import responder_com_ia
             hist = _get_hist_ia(wa_to)
+            CONTADORES["ia_chamadas"] += 1
             resposta_ia = responder_com_ia(body, profile_name or None, historico=hist)
         except Exception:
             pass
         if resposta_ia:
             _add_hist_ia(wa_to, body, resposta_ia)
             _send_text(wa_to, resposta_ia)
-        _send_buttons(wa_to, _welcome_named(profile_name), BTN_ROOT); return
+        _send_boas_vindas(wa_to, profile_name); return
 # ===== Decidir próximo passo / salvar ========================================
 def _finaliza_ou_pergunta_proximo(ss, wa_to, ses):
-    route = ses.get("route"); data  = ses.get("data", {})
+    route = ses.route; data  = ses.data
 
     # ===== ENDEREÇO AUTOMÁTICO DESATIVADO TEMPORARIAMENTE =====
-# if route in {"consulta","exames","editar_endereco"}:
+# if route in _ROTAS_ENDERECO:
 #     if data.get("cep") and data.get("numero") and ("complemento" in data) and not data.get("endereco"):
 #         end = _montar_endereco_via_cep(data["cep"], data["numero"], data.get("complemento",""))
 #         if end: data["endereco"] = end
 #         else:
-#             ses["stage"] = "cep"
+#             ses.stage = Etapa.CEP
 #             SESS[wa_to] = ses
 #             _send_text(wa_to, "Não localizei o CEP. Envie 8 dígitos ou informe o endereço completo.")
 #             return
 
     # Bifurcação paciente após escolha de forma+especialidade/exame
-    if route == "consulta" and data.get("forma") and data.get("especialidade") and not data.get("_pac_decidido"):
-        data["_pac_decidido"] = True; ses["stage"] = "paciente_escolha"; SESS[wa_to] = ses
-        _send_buttons(wa_to, "O atendimento é para você mesmo(a) ou para outro paciente (filho/dependente)?", BTN_PACIENTE); return
-    if route == "exames" and data.get("forma") and data.get("exame") and not data.get("_pac_decidido"):
-        data["_pac_decidido"] = True; ses["stage"] = "paciente_escolha"; SESS[wa_to] = ses
-        _send_buttons(wa_to, "O atendimento é para você mesmo(a) ou para outro paciente (filho/dependente)?", BTN_PACIENTE); return
+    if route == Rota.CONSULTA and data.get("forma") and data.get("especialidade") and not data.get("_pac_decidido"):
+        data["_pac_decidido"] = True; ses.stage = Etapa.PACIENTE_ESCOLHA; SESS[wa_to] = ses
+        _send_catalogo(wa_to, "paciente"); return
+    if route == Rota.EXAMES and data.get("forma") and data.get("exame") and not data.get("_pac_decidido"):
+        data["_pac_decidido"] = True; ses.stage = Etapa.PACIENTE_ESCOLHA; SESS[wa_to] = ses
+        _send_catalogo(wa_to, "paciente"); return
 
     fields = _fields_for(route, data) or []
     pend   = [(k, q) for (k, q) in fields if not data.get(k)]
@@ -1228,18 +1288,18 @@ def _finaliza_ou_pergunta_proximo(ss, wa_to, ses):
     # NÃO mover este bloco para depois do confirmar.
     # Quando já temos CEP+Número e a decisão sobre complemento (complemento presente,
     # mesmo que vazio), perguntamos a ORIGEM uma única vez, antes de montar o resumo.
-    if route in {"consulta","exames"} and not data.get("_origem_done"):
+    if route in _ROTAS_AGENDAMENTO and not data.get("_origem_done"):
         if data.get("cep") and data.get("numero"):
-            ses["stage"] = "origem_menu"; SESS[wa_to] = ses
-            _send_text(wa_to, _origem_menu_texto()); return
+            ses.stage = Etapa.ORIGEM_MENU; SESS[wa_to] = ses
+            _send_catalogo(wa_to, "menu_origem"); return
 
     # Quando todos os campos obrigatórios estão ok e marketing já foi coletado,
     # montamos a caixa de confirmação.
-    if not pend and route in {"consulta","exames"} and not data.get("_confirmado"):
+    if not pend and route in _ROTAS_AGENDAMENTO and not data.get("_confirmado"):
         # Se ainda não perguntamos marketing por algum motivo, faz agora.
         if not data.get("_origem_done"):
-            ses["stage"] = "origem_menu"; SESS[wa_to] = ses
-            _send_text(wa_to, _origem_menu_texto()); return
+            ses.stage = Etapa.ORIGEM_MENU; SESS[wa_to] = ses
+            _send_catalogo(wa_to, "menu_origem"); return
 
         resumo = [
             f"Responsável: {data.get('nome','')}",
@@ -1248,35 +1308,35 @@ def _finaliza_ou_pergunta_proximo(ss, wa_to, ses):
         ]
         if data.get("_pac_outro"):
             resumo += [f"Paciente: {data.get('paciente_nome','')}  Nasc: {data.get('paciente_nasc','')}  Doc: {data.get('paciente_documento','') or '-'}"]
-        if route=="consulta": resumo.append(f"Especialidade: {data.get('especialidade','')}")
-        if route=="exames":   resumo.append(f"Exame: {data.get('exame','')}")
+        if route == Rota.CONSULTA: resumo.append(f"Especialidade: {data.get('especialidade','')}")
+        if route == Rota.EXAMES:   resumo.append(f"Exame: {data.get('exame','')}")
         # Origem/Marketing no resumo
         if data.get("panfleto_codigo"):
             resumo.append(f"Origem: Panfleto ({data.get('panfleto_codigo')})")
         elif data.get("origem_cliente"):
             resumo.append(f"Origem: {data.get('origem_cliente')}")
         _send_text(wa_to, "✅ Confirme seus dados:\n" + "\n".join(resumo))
-        _send_buttons(wa_to, "Está correto?", BTN_CONFIRMA)
-        ses["stage"] = "confirmar"; SESS[wa_to] = ses; return
+        _send_catalogo(wa_to, "confirma")
+        ses.stage = Etapa.CONFIRMAR; SESS[wa_to] = ses; return
 
     if pend:
         next_key, question = pend[0]
-        ses["stage"] = next_key; SESS[wa_to] = ses
-        if next_key == "forma": _ask_forma(wa_to); return
-        if route == "consulta" and next_key == "especialidade": _ask_especialidade_num(wa_to, ses); return
-        if route == "exames"   and next_key == "exame":          _ask_exame_num(wa_to, ses); return
+        ses.stage = etapa(next_key); SESS[wa_to] = ses
+        if next_key == Etapa.FORMA: _ask_forma(wa_to); return
+        if route == Rota.CONSULTA and next_key == Etapa.ESPECIALIDADE: _ask_especialidade_num(wa_to, ses); return
+        if route == Rota.EXAMES   and next_key == Etapa.EXAME:          _ask_exame_num(wa_to, ses); return
         _send_text(wa_to, question); return
 
-    if route in {"retorno","resultado"}:
+    if route in _ROTAS_PACIENTE:
         _add_solicitacao(ss, data)
         _send_text(wa_to, "✅ Recebido! Nossa equipe vai verificar e te retornar.")
-        SESS[wa_to] = {"route":"root","stage":"","data":{}}; return
+        SESS[wa_to] = Sessao(Rota.ROOT); return
 
-    if route == "editar_endereco":
+    if route == Rota.EDITAR_ENDERECO:
         d = dict(data); d["tipo"] = "editar_endereco"
         _add_solicitacao(ss, d)
         _send_text(wa_to, f"✅ Endereço atualizado e registrado:\n{data.get('endereco','')}")
-        SESS[wa_to] = {"route":"root","stage":"","data":data}; return
+        SESS[wa_to] = Sessao(Rota.ROOT, data=data); return
 
     # (REMOVIDO GANCHO ANTIGO) marketing depois do confirmar
 
@@ -1307,20 +1367,20 @@ def _finaliza_ou_pergunta_proximo(ss, wa_to, ses):
         print("[FINALIZAÇÃO] erro ao enviar mensagem final:", e)
 
     # Reset sessão
-    SESS[wa_to] = {"route":"root", "stage":"", "data":{}}
+    SESS[wa_to] = Sessao(Rota.ROOT)
 
 # ===== Continue form ==========================================================
 def _continue_form(ss, wa_to, ses, user_text):
-    route = ses["route"]; stage = ses.get("stage","" ); data  = ses["data"]
+    route = ses.route; stage = ses.stage; data  = ses.data
 
     # Reabrir UI correta se aguardando
-    if (route == "consulta" and stage == "especialidade"): _ask_especialidade_num(wa_to, ses); return
-    if (route == "exames" and stage == "exame_num"):       _ask_exame_num(wa_to, ses); return
+    if (route == Rota.CONSULTA and stage == Etapa.ESPECIALIDADE): _ask_especialidade_num(wa_to, ses); return
+    if (route == Rota.EXAMES and stage == Etapa.EXAME_NUM):       _ask_exame_num(wa_to, ses); return
 
     # Campo atual
     if stage:
         if stage in {"nasc", "cep"}: user_text = _normalize(stage, user_text)
-        if stage == "forma": data["forma"] = _normalize("forma", user_text)
+        if stage == Etapa.FORMA: data["forma"] = _normalize("forma", user_text)
         else:
             # casos especiais (marketing) já tratados fora
             if stage not in {"origem_outros_texto", "origem_panfleto_codigo", "origem_menu", "exame_num"}:
@@ -1328,53 +1388,53 @@ def _continue_form(ss, wa_to, ses, user_text):
                 if err:
                     _send_text(wa_to, err); _send_text(wa_to, _question_for(route, stage, data)); return
                 data[stage] = user_text if stage in {"nasc", "cep"} else _normalize(stage, user_text)
-                if route == "consulta" and stage == "convenio":
+                if route == Rota.CONSULTA and stage == Etapa.CONVENIO:
                     _ask_especialidade_num(wa_to, ses); return
-                if route == "exames" and stage == "convenio":
+                if route == Rota.EXAMES and stage == Etapa.CONVENIO:
                     _ask_exame_num(wa_to, ses); return
-                if stage == "cep" and route in {"consulta","exames","editar_endereco"}:
-                    ses["stage"] = "numero"; SESS[wa_to] = ses; _send_text(wa_to, "Informe o número:"); return
+                if stage == Etapa.CEP and route in _ROTAS_ENDERECO:
+                    ses.stage = Etapa.NUMERO; SESS[wa_to] = ses; _send_text(wa_to, "Informe o número:"); return
 
     # Paciente "outro"
     if data.get("_pac_outro"):
 
-        if stage == "paciente_nome":
+        if stage == Etapa.PACIENTE_NOME:
             data["paciente_nome"] = (user_text or "").strip()
 
             # ===== DESATIVADO TEMPORARIAMENTE =====
             # Não vamos mais pedir nascimento nem documento do paciente
             # Para reativar no futuro, basta remover o comentário abaixo
 
-            # ses["stage"] = "paciente_nasc"
+            # ses.stage = Etapa.PACIENTE_NASC
             # SESS[wa_to] = ses
             # _send_text(wa_to, "Data de nascimento do paciente (dd/mm/aaaa):")
             # return
 
             # >>> Agora seguimos direto
-            ses["stage"] = None
+            ses.stage = Etapa.NENHUMA
             SESS[wa_to] = ses
             _finaliza_ou_pergunta_proximo(ss, wa_to, ses)
             return
 
         # ===== BLOCO DOCUMENTO PACIENTE DESATIVADO TEMPORARIAMENTE =====
-        # if stage == "paciente_doc":
+        # if stage == Etapa.PACIENTE_DOC:
         #     data["paciente_documento"] = (user_text or "").strip()
-        #     ses["stage"] = None
+        #     ses.stage = Etapa.NENHUMA
         #     SESS[wa_to] = ses
         #     _finaliza_ou_pergunta_proximo(ss, wa_to, ses)
         #     return
 
     # Endereço
-    if route in {"consulta","exames","editar_endereco"} and stage == "numero":
+    if route in _ROTAS_ENDERECO and stage == Etapa.NUMERO:
         if not data.get("numero"):
             _send_text(wa_to, "Informe o número (ou S/N):"); return
-        ses["stage"] = "complemento_decisao"; SESS[wa_to] = ses
-        _send_buttons(wa_to, "Possui complemento (apto, bloco, sala)?", BTN_COMPLEMENTO); return
+        ses.stage = Etapa.COMPLEMENTO_DECISAO; SESS[wa_to] = ses
+        _send_catalogo(wa_to, "complemento"); return
 
-    if stage == "complemento_decisao":
+    if stage == Etapa.COMPLEMENTO_DECISAO:
         # Se já veio do botão "Sim", não repete a pergunta
         if data.get("_compl_decidido"):
-            ses["stage"] = "complemento"
+            ses.stage = Etapa.COMPLEMENTO
             SESS[wa_to] = ses
             _send_text(wa_to, "Digite o complemento (apto, bloco, sala):")
             return
@@ -1382,49 +1442,50 @@ def _continue_form(ss, wa_to, ses, user_text):
         l = (user_text or "").strip().lower()
         if l in {"nao", "não", "n", "no"}:
             data["complemento"] = ""
-            ses["stage"] = None
+            ses.stage = Etapa.NENHUMA
             SESS[wa_to] = ses
             _finaliza_ou_pergunta_proximo(ss, wa_to, ses)
             return
 
         if l in {"sim", "s", "yes", "y"}:
-            ses["stage"] = "complemento"
+            ses.stage = Etapa.COMPLEMENTO
             SESS[wa_to] = ses
             _send_text(wa_to, "Digite o complemento (apto, bloco, sala):")
             return
 
-        _send_buttons(wa_to, "Possui complemento (apto, bloco, sala)?", BTN_COMPLEMENTO)
+        _send_catalogo(wa_to, "complemento")
         return
 
-    if stage == "complemento":
+    if stage == Etapa.COMPLEMENTO:
         data["complemento"] = (user_text or "").strip()
         # opcional: limpar o flag para evitar efeitos colaterais
         data.pop("_compl_decidido", None)
         # Remove flag interna para evitar reentrada em loop
         # Mantém o fluxo limpo após definir complemento
-        ses["stage"] = None
+        ses.stage = Etapa.NENHUMA
         SESS[wa_to] = ses
         _finaliza_ou_pergunta_proximo(ss, wa_to, ses)
         return
 
     # Especialidade por número
-    if route == "consulta" and stage == "especialidade_num":
+    if route == Rota.CONSULTA and stage == Etapa.ESPECIALIDADE_NUM:
         txt = (user_text or "").strip()
         m = re.match(r"^\s*(\d{1,2})\s*$", txt)
         if m:
             idx = int(m.group(1))
             if 1 <= idx <= len(ESPECIALIDADES_ORDER):
-                ses["data"]["especialidade"] = ESPECIALIDADES_ORDER[idx-1]
-                ses["stage"] = None; SESS[wa_to] = ses
+                ses.data["especialidade"] = ESPECIALIDADES_ORDER[idx-1]
+                ses.stage = Etapa.NENHUMA; SESS[wa_to] = ses
                 _finaliza_ou_pergunta_proximo(ss, wa_to, ses); return
             _send_text(wa_to, f"O número {idx} não está na lista. Tente novamente.")
-            _send_text(wa_to, _especialidade_menu_texto()); return
+            _send_catalogo(wa_to, "menu_especialidade"); return
         # Texto livre no lugar de número: tenta IA antes de pedir o número de novo
         resposta_ia = None
         try:
             from responder_ia import responder_com_ia
             nome_ses = data.get("whatsapp_nome") or None
             hist = _get_hist_ia(wa_to)
+            CONTADORES["ia_chamadas"] += 1
             resposta_ia = responder_com_ia(txt, nome_ses, historico=hist)
         except Exception:
             pass
@@ -1433,15 +1494,15 @@ def _continue_form(ss, wa_to, ses, user_text):
             _send_text(wa_to, resposta_ia)
         else:
             _send_text(wa_to, "Não entendi. Digite apenas o número da especialidade.")
-            _send_text(wa_to, _especialidade_menu_texto())
+            _send_catalogo(wa_to, "menu_especialidade")
         return
 
     # Pesquisa (se usar)
-    if route == "pesquisa":
+    if route == Rota.PESQUISA:
         needed = ["nome","cpf","nasc","endereco","especialidade","exame"]
         for k in needed:
             if not data.get(k):
-                ses["stage"] = k; SESS[wa_to] = ses
+                ses.stage = etapa(k); SESS[wa_to] = ses
                 _send_text(wa_to, {
                     "nome":"Informe seu nome completo:",
                     "cpf":"Informe seu CPF:",
@@ -1451,7 +1512,7 @@ def _continue_form(ss, wa_to, ses, user_text):
                     "exame":"Qual exame você procura?"
                 }[k]); return
         _add_pesquisa(ss, data); _send_text(wa_to, "Obrigado! Pesquisa registrada.")
-        SESS[wa_to] = {"route":"root","stage":"","data":{}}; return
+        SESS[wa_to] = Sessao(Rota.ROOT); return
 
     # Continuação padrão
     _finaliza_ou_pergunta_proximo(ss, wa_to, ses)
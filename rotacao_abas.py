@@ -0,0 +1,180 @@
+# rotacao_abas.py — arquivamento mensal das abas que só crescem (Interacoes, Logs, Pesquisa, Solicitacoes)
+# ==============================================================================
+# O bot continua gravando sempre na aba principal (ex.: "Interacoes"): ela é a
+# "fatia atual" e ninguém precisa descobrir onde escrever. Este job, rodado de
+# tempos em tempos (cron do Render / agendador do Windows), move as linhas mais
+# antigas que ROTACAO_DIAS para abas de arquivo por mês ("Interacoes_2025_07"),
+# na mesma planilha ou em ROTACAO_PLANILHA_ARQUIVO.
+#
+# Uso:
+#   python rotacao_abas.py contar
+#   python rotacao_abas.py rotacionar [--dias 90] [--abas Interacoes,Logs] [--simular]
+#
+# Ordem segura: grava no arquivo → confere que as linhas de origem não mudaram →
+# apaga da origem (uma faixa contínua). Se cair no meio, no máximo sobra duplicata
+# no arquivo; nunca se perde linha.
+#
+# Cópia com o mesmo tipo de célula: lê o valor sem formatação (número continua
+# número; data vem como texto formatado) e grava com USER_ENTERED, igual ao bot —
+# a data volta a ser data no arquivo, em vez de texto.
+import os, sys, time
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+
+import gsheets_client as gs
+
+ROTACAO_ABAS              = [a.strip() for a in os.getenv("ROTACAO_ABAS", "Interacoes,Logs,Pesquisa,Solicitacoes").split(",") if a.strip()]
+ROTACAO_DIAS              = int(os.getenv("ROTACAO_DIAS", "90"))
+ROTACAO_PLANILHA_ARQUIVO  = os.getenv("ROTACAO_PLANILHA_ARQUIVO", "").strip()   # vazio = mesma planilha
+ROTACAO_ALERTA_LINHAS     = int(os.getenv("ROTACAO_ALERTA_LINHAS", "20000"))
+ROTACAO_MAX_LINHAS_LOTE   = int(os.getenv("ROTACAO_MAX_LINHAS_LOTE", "5000"))   # por aba, por execução
+
+_FORMATOS = ("%Y-%m-%d %H:%M:%S", "%Y-%m-%d %H:%M", "%Y-%m-%d",
+             "%d/%m/%Y %H:%M:%S", "%d/%m/%Y %H:%M", "%d/%m/%Y")
+
+
+def _data(valor) -> Optional[datetime]:
+    texto = str(valor or "").strip()
+    for fmt in _FORMATOS:
+        try:
+            return datetime.strptime(texto, fmt)
+        except ValueError:
+            pass
+    return None
+
+
+def _valores(planilha: str, faixas: List[str]) -> List[list]:
+    resp = gs._service().spreadsheets().values().batchGet(
+        spreadsheetId=planilha, ranges=faixas, majorDimension="ROWS",
+        valueRenderOption="UNFORMATTED_VALUE", dateTimeRenderOption="FORMATTED_STRING").execute()
+    return [vr.get("values", []) for vr in resp.get("valueRanges", [])]
+
+
+def _propriedades(planilha: str) -> Dict[str, dict]:
+    resp = gs._service().spreadsheets().get(
+        spreadsheetId=planilha, fields="sheets.properties(sheetId,title,gridProperties.rowCount)").execute()
+    return {s["properties"]["title"]: s["properties"] for s in resp.get("sheets", [])}
+
+
+# ===== Contagem ==============================================================
+def contar(abas: List[str] = ROTACAO_ABAS) -> Dict[str, dict]:
+    """Linhas com dados (coluna A) e linhas da grade por aba — duas chamadas no total."""
+    props = _propriedades(gs.SHEET_ID)
+    presentes = [a for a in abas if a in props]
+    colunas = _valores(gs.SHEET_ID, [f"'{a}'!A:A" for a in presentes]) if presentes else []
+    resultado = {}
+    for aba, col in zip(presentes, colunas):
+        linhas = max(0, len(col) - 1)   # sem cabeçalho
+        antiga = next((d for d in (_data(c[0]) for c in col[1:] if c) if d), None)
+        resultado[aba] = {
+            "linhas": linhas,
+            "linhas_grade": props[aba]["gridProperties"]["rowCount"],
+            "mais_antiga": antiga.strftime("%Y-%m-%d") if antiga else None,
+            "rotacionar": linhas >= ROTACAO_ALERTA_LINHAS,
+        }
+    for aba in abas:
+        if aba not in props:
+            resultado[aba] = {"linhas": 0, "ausente": True}
+    return resultado
+
+
+# ===== Rotação ===============================================================
+def _garantir_abas(planilha: str, nomes: List[str], cabecalho: list):
+    """Cria de uma vez (um batchUpdate) as abas de arquivo que faltam, com cabeçalho."""
+    existentes = _propriedades(planilha)
+    faltam = [n for n in nomes if n not in existentes]
+    if not faltam:
+        return
+    svc = gs._service().spreadsheets()
+    svc.batchUpdate(spreadsheetId=planilha, body={
+        "requests": [{"addSheet": {"properties": {"title": n}}} for n in faltam]}).execute()
+    if cabecalho:
+        svc.values().batchUpdate(spreadsheetId=planilha, body={
+            "valueInputOption": "RAW",
+            "data": [{"range": f"'{n}'!A1", "values": [cabecalho]} for n in faltam],
+        }).execute()
+
+
+def rotacionar_aba(aba: str, dias: int = ROTACAO_DIAS, simular: bool = False) -> dict:
+    corte = datetime.now() - timedelta(days=dias)
+    linhas = _valores(gs.SHEET_ID, [f"'{aba}'!A:ZZ"])[0]
+    if len(linhas) <= 1:
+        return {"aba": aba, "movidas": 0}
+    cabecalho, dados = linhas[0], linhas[1:]
+
+    # Aba append-only: as antigas formam um prefixo. Para na primeira linha
+    # recente (ou sem data legível) — o que vier depois fica onde está.
+    n = 0
+    por_mes: Dict[str, list] = {}
+    for linha in dados[:ROTACAO_MAX_LINHAS_LOTE]:
+        quando = _data(linha[0] if linha else "")
+        if quando is None or quando >= corte:
+            break
+        por_mes.setdefault(f"{aba}_{quando:%Y_%m}", []).append(linha)
+        n += 1
+    if not n:
+        return {"aba": aba, "movidas": 0}
+    if simular:
+        return {"aba": aba, "movidas": n, "destinos": {k: len(v) for k, v in por_mes.items()}, "simulado": True}
+
+    destino = ROTACAO_PLANILHA_ARQUIVO or gs.SHEET_ID
+    _garantir_abas(destino, list(por_mes), cabecalho)
+    svc = gs._service().spreadsheets()
+    for nome, bloco in por_mes.items():
+        svc.values().append(
+            spreadsheetId=destino, range=f"'{nome}'!A:ZZ", valueInputOption="USER_ENTERED",
+            insertDataOption="INSERT_ROWS", body={"values": bloco}).execute()
+
+    # Confere que o prefixo ainda é o mesmo (ninguém apagou/inseriu linhas no topo)
+    atual = _valores(gs.SHEET_ID, [f"'{aba}'!A2:A{n + 1}"])[0]
+    if [c[0] if c else "" for c in atual] != [l[0] if l else "" for l in dados[:n]]:
+        print(f"⚠️ [ROTACAO] {aba} mudou durante a rotação — linhas copiadas, origem mantida")
+        return {"aba": aba, "movidas": 0, "copiadas": n, "conflito": True}
+
+    sheet_id = _propriedades(gs.SHEET_ID)[aba]["sheetId"]
+    svc.batchUpdate(spreadsheetId=gs.SHEET_ID, body={"requests": [{
+        "deleteDimension": {"range": {"sheetId": sheet_id, "dimension": "ROWS",
+                                      "startIndex": 1, "endIndex": n + 1}}}]}).execute()
+    return {"aba": aba, "movidas": n, "destinos": {k: len(v) for k, v in por_mes.items()}}
+
+
+def rotacionar(abas: List[str] = ROTACAO_ABAS, dias: int = ROTACAO_DIAS, simular: bool = False) -> list:
+    resultados = []
+    for aba in abas:
+        inicio = time.monotonic()
+        try:
+            r = rotacionar_aba(aba, dias, simular)
+        except Exception as e:
+            r = {"aba": aba, "erro": str(e)}
+        r["ms"] = round((time.monotonic() - inicio) * 1000)
+        print(f"🗄️ [ROTACAO] {r}")
+        resultados.append(r)
+    return resultados
+
+
+def _main(argv):
+    import argparse
+    from dotenv import load_dotenv
+    load_dotenv()
+    gs.SHEET_ID = gs.SHEET_ID or os.getenv("CLINICA_SHEET_ID")
+
+    ap = argparse.ArgumentParser(description="Arquivamento mensal das abas de log da clínica")
+    ap.add_argument("acao", choices=["contar", "rotacionar"])
+    ap.add_argument("--dias", type=int, default=ROTACAO_DIAS)
+    ap.add_argument("--abas", default=",".join(ROTACAO_ABAS))
+    ap.add_argument("--simular", action="store_true", help="só mostra o que seria movido")
+    args = ap.parse_args(argv)
+    abas = [a.strip() for a in args.abas.split(",") if a.strip()]
+
+    if args.acao == "contar":
+        for aba, info in contar(abas).items():
+            alerta = "  ← rotacionar" if info.get("rotacionar") else ""
+            print(f"{aba:>14}: {info.get('linhas', 0):>7} linhas  "
+                  f"(grade {info.get('linhas_grade', '-')}, mais antiga {info.get('mais_antiga') or '-'})"
+                  f"{' [ausente]' if info.get('ausente') else ''}{alerta}")
+    else:
+        rotacionar(abas, args.dias, args.simular)
+
+
+if __name__ == "__main__":
+    _main(sys.argv[1:])
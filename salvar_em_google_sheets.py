@@ -1,10 +1,11 @@
-import gspread 
-from google.oauth2.service_account import Credentials
 from datetime import datetime
 import traceback
 import os
 from dotenv import load_dotenv
 
+from indice_contatos import indice
+from planilhas_google import com_aba
+
 # 🔁 Carregar variáveis do .env
 load_dotenv()
 
@@ -12,22 +13,24 @@ CAMINHO_CREDENCIAL = os.getenv("SHEETS_CREDENTIALS_PATH")  # 👈 usa .env agora
 SHEET_ID = '1Xke33HzOXW78CjX7sVm9O0RZmw7dvUN2YzjBXcVQ0II'
 NOME_ABA = 'Página1'
 
+# Números já presentes na coluna A (evita baixar a coluna inteira a cada contato)
+INDICE = indice(SHEET_ID, NOME_ABA)
+
 def salvar_em_google_sheets(numero, nome, interesse='-', data=None):
     if data is None:
         data = datetime.now().strftime('%d/%m/%Y')
     try:
-        SCOPES = ['https://www.googleapis.com/auth/spreadsheets']
-        creds = Credentials.from_service_account_file(CAMINHO_CREDENCIAL, scopes=SCOPES)
-        client = gspread.authorize(creds)
-        planilha = client.open_by_key(SHEET_ID)
-        aba = planilha.worksheet(NOME_ABA)
-        numeros_existentes = [n.strip() for n in aba.col_values(1)]
-        if numero.strip() in numeros_existentes:
-            print("📌 Número já registrado.")
-            return
-        print(f"🟡 Tentando gravar: {numero}, {nome}, {interesse}, {data}")
-        aba.append_row([numero, nome, interesse, data], value_input_option="USER_ENTERED")
-        print("✅ Contato salvo com sucesso no Google Sheets.")
+        def gravar(aba):
+            with INDICE.lock:
+                if INDICE.contem(aba, numero):
+                    print("📌 Número já registrado.")
+                    return
+                print(f"🟡 Tentando gravar: {numero}, {nome}, {interesse}, {data}")
+                resp = aba.append_row([numero, nome, interesse, data], value_input_option="USER_ENTERED")
+                INDICE.registrar_append(numero, resp)
+            print("✅ Contato salvo com sucesso no Google Sheets.")
+
+        com_aba(SHEET_ID, NOME_ABA, CAMINHO_CREDENCIAL, gravar)
     except Exception as e:
         print("❌ Erro ao salvar no Google Sheets:")
         traceback.print_exc()
@@ -0,0 +1,238 @@
+# sessao.py — sessão de conversa compacta (__slots__) com rota/etapa em constantes nomeadas
+# ==============================================================================
+# Antes cada sessão era um dict aninhado ({"route","stage","data","last_at"}),
+# recriado com literais a cada troca de menu, e rota/etapa eram comparadas como
+# texto. Aqui:
+#
+#   Rota / Etapa   constantes com nome para os textos de rota/etapa
+#                  (`ses.stage == Etapa.FORMA`); o valor continua sendo o texto
+#                  antigo (vai igual para logs, JSON e Sheets)
+#   Formulario     os campos coletados no fluxo em __slots__; chaves fora da lista
+#                  vão para `extras`. Tem get/[]/in/pop/keys, então dict(data)
+#                  e o resto do código que lia o dict continuam funcionando
+#   Sessao         route, stage, data, last_at em __slots__
+#
+# Serialização para o armazém compartilhado: uma lista curta
+# [rota, etapa, {campos preenchidos}, last_at epoch] (ver armazem_sessoes).
+from datetime import datetime
+from operator import attrgetter
+from typing import FrozenSet, Optional
+
+from zoneinfo import ZoneInfo
+
+from armazem_sessoes import registrar_tipo
+
+_TZ_SP = ZoneInfo("America/Sao_Paulo")
+
+
+class _Rotulos:
+    """Constantes de texto (em MAIÚSCULAS) de uma enumeração; `valores` lista as válidas."""
+    valores: FrozenSet[str] = frozenset()
+
+    def __init_subclass__(cls):
+        cls.valores = frozenset(v for k, v in vars(cls).items() if k.isupper())
+
+
+class Rota(_Rotulos):
+    NENHUMA         = ""
+    ROOT            = "root"
+    CONSULTA        = "consulta"
+    EXAMES          = "exames"
+    RETORNO         = "retorno"
+    RESULTADO       = "resultado"
+    EDITAR_ENDERECO = "editar_endereco"
+    PESQUISA        = "pesquisa"
+    SUGESTAO        = "sugestao"
+    MAIS2           = "mais2"
+    MAIS3           = "mais3"
+    MAIS4           = "mais4"
+
+
+class Etapa(_Rotulos):
+    NENHUMA                = ""
+    FORMA                  = "forma"
+    CONVENIO               = "convenio"
+    ESPECIALIDADE          = "especialidade"
+    ESPECIALIDADE_NUM      = "especialidade_num"
+    EXAME                  = "exame"
+    EXAME_NUM              = "exame_num"
+    NOME                   = "nome"
+    CPF                    = "cpf"
+    NASC                   = "nasc"
+    ENDERECO               = "endereco"
+    CEP                    = "cep"
+    NUMERO                 = "numero"
+    COMPLEMENTO            = "complemento"
+    COMPLEMENTO_DECISAO    = "complemento_decisao"
+    CONFIRMAR              = "confirmar"
+    AGUARDA_TEXTO          = "await_text"
+    ORIGEM_MENU            = "origem_menu"
+    ORIGEM_OUTROS_TEXTO    = "origem_outros_texto"
+    ORIGEM_PANFLETO_CODIGO = "origem_panfleto_codigo"
+    PACIENTE_ESCOLHA       = "paciente_escolha"
+    PACIENTE_NOME          = "paciente_nome"
+    PACIENTE_NASC          = "paciente_nasc"
+    PACIENTE_DOC           = "paciente_doc"
+    PACIENTE_DOC_CHOICE    = "paciente_doc_choice"
+
+
+# Rotas que coletam dados por texto (fluxo ativo)
+ROTAS_FORMULARIO = frozenset({Rota.CONSULTA, Rota.EXAMES, Rota.RETORNO, Rota.RESULTADO,
+                              Rota.PESQUISA, Rota.EDITAR_ENDERECO})
+
+
+def rota(valor) -> str:
+    """Texto/None → texto da rota; None vira Rota.NENHUMA."""
+    return str(valor) if valor else Rota.NENHUMA
+
+
+def etapa(valor) -> str:
+    """Texto/None → texto da etapa; None vira Etapa.NENHUMA."""
+    return str(valor) if valor else Etapa.NENHUMA
+
+
+# ===== Dados do formulário ===================================================
+_CAMPOS = (
+    "tipo", "forma", "convenio", "especialidade", "exame", "categoria",
+    "nome", "cpf", "nasc", "endereco", "cep", "numero", "complemento",
+    "contato", "wa_id", "whatsapp_nome",
+    "paciente_nome", "paciente_nasc", "paciente_documento",
+    "origem_cliente", "origem_outro_texto", "panfleto_codigo", "panfleto_codigo_raw",
+    # flags internas do fluxo (não vão para o Sheets — ver registro_sheets)
+    "_pac_outro", "_pac_decidido", "_origem_done", "_confirmado", "_compl_decidido",
+)
+_CAMPOS_SET = frozenset(_CAMPOS)
+
+
+class Formulario:
+    """
+    Campos coletados no fluxo. Campo vazio (None) = ausente, como chave ausente
+    no dict antigo. Chaves que não estão em _CAMPOS vão para `extras`.
+    No código novo, leia direto o atributo (data.forma); get/[] ficam para o resto.
+    """
+    __slots__ = _CAMPOS + ("extras",)
+
+    def __init__(self, dados: Optional[dict] = None):
+        for campo in Formulario.__slots__:
+            setattr(self, campo, None)
+        if dados:
+            for chave, valor in dados.items():
+                if chave in _CAMPOS_SET:
+                    setattr(self, chave, valor)
+                else:
+                    self[chave] = valor
+
+    def get(self, chave, padrao=None):
+        if chave in _CAMPOS_SET:
+            valor = getattr(self, chave)
+            return padrao if valor is None else valor
+        return self.extras.get(chave, padrao) if self.extras else padrao
+
+    def __getitem__(self, chave):
+        valor = self.get(chave)
+        if valor is None:
+            raise KeyError(chave)
+        return valor
+
+    def __setitem__(self, chave, valor):
+        if chave in _CAMPOS_SET:
+            setattr(self, chave, valor)
+        else:
+            if self.extras is None:
+                self.extras = {}
+            self.extras[chave] = valor
+
+    def __contains__(self, chave) -> bool:
+        return self.get(chave) is not None
+
+    def pop(self, chave, *padrao):
+        valor = self.get(chave)
+        if valor is None:
+            if padrao:
+                return padrao[0]
+            raise KeyError(chave)
+        if chave in _CAMPOS_SET:
+            setattr(self, chave, None)
+        else:
+            del self.extras[chave]
+        return valor
+
+    def para_dict(self) -> dict:
+        d = {c: v for c, v in zip(_CAMPOS, _LER_CAMPOS(self)) if v is not None}
+        if self.extras:
+            d.update(self.extras)
+        return d
+
+    def keys(self):
+        return self.para_dict().keys()
+
+    def items(self):
+        return self.para_dict().items()
+
+    def __iter__(self):
+        return iter(self.para_dict())
+
+    def __len__(self) -> int:
+        return len(self.para_dict())
+
+    def __repr__(self):
+        return f"Formulario({self.para_dict()!r})"
+
+
+_LER_CAMPOS = attrgetter(*_CAMPOS)
+
+
+# ===== Sessão ================================================================
+@registrar_tipo
+class Sessao:
+    """
+    Estado de um contato. Aceita também ses["stage"] / ses.get("data") do código
+    antigo; a gravação por chave normaliza rota/etapa (None vira "").
+    """
+    __slots__ = ("route", "stage", "data", "last_at")
+
+    def __init__(self, route: str = Rota.ROOT, stage: str = Etapa.NENHUMA, data=None,
+                 last_at: Optional[datetime] = None):
+        self.route = rota(route)
+        self.stage = etapa(stage)
+        self.data = data if data.__class__ is Formulario else Formulario(data)
+        self.last_at = last_at
+
+    # --- compatibilidade com o dict antigo -----------------------------------
+    def get(self, chave, padrao=None):
+        if chave in Sessao.__slots__:
+            valor = getattr(self, chave)
+            return padrao if valor is None else valor
+        return padrao
+
+    def __getitem__(self, chave):
+        if chave not in Sessao.__slots__:
+            raise KeyError(chave)
+        return getattr(self, chave)
+
+    def __setitem__(self, chave, valor):
+        if chave == "stage":
+            self.stage = etapa(valor)
+        elif chave == "route":
+            self.route = rota(valor)
+        elif chave == "data":
+            self.data = valor if valor.__class__ is Formulario else Formulario(valor)
+        elif chave == "last_at":
+            self.last_at = valor
+        else:
+            raise KeyError(chave)
+
+    # --- serialização compacta -----------------------------------------------
+    _etiqueta = "__ses__"
+
+    def para_json(self) -> list:
+        return [self.route, self.stage, self.data.para_dict(),
+                self.last_at.timestamp() if self.last_at else None]
+
+    @classmethod
+    def de_json(cls, v: list) -> "Sessao":
+        quando = datetime.fromtimestamp(v[3], _TZ_SP) if v[3] is not None else None
+        return cls(v[0], v[1], v[2], quando)
+
+    def __repr__(self):
+        return f"Sessao({self.route!r}, {self.stage!r}, {self.data!r})"
@@ -0,0 +1,99 @@
+# status_entrega.py — callbacks de status da Meta (sent/delivered/read/failed)
+# ==============================================================================
+# A maior parte do tráfego do webhook é status, não mensagem. Aqui esses payloads
+# são reconhecidos cedo e viram contadores em memória, sem passar pelo pipeline
+# de conversa nem imprimir o payload inteiro no log.
+import os, threading
+from collections import Counter, OrderedDict
+
+from metricas import Estatistica
+
+STATUS_MAX_MENSAGENS = int(os.getenv("STATUS_MAX_MENSAGENS", "20000"))
+
+
+def so_status(data: dict) -> bool:
+    """True se o payload só traz 'statuses' (nenhuma mensagem de paciente)."""
+    entries = data.get("entry")
+    if not entries:
+        return False
+    tem_status = False
+    for entry in entries:
+        for change in entry.get("changes") or ():
+            value = change.get("value") or {}
+            if "messages" in value:
+                return False
+            if "statuses" in value:
+                tem_status = True
+    return tem_status
+
+
+class RegistroEntregas:
+    """
+    Estado de entrega por message_id (limitado aos últimos max_mensagens)
+    + agregados: contagem por status, códigos de falha e latências
+    sent→delivered e delivered→read (timestamps da própria Meta).
+    """
+
+    def __init__(self, max_mensagens: int = STATUS_MAX_MENSAGENS):
+        self.max_mensagens = max_mensagens
+        self._lock = threading.Lock()
+        self._estado = OrderedDict()       # message_id -> {status: ts}
+        self.por_status = Counter()
+        self.falhas_por_codigo = Counter()
+        self.enviado_entregue_s = Estatistica()
+        self.entregue_lido_s = Estatistica()
+
+    def registrar_payload(self, data: dict):
+        for entry in data.get("entry") or ():
+            for change in entry.get("changes") or ():
+                for st in (change.get("value") or {}).get("statuses") or ():
+                    self.registrar(st)
+
+    def registrar(self, st: dict):
+        mid = st.get("id")
+        status = st.get("status") or "?"
+        try:
+            ts = int(st.get("timestamp") or 0)
+        except (TypeError, ValueError):
+            ts = 0
+
+        with self._lock:
+            if mid:
+                marcas = self._estado.get(mid)
+                if marcas is None:
+                    marcas = {}
+                    self._estado[mid] = marcas
+                    while len(self._estado) > self.max_mensagens:
+                        self._estado.popitem(last=False)
+                if status in marcas:
+                    return   # reentrega do mesmo status: já contado
+                marcas[status] = ts
+
+            self.por_status[status] += 1
+            if status == "failed":
+                for err in st.get("errors") or [{}]:
+                    codigo = str(err.get("code", "?"))
+                    self.falhas_por_codigo[codigo] += 1
+                    print(f"❌ [STATUS] falha {codigo} p/ {st.get('recipient_id')}: {err.get('title', '')}")
+
+            if not mid:
+                return
+
+        if status == "delivered" and marcas.get("sent") and ts:
+            self.enviado_entregue_s.registrar(ts - marcas["sent"])
+        elif status == "read" and marcas.get("delivered") and ts:
+            self.entregue_lido_s.registrar(ts - marcas["delivered"])
+
+    def estado(self, message_id: str) -> dict:
+        with self._lock:
+            return dict(self._estado.get(message_id) or {})
+
+    def metricas(self) -> dict:
+        with self._lock:
+            return {
+                "mensagens_rastreadas": len(self._estado),
+                "por_status": dict(self.por_status),
+                "falhas_por_codigo": dict(self.falhas_por_codigo),
+                "enviado_entregue_s": self.enviado_entregue_s.resumo(),
+                "entregue_lido_s": self.entregue_lido_s.resumo(),
+            }
@@ -1,8 +1,14 @@
 import os
-import requests
-from flask import Flask, request
+from flask import Flask, request, jsonify
 from dotenv import load_dotenv
 import responder_clinica as responder
+from executor_remetente import ExecutorPorRemetente
+from dedup_mensagens import DedupTTL
+from eventos_meta import EventoEntrada, extrair_eventos
+from status_entrega import RegistroEntregas, so_status
+from agrupador_rajadas import AgrupadorRajadas
+from whatsapp_client import cliente as cliente_wa
+from agendador_envios import agendador
 
 load_dotenv()
 app = Flask(__name__)
@@ -11,16 +17,40 @@ app = Flask(__name__)
 # CONTROLE DE DUPLICIDADE
 # ============================================================
 
-MENSAGENS_PROCESSADAS = set()
+# Janela de tempo + tamanho máximo; DEDUP_SQLITE_PATH persiste entre restarts
+MENSAGENS_PROCESSADAS = DedupTTL()
 
 # ============================================================
 # VARIÁVEIS DE AMBIENTE (PADRÃO OFICINA)
 # ============================================================
 
 VERIFY_TOKEN = os.getenv("VERIFY_TOKEN")
-WA_PHONE_NUMBER_ID = os.getenv("WA_PHONE_NUMBER_ID")
 WA_ACCESS_TOKEN = os.getenv("WA_ACCESS_TOKEN")
 
+# "fila"   → responde 200 na hora e processa em background (padrão)
+# "inline" → processa dentro da requisição (comportamento antigo)
+WEBHOOK_MODO = os.getenv("WEBHOOK_MODO", "fila").strip().lower()
+METRICAS_TOKEN = os.getenv("METRICAS_TOKEN", "").strip()
+
+# ============================================================
+# FILA DE INGESTÃO (uma raia serial por wa_id)
+# ============================================================
+
+EXECUTOR = ExecutorPorRemetente(nome="webhook")
+
+# Textos em rajada do mesmo paciente viram um único turno (com DEBOUNCE_MS > 0; padrão desligado)
+AGRUPADOR = AgrupadorRajadas(
+    lambda ev: EXECUTOR.submeter(ev.wa_id, processar_mensagem, ev),
+    contadores=responder.CONTADORES,
+)
+
+# Estado de entrega das mensagens enviadas (callbacks de status da Meta)
+ENTREGAS = RegistroEntregas()
+
+# Disparos de campanha que ficaram na outbox de um processo anterior: uma vez
+# por processo (o gunicorn importa este módulo em cada worker)
+agendador().retomar_campanhas()
+
 # ============================================================
 # HOME
 # ============================================================
@@ -65,12 +95,10 @@ def normalizar_dropbox(url):
     return u
 
 # ============================================================
-# ENVIO TEMPLATE (IGUAL OFICINA)
+# ENVIO TEMPLATE (IGUAL OFICINA) — entra na fila de campanha
 # ============================================================
 
-def enviar_template_clinica(numero, imagem_url):
-
-    url = f"https://graph.facebook.com/v20.0/{WA_PHONE_NUMBER_ID}/messages"
+def enviar_template_clinica(numero, imagem_url) -> bool:
 
     payload = {
         "messaging_product": "whatsapp",
@@ -93,13 +121,71 @@ def enviar_template_clinica(numero, imagem_url):
         }
     }
 
-    headers = {
-        "Authorization": f"Bearer {WA_ACCESS_TOKEN}",
-        "Content-Type": "application/json"
-    }
+    # Ritmo controlado pelo agendador: conversas ao vivo têm prioridade
+    return agendador().enfileirar_campanha(payload, tipo="template_disparo")
+
+# ============================================================
+# PROCESSAMENTO DE UMA MENSAGEM (roda no worker da fila)
+# ============================================================
 
-    r = requests.post(url, json=payload, headers=headers, timeout=30)
-    print("📤 TEMPLATE:", r.status_code, r.text)
+def processar_mensagem(ev: EventoEntrada):
+
+    msg = ev.msg
+    numero = ev.wa_id
+
+    texto = ""
+
+    # TEXTO NORMAL
+    if msg.get("type") == "text":
+        texto = msg.get("text", {}).get("body", "").strip()
+
+    # INTERACTIVE
+    elif msg.get("type") == "interactive":
+        interactive = msg.get("interactive", {})
+        tipo = interactive.get("type")
+
+        if tipo == "button_reply":
+            texto = interactive["button_reply"].get("id") or interactive["button_reply"].get("title")
+
+        elif tipo == "list_reply":
+            texto = interactive["list_reply"].get("id") or interactive["list_reply"].get("title")
+
+    # BOTÃO TEMPLATE
+    elif msg.get("type") == "button":
+        texto = msg.get("button", {}).get("text")
+
+    # ÁUDIO: transcreve via Groq Whisper
+    elif msg.get("type") == "audio":
+        try:
+            from transcrever_audio import transcrever_audio
+            media_id = (msg.get("audio") or {}).get("id", "")
+            if media_id:
+                texto = transcrever_audio(media_id, WA_ACCESS_TOKEN)
+                if texto:
+                    msg = dict(msg)
+                    msg["type"] = "text"
+                    msg["text"] = {"body": texto}
+                    msg["_audio_transcricao"] = True
+                print(f"🎙️ Áudio transcrito: {texto!r}")
+        except Exception as e:
+            print("❌ Erro ao transcrever áudio:", e)
+
+    # IMAGEM — resposta direta
+    elif msg.get("type") == "image":
+        responder._send_text(
+            numero,
+            "Recebemos sua imagem! 📸\n\n"
+            "Infelizmente não consigo visualizar fotos por aqui.\n\n"
+            "Pode descrever em texto o que você precisa? Será um prazer ajudar! 😊"
+        )
+        return
+
+    if texto and len(texto.strip()) > 0:
+
+        print(f"👉 RECEBIDO: {texto}")
+        print("📞 ENVIANDO PARA RESPONDER:", numero)
+
+        responder.responder_mensagem(msg, numero, ev.nome)
 
 # ============================================================
 # WEBHOOK POST
@@ -113,6 +199,11 @@ def webhook():
     except:
         data = {}
 
+    # ===== STATUS (sent/delivered/read/failed) — caminho rápido =====
+    if so_status(data):
+        ENTREGAS.registrar_payload(data)
+        return "OK", 200
+
     print("📩 PAYLOAD RECEBIDO:")
     print(data)
 
@@ -123,8 +214,9 @@ def webhook():
         imagem = normalizar_dropbox(data.get("imagem_url"))
 
         if numero and imagem:
-            enviar_template_clinica(numero, imagem)
-            print("🚀 DISPARO EXECUTADO")
+            if not enviar_template_clinica(numero, imagem):
+                return "OCUPADO", 503
+            print("🚀 DISPARO ENFILEIRADO")
             return "OK", 200
         else:
             return "ERRO", 400
@@ -133,97 +225,56 @@ def webhook():
     if "entry" not in data:
         return "OK", 200
 
-    for entry in data["entry"]:
-        for change in entry.get("changes", []):
-            value = change.get("value", {})
-            messages = value.get("messages")
-            contacts = value.get("contacts")
-
-            if not messages or not contacts:
-                continue
-
-            msg = messages[0]
+    # Payload misto: também contabiliza os status que vierem junto
+    ENTREGAS.registrar_payload(data)
 
-            if "from" not in msg:
-                continue
+    # Todas as mensagens de todos os entries/changes (a Meta agrupa entregas)
+    for ev in extrair_eventos(data):
 
-            message_id = msg.get("id")
+        if ev.message_id and not MENSAGENS_PROCESSADAS.marcar_se_novo(ev.message_id):
+            continue
 
-            if message_id in MENSAGENS_PROCESSADAS:
-                continue
+        if WEBHOOK_MODO != "fila":
+            processar_mensagem(ev)
+            continue
 
-            MENSAGENS_PROCESSADAS.add(message_id)
+        # Fila cheia: libera o id e devolve 503 para a Meta reenviar depois
+        # (as mensagens já enfileiradas deste lote serão barradas pelo dedup)
+        if not AGRUPADOR.adicionar(ev):
+            if ev.message_id:
+                MENSAGENS_PROCESSADAS.esquecer(ev.message_id)
+            return "OCUPADO", 503
 
-            numero = msg.get("from") or contacts[0].get("wa_id")
-
-            if not numero:
-                print("⚠️ Número não identificado")
-                continue
-
-            nome = contacts[0].get("profile", {}).get("name", "Cliente")
-
-            texto = ""
-
-            # TEXTO NORMAL
-            if msg.get("type") == "text":
-                texto = msg.get("text", {}).get("body", "").strip()
-
-            # INTERACTIVE
-            elif msg.get("type") == "interactive":
-                interactive = msg.get("interactive", {})
-                tipo = interactive.get("type")
-
-                if tipo == "button_reply":
-                    texto = interactive["button_reply"].get("id") or interactive["button_reply"].get("title")
-
-                elif tipo == "list_reply":
-                    texto = interactive["list_reply"].get("id") or interactive["list_reply"].get("title")
-
-            # BOTÃO TEMPLATE
-            elif msg.get("type") == "button":
-                texto = msg.get("button", {}).get("text")
-
-            # ÁUDIO: transcreve via Groq Whisper
-            elif msg.get("type") == "audio":
-                try:
-                    from transcrever_audio import transcrever_audio
-                    media_id = (msg.get("audio") or {}).get("id", "")
-                    if media_id:
-                        texto = transcrever_audio(media_id, WA_ACCESS_TOKEN)
-                        if texto:
-                            msg = dict(msg)
-                            msg["type"] = "text"
-                            msg["text"] = {"body": texto}
-                            msg["_audio_transcricao"] = True
-                        print(f"🎙️ Áudio transcrito: {texto!r}")
-                except Exception as e:
-                    print("❌ Erro ao transcrever áudio:", e)
-
-            # IMAGEM — resposta direta
-            elif msg.get("type") == "image":
-                responder._send_text(
-                    numero,
-                    "Recebemos sua imagem! 📸\n\n"
-                    "Infelizmente não consigo visualizar fotos por aqui.\n\n"
-                    "Pode descrever em texto o que você precisa? Será um prazer ajudar! 😊"
-                )
-                continue
-
-            if texto and len(texto.strip()) > 0:
-
-                print(f"👉 RECEBIDO: {texto}")
-                print("📞 ENVIANDO PARA RESPONDER:", numero)
+    return "OK", 200
 
-                responder.responder_evento_mensagem({
-                    "changes": [{
-                        "value": {
-                            "messages": [msg],
-                            "contacts": contacts
-                        }
-                    }]
-                })
+# ============================================================
+# MÉTRICAS (fila de ingestão)
+# ============================================================
 
-    return "OK", 200
+@app.route("/metricas", methods=["GET"])
+def metricas():
+    if METRICAS_TOKEN and request.args.get("token") != METRICAS_TOKEN:
+        return "Erro", 403
+    return jsonify({
+        "modo": WEBHOOK_MODO,
+        "executor": EXECUTOR.metricas(),
+        "dedup": MENSAGENS_PROCESSADAS.metricas(),
+        "entregas": ENTREGAS.metricas(),
+        "rajadas": AGRUPADOR.metricas(),
+        "whatsapp": cliente_wa().metricas(),
+        "envios": agendador().metricas(),
+        "lote_texto_botoes": responder.LOTE.metricas(),
+        "catalogo": responder.CATALOGO.metricas(),
+        "sheets": responder.FILA_SHEETS.metricas(),
+        "acessos": responder.ACESSOS.metricas(),
+        "solicitacoes": responder.SOLICITACOES.metricas(),
+        "sessoes": {
+            "backend": responder.ARMAZEM.nome,
+            "sess": responder.SESS.metricas(),
+            "ultimo_acesso": responder.ULTIMO_ACESSO.metricas(),
+            "hist_ia": responder._HIST_IA.metricas(),
+        },
+    }), 200
 
 # ============================================================
 # RUN
@@ -0,0 +1,156 @@
+# whatsapp_client.py — cliente único da WhatsApp Cloud API (Graph) com conexão keep-alive
+# ==============================================================================
+import os, json, threading, time
+from typing import Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import NewConnectionError
+
+from metricas import Estatistica
+
+GRAPH_VERSAO       = os.getenv("GRAPH_VERSAO", "v20.0").strip()
+WA_POOL_MAX        = int(os.getenv("WA_POOL_MAX", "16"))     # ≥ número de workers
+WA_TIMEOUT_CONEXAO = float(os.getenv("WA_TIMEOUT_CONEXAO", "5"))
+WA_TIMEOUT_LEITURA = float(os.getenv("WA_TIMEOUT_LEITURA", "30"))
+
+
+class RespostaEnvio:
+    """
+    Resultado padronizado de um POST /messages (nunca levanta exceção).
+    nao_enviado=True só quando a conexão nem abriu (o pedido certamente não saiu);
+    um timeout de leitura fica False: a Meta pode ter recebido a mensagem.
+    """
+    __slots__ = ("ok", "status_code", "message_id", "erro_codigo", "erro_msg", "texto", "latencia_ms",
+                 "nao_enviado")
+
+    def __init__(self, ok=False, status_code=0, message_id="", erro_codigo=None, erro_msg="",
+                 texto="", latencia_ms=0.0, nao_enviado=False):
+        self.ok = ok
+        self.status_code = status_code
+        self.message_id = message_id
+        self.erro_codigo = erro_codigo
+        self.erro_msg = erro_msg
+        self.texto = texto
+        self.latencia_ms = latencia_ms
+        self.nao_enviado = nao_enviado
+
+    def __repr__(self):
+        if self.ok:
+            return f"RespostaEnvio(ok, {self.status_code}, {self.message_id!r})"
+        return f"RespostaEnvio(erro, {self.status_code}, {self.erro_codigo}, {self.erro_msg!r})"
+
+
+def _conexao_recusada(e: requests.RequestException) -> bool:
+    """Falhou antes de enviar o corpo (DNS, conexão recusada, timeout de conexão)?"""
+    if isinstance(e, requests.ConnectTimeout):
+        return True
+    if isinstance(e, requests.ConnectionError):
+        causa = e.args[0] if e.args else None
+        return isinstance(getattr(causa, "reason", causa), NewConnectionError)
+    return False
+
+
+class WhatsAppClient:
+    """
+    Dono de uma requests.Session com pool de conexões para graph.facebook.com:
+    o handshake TCP/TLS é feito uma vez e reaproveitado por todos os envios.
+    """
+
+    def __init__(self, access_token: str, phone_number_id: str, versao: str = GRAPH_VERSAO,
+                 pool_max: int = WA_POOL_MAX):
+        self.access_token = access_token
+        self.phone_number_id = phone_number_id
+        self.url = f"https://graph.facebook.com/{versao}/{phone_number_id}/messages" if phone_number_id else ""
+
+        self.sessao = requests.Session()
+        adaptador = HTTPAdapter(pool_connections=2, pool_maxsize=pool_max, max_retries=0)
+        self.sessao.mount("https://", adaptador)
+        self.sessao.headers.update({
+            "Authorization": f"Bearer {access_token}",
+            "Content-Type": "application/json",
+        })
+
+        self._lock = threading.Lock()
+        self._latencias = {}
+        self._status = {}
+
+    def configurado(self) -> bool:
+        return bool(self.access_token and self.phone_number_id)
+
+    # ===== Envio ==============================================================
+    def enviar(self, payload, tipo: Optional[str] = None, timeout: Optional[float] = None) -> RespostaEnvio:
+        """payload: dict, ou bytes já serializados (catálogo pré-renderizado)."""
+        if isinstance(payload, (bytes, bytearray)):
+            corpo = payload
+            tipo = tipo or "text"
+        else:
+            corpo = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+            tipo = tipo or payload.get("type") or "text"
+        inicio = time.monotonic()
+        try:
+            r = self.sessao.post(self.url, data=corpo,
+                                 timeout=(WA_TIMEOUT_CONEXAO, timeout or WA_TIMEOUT_LEITURA))
+        except requests.RequestException as e:
+            resp = RespostaEnvio(ok=False, erro_msg=str(e), latencia_ms=(time.monotonic() - inicio) * 1000,
+                                 nao_enviado=_conexao_recusada(e))
+            self._registrar(tipo, resp)
+            return resp
+
+        resp = self._interpretar(r, (time.monotonic() - inicio) * 1000)
+        self._registrar(tipo, resp)
+        return resp
+
+    @staticmethod
+    def _interpretar(r, latencia_ms: float) -> RespostaEnvio:
+        try:
+            j = r.json()
+        except ValueError:
+            j = {}
+        if 200 <= r.status_code < 300:
+            mid = ((j.get("messages") or [{}])[0]).get("id", "")
+            return RespostaEnvio(ok=True, status_code=r.status_code, message_id=mid,
+                                 texto=r.text, latencia_ms=latencia_ms)
+        err = j.get("error") or {}
+        return RespostaEnvio(ok=False, status_code=r.status_code, erro_codigo=err.get("code"),
+                             erro_msg=err.get("message") or r.text[:300], texto=r.text,
+                             latencia_ms=latencia_ms)
+
+    # ===== Observabilidade ====================================================
+    def _registrar(self, tipo: str, resp: RespostaEnvio):
+        with self._lock:
+            est = self._latencias.get(tipo)
+            if est is None:
+                est = self._latencias[tipo] = Estatistica()
+            chave = f"{tipo}:{resp.status_code}"
+            self._status[chave] = self._status.get(chave, 0) + 1
+        est.registrar(resp.latencia_ms)
+
+    def metricas(self) -> dict:
+        with self._lock:
+            latencias = dict(self._latencias)
+            status = dict(self._status)
+        return {
+            "latencia_ms_por_tipo": {t: e.resumo() for t, e in latencias.items()},
+            "respostas_por_tipo_status": status,
+        }
+
+
+# ===== Instância compartilhada ===============================================
+_CLIENTE = None
+_CLIENTE_LOCK = threading.Lock()
+
+
+def cliente() -> WhatsAppClient:
+    """
+    Cliente único do processo. Criado no primeiro uso (depois do load_dotenv
+    e do fork do gunicorn), com as mesmas variáveis de sempre.
+    """
+    global _CLIENTE
+    if _CLIENTE is None:
+        with _CLIENTE_LOCK:
+            if _CLIENTE is None:
+                token = os.getenv("WA_ACCESS_TOKEN", "").strip() or os.getenv("ACCESS_TOKEN", "").strip()
+                phone = os.getenv("WA_PHONE_NUMBER_ID", "").strip() or os.getenv("PHONE_NUMBER_ID", "").strip()
+                _CLIENTE = WhatsAppClient(token, phone)
+    return _CLIENTE